@@ -1,8 +1,17 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 import pandas as pd
 import psycopg2
 from backtesting import Backtest, Strategy
 from backtesting.lib import crossover
 import talib
+from bar_cache import BarCache
+from indicator_cache import INDICATOR_CACHE, merge_stats
+from result_store import ResultStore, params_key
+from search import ParameterSpace
 
 # Database connection parameters
 conn_params = {
@@ -13,34 +22,180 @@ conn_params = {
     'port': '5432'
 }
 
-# Fetch 15-minute data from TimescaleDB
-def fetch_15min_data(symbols, start, end):
-    conn = psycopg2.connect(**conn_params)
-    query = """
-        SELECT timestamp, symbol, open, high, low, close, volume
+# Output columns of the bar loaders, in Backtest's naming
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Bucket minute bars in the database with TimescaleDB's time_bucket
+BUCKET_QUERY = """
+    SELECT time_bucket(%s, timestamp) AS bucket, symbol,
+           first(open, timestamp), MAX(high), MIN(low), last(close, timestamp), SUM(volume)::BIGINT
+    FROM alpaca_minute_data
+    WHERE timestamp >= %s AND timestamp <= %s
+    AND symbol = ANY(%s)
+    GROUP BY symbol, bucket
+    ORDER BY symbol COLLATE "C", bucket;
+"""
+
+# Raw minute bars, for databases without TimescaleDB (bucketed in pandas instead)
+MINUTE_QUERY = """
+    SELECT timestamp, symbol, open, high, low, close, volume
+    FROM alpaca_minute_data
+    WHERE timestamp >= %s AND timestamp <= %s
+    AND symbol = ANY(%s)
+    ORDER BY symbol COLLATE "C", timestamp;
+"""
+
+# Continuous aggregates of alpaca_minute_data kept by data_retrieval.py (see create_rollups),
+# by timeframe
+ROLLUP_VIEWS = {timeframe: f"alpaca_minute_data_{timeframe}" for timeframe in ('5min', '15min', '1h', '1d')}
+
+# Pre-aggregated bars from a rollup, returning the same rows as BUCKET_QUERY over the
+# same range: whole buckets inside [start, end] are an index range scan of the view, and
+# the partial buckets at either end (minutes from start to the first bucket boundary, and
+# from the last boundary up to and including end) are bucketed from the minute bars.
+# Parameters come from rollup_params. The union is wrapped in a subquery because an
+# ORDER BY on a UNION only takes output column names, not the COLLATE expression.
+ROLLUP_QUERY = """
+    SELECT bucket, symbol, open, high, low, close, volume FROM (
+        SELECT bucket, symbol, open, high, low, close, volume
+        FROM {view}
+        WHERE bucket >= %s AND bucket < %s
+        AND symbol = ANY(%s)
+        UNION ALL
+        SELECT time_bucket(%s, timestamp) AS bucket, symbol,
+               first(open, timestamp), MAX(high), MIN(low), last(close, timestamp), SUM(volume)::BIGINT
         FROM alpaca_minute_data
-        WHERE timestamp >= %s AND timestamp <= %s
+        WHERE timestamp >= %s AND timestamp <= %s AND (timestamp < %s OR timestamp >= %s)
         AND symbol = ANY(%s)
-        ORDER BY timestamp;
-    """
+        GROUP BY symbol, bucket
+    ) bars
+    ORDER BY symbol COLLATE "C", bucket;
+"""
+
+# A time as a UTC Timestamp, naive times taken as UTC (as in data_retrieval.py). Every
+# loader query gets its range through this, so the result doesn't depend on the database
+# session's timezone.
+def to_utc(ts):
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+# ROLLUP_QUERY parameters for [start, end]. Buckets are aligned like time_bucket's for
+# widths up to a day; when the range lies within one bucket, the view part is empty and
+# every minute is bucketed directly.
+def rollup_params(start, end, freq, symbols):
+    width = pd.Timedelta(freq)
+    start, end = to_utc(start), to_utc(end)
+    first, last = start.ceil(width), end.floor(width)
+    symbols = list(symbols)
+    return (first, last, symbols, width.to_pytimedelta(), start, end, first, last, symbols)
+
+# Vectorized resample of minute bars for every symbol in the frame at once
+def resample_bars(df, freq='15min'):
+    return df.set_index('timestamp').groupby(['symbol', pd.Grouper(freq=freq)]).agg(
+        Open=('Open', 'first'),
+        High=('High', 'max'),
+        Low=('Low', 'min'),
+        Close=('Close', 'last'),
+        Volume=('Volume', 'sum')
+    ).dropna()
+
+# Stream bars for all symbols with one query through a named (server-side) cursor.
+# Rows arrive ordered by symbol in chunks of chunk_size, and each symbol's bars are
+# yielded as soon as the next symbol starts, so memory is bounded by one symbol's
+# bars plus one chunk rather than the whole minute history.
+# Timeframes with a rollup (ROLLUP_VIEWS) are read from it; others, or rollup=False, are
+# bucketed from the minute bars in the database or, with aggregate_in_db=False, in pandas.
+def stream_15min_bars(symbols, start, end, freq='15min', chunk_size=50000, aggregate_in_db=True, rollup=True):
+    conn = psycopg2.connect(**conn_params)
+    cursor = conn.cursor(name='stream_15min_bars')
+    cursor.itersize = chunk_size
+    start, end = to_utc(start), to_utc(end)
+    try:
+        if aggregate_in_db and rollup and freq in ROLLUP_VIEWS:
+            cursor.execute(ROLLUP_QUERY.format(view=ROLLUP_VIEWS[freq]), rollup_params(start, end, freq, symbols))
+        elif aggregate_in_db:
+            cursor.execute(BUCKET_QUERY, (pd.Timedelta(freq).to_pytimedelta(), start, end, list(symbols)))
+        else:
+            cursor.execute(MINUTE_QUERY, (start, end, list(symbols)))
+
+        current, parts, carry = None, [], None
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if rows:
+                df = pd.DataFrame.from_records(rows, columns=['timestamp', 'symbol'] + BAR_COLUMNS)
+                df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+            if aggregate_in_db:
+                if not rows:
+                    break
+                df = df.set_index(['symbol', 'timestamp'])
+            else:
+                if carry is not None:
+                    df = pd.concat([carry, df]) if rows else carry
+                if rows:
+                    # Hold back the last symbol's last bucket, its minutes may continue in the next chunk
+                    last_bucket = df['timestamp'].iat[-1].floor(freq)
+                    tail = (df['symbol'] == df['symbol'].iat[-1]) & (df['timestamp'] >= last_bucket)
+                    carry, df = df[tail], df[~tail]
+                elif carry is None:
+                    break
+                else:
+                    carry = None
+                df = resample_bars(df, freq) if len(df) else None
+
+            if df is not None:
+                for symbol, part in df.groupby(level='symbol', sort=False):
+                    if symbol != current and parts:
+                        yield current, pd.concat(parts).droplevel('symbol')
+                        parts = []
+                    current = symbol
+                    parts.append(part)
+            if not rows:
+                break
+        if parts:
+            yield current, pd.concat(parts).droplevel('symbol')
+    finally:
+        cursor.close()
+        conn.close()
+
+# Fetch 15-minute data from TimescaleDB
+def fetch_15min_data(symbols, start, end, **kwargs):
     df_list = []
-    for symbol in symbols:
-        df = pd.read_sql_query(query, conn, params=(start, end, [symbol]))
-        df.set_index('timestamp', inplace=True)
-        df.index = pd.to_datetime(df.index)
-        df.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'volume': 'Volume'}, inplace=True)
+    for symbol, df in stream_15min_bars(symbols, start, end, **kwargs):
         df['symbol'] = symbol  # Ensure the symbol column is added
-        df = df.resample('15min').agg({
-            'Open': 'first',
-            'High': 'max',
-            'Low': 'min',
-            'Close': 'last',
-            'Volume': 'sum',
-            'symbol': 'last'  # Retain the symbol after resampling
-        }).dropna()
         df_list.append(df)
-    conn.close()
-    return pd.concat(df_list)
+    data = pd.concat(df_list)
+    data['symbol'] = data['symbol'].astype('category')
+    return data
+
+# Bars of one timeframe for several symbols (same shape as fetch_15min_data), read from
+# the rollup when the timeframe has one, e.g. fetch_bars(symbols, start, end, '1h')
+def fetch_bars(symbols, start, end, timeframe='15min'):
+    return fetch_15min_data(symbols, start, end, freq=timeframe)
+
+# Fetch one symbol's bars, in the loader shape BarCache expects
+def load_symbol_bars(symbol, start, end, freq='15min'):
+    for _, df in stream_15min_bars([symbol], start, end, freq):
+        return df
+    return pd.DataFrame(columns=BAR_COLUMNS)
+
+# Time up to which symbol's minute bars are stored (one minute past the last one), or
+# None if there are none; BarCache's high_water, so coverage never runs past the ingest
+def minute_high_water(symbol):
+    conn = psycopg2.connect(**conn_params)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(timestamp) FROM alpaca_minute_data WHERE symbol = %s;", (symbol,))
+        last = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        conn.close()
+    return to_utc(last) + pd.Timedelta(minutes=1) if last is not None else None
+
+# talib indicators memoized across parameter sweeps, so e.g. the EMA for one
+# ema_window is computed once per symbol rather than once per ADX setting
+EMA = INDICATOR_CACHE(talib.EMA)
+ADX = INDICATOR_CACHE(talib.ADX)
+BBANDS = INDICATOR_CACHE(talib.BBANDS)
 
 # Define trend-following strategy using EMA and ADX
 class EMADXStrategy(Strategy):
@@ -49,8 +204,8 @@ class EMADXStrategy(Strategy):
     adx_threshold = 25
 
     def init(self):
-        self.ema = self.I(talib.EMA, self.data.Close, self.ema_window)
-        self.adx = self.I(talib.ADX, self.data.High, self.data.Low, self.data.Close, timeperiod=self.adx_window)
+        self.ema = self.I(EMA, self.data.Close, self.ema_window)
+        self.adx = self.I(ADX, self.data.High, self.data.Low, self.data.Close, timeperiod=self.adx_window)
 
     def next(self):
         if self.adx[-1] > self.adx_threshold and crossover(self.data.Close, self.ema):
@@ -64,7 +219,7 @@ class BollingerBandsStrategy(Strategy):
     num_std_dev = 2
 
     def init(self):
-        upper, middle, lower = self.I(talib.BBANDS, self.data.Close, timeperiod=self.window, nbdevup=self.num_std_dev, nbdevdn=self.num_std_dev, matype=0)
+        upper, middle, lower = self.I(BBANDS, self.data.Close, timeperiod=self.window, nbdevup=self.num_std_dev, nbdevdn=self.num_std_dev, matype=0)
         self.upper_band = upper
         self.lower_band = lower
 
@@ -74,51 +229,439 @@ class BollingerBandsStrategy(Strategy):
         elif self.data.Close[-1] > self.upper_band[-1]:
             self.sell()
 
-# Function to optimize EMADXStrategy
-def optimize_emadx_strategy(df):
+# Cash and commission every optimization backtest runs with
+BACKTEST_KWARGS = {'cash': 10000, 'commission': .002}
+
+# Parameter grids searched by the optimizers, in evaluation order
+EMADX_GRID = [
+    {'ema_window': ema_window, 'adx_window': adx_window, 'adx_threshold': adx_threshold}
+    for ema_window in range(10, 50, 5)
+    for adx_window in range(10, 30, 5)
+    for adx_threshold in range(20, 40, 5)
+]
+BOLLINGER_GRID = [
+    {'window': window, 'num_std_dev': num_std_dev}
+    for window in range(10, 50, 5)
+    for num_std_dev in range(1, 4)
+]
+
+# Strategy class and parameter grid by name, as used in the results dict
+STRATEGY_GRIDS = {
+    'emadx': (EMADXStrategy, EMADX_GRID),
+    'bollinger': (BollingerBandsStrategy, BOLLINGER_GRID)
+}
+
+# Backtest every parameter set of a grid over df, in grid order, yielding (params, stats).
+# Parameters are passed to Backtest.run rather than set on the class, so runs don't leak state.
+# With a ResultStore, parameter sets already stored for the same symbol, bars, strategy code,
+# cash and commission come from the store (scalar stats only) and just the rest are run and
+# stored.
+def run_grid(df, strategy, grid, store=None, symbol=''):
+    stored = {}
+    if store is not None:
+        data_key = store.data_key(df)
+        stored = store.lookup(symbol, data_key, strategy, grid, **BACKTEST_KWARGS)
+    for params in grid:
+        stats = stored.get(params_key(params))
+        if stats is None:
+            bt = Backtest(df, strategy, **BACKTEST_KWARGS)
+            stats = bt.run(**params)
+            if store is not None:
+                store.put(symbol, data_key, strategy, params, stats, **BACKTEST_KWARGS)
+        yield params, stats
+    if store is not None:
+        store.commit()
+
+# Best parameter set of a grid (first highest return) and its stats. A winner that came
+# from the store only has the scalar stats, so it is re-run to return the full Backtest
+# result (_trades, _equity_curve, _strategy), the same as without a store.
+def best_of_grid(df, strategy, grid, store=None, symbol=''):
     best_result = None
     best_params = None
-    for ema_window in range(10, 50, 5):
-        for adx_window in range(10, 30, 5):
-            for adx_threshold in range(20, 40, 5):
-                EMADXStrategy.ema_window = ema_window
-                EMADXStrategy.adx_window = adx_window
-                EMADXStrategy.adx_threshold = adx_threshold
-                bt = Backtest(df, EMADXStrategy, cash=10000, commission=.002)
-                stats = bt.run()
-                if best_result is None or stats['Return [%]'] > best_result['Return [%]']:
-                    best_result = stats
-                    best_params = {'ema_window': ema_window, 'adx_window': adx_window, 'adx_threshold': adx_threshold}
+    for params, stats in run_grid(df, strategy, grid, store, symbol):
+        if best_result is None or stats['Return [%]'] > best_result['Return [%]']:
+            best_result = stats
+            best_params = params
+    if best_result is not None and '_strategy' not in best_result:
+        best_result = Backtest(df, strategy, **BACKTEST_KWARGS).run(**best_params)
     return best_result, best_params
 
+# Function to optimize EMADXStrategy
+def optimize_emadx_strategy(df, store=None, symbol=''):
+    return best_of_grid(df, EMADXStrategy, EMADX_GRID, store, symbol)
+
 # Function to optimize BollingerBandsStrategy
-def optimize_bollinger_strategy(df):
-    best_result = None
-    best_params = None
-    for window in range(10, 50, 5):
-        for num_std_dev in range(1, 4):
-            BollingerBandsStrategy.window = window
-            BollingerBandsStrategy.num_std_dev = num_std_dev
-            bt = Backtest(df, BollingerBandsStrategy, cash=10000, commission=.002)
-            stats = bt.run()
-            if best_result is None or stats['Return [%]'] > best_result['Return [%]']:
-                best_result = stats
-                best_params = {'window': window, 'num_std_dev': num_std_dev}
-    return best_result, best_params
+def optimize_bollinger_strategy(df, store=None, symbol=''):
+    return best_of_grid(df, BollingerBandsStrategy, BOLLINGER_GRID, store, symbol)
+
+# UTC epoch nanoseconds of a bar frame's index
+def index_to_ns(index):
+    index = pd.DatetimeIndex(index)
+    index = index.tz_localize('UTC') if index.tz is None else index.tz_convert('UTC')
+    return np.asarray(index.tz_localize(None), dtype='datetime64[ns]').view(np.int64)
+
+# Copy every symbol's bars into one shared memory block: per symbol an int64 timestamp
+# column followed by an (n x 5) float64 OHLCV block. Returns the block and
+# {symbol: (offset, n)} so workers can map the same bytes without pickling frames.
+def share_bars(frames):
+    size = sum(len(df) * 6 * 8 for df in frames.values())
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    layout = {}
+    offset = 0
+    for symbol, df in frames.items():
+        n = len(df)
+        np.ndarray((n,), dtype=np.int64, buffer=shm.buf, offset=offset)[:] = index_to_ns(df.index)
+        np.ndarray((n, 5), dtype=np.float64, buffer=shm.buf, offset=offset + n * 8)[:] = df[BAR_COLUMNS].to_numpy(np.float64)
+        layout[symbol] = (offset, n)
+        offset += n * 6 * 8
+    return shm, layout
+
+# Per-process state of the optimization workers
+_worker_shm = None
+_worker_layout = {}
+_worker_frames = {}
+
+def _init_worker(shm_name, layout):
+    global _worker_shm, _worker_layout
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_layout = layout
+    _worker_frames.clear()
+
+# Build a symbol's DataFrame over the shared block once per worker
+def _worker_frame(symbol):
+    if symbol not in _worker_frames:
+        offset, n = _worker_layout[symbol]
+        index = np.ndarray((n,), dtype=np.int64, buffer=_worker_shm.buf, offset=offset)
+        values = np.ndarray((n, 5), dtype=np.float64, buffer=_worker_shm.buf, offset=offset + n * 8)
+        index = pd.DatetimeIndex(pd.to_datetime(index, unit='ns', utc=True), name='timestamp')
+        _worker_frames[symbol] = pd.DataFrame(values, index=index, columns=BAR_COLUMNS, copy=False)
+    return _worker_frames[symbol]
+
+# Run one (symbol, strategy, params) backtest and return its scalar stats,
+# along with the worker's pid and indicator cache counters
+def _run_job(job):
+    symbol, name, params = job
+    strategy = STRATEGY_GRIDS[name][0]
+    stats = Backtest(_worker_frame(symbol), strategy, **BACKTEST_KWARGS).run(**params)
+    stats = {key: value for key, value in stats.items() if not key.startswith('_')}
+    return stats, os.getpid(), INDICATOR_CACHE.stats()
+
+# Optimize every strategy for every symbol on a process pool of `workers` processes.
+# Jobs are (symbol, strategy, param-set) and are handed out in grid order in chunks,
+# so consecutive jobs of a symbol tend to land on the same worker. The best params are
+# picked with the same first-highest-return rule as the serial loops, and the winners
+# are re-run here so the returned stats are identical to the serial run.
+# With a ResultStore, stored jobs are not run at all, and the new results are stored.
+def optimize_parallel(frames, workers=None, strategies=('emadx', 'bollinger'), store=None):
+    workers = workers or os.cpu_count()
+    grid_jobs = [(symbol, name, params)
+                 for symbol in frames
+                 for name in strategies
+                 for params in STRATEGY_GRIDS[name][1]]
+
+    stored = {}
+    if store is not None:
+        data_keys = {symbol: store.data_key(df) for symbol, df in frames.items()}
+        for symbol in frames:
+            for name in strategies:
+                strategy, grid = STRATEGY_GRIDS[name]
+                for key, stats in store.lookup(symbol, data_keys[symbol], strategy, grid, **BACKTEST_KWARGS).items():
+                    stored[(symbol, name, key)] = stats
+    jobs = [(symbol, name, params) for symbol, name, params in grid_jobs
+            if (symbol, name, params_key(params)) not in stored]
+
+    if jobs:
+        shm, layout = share_bars(frames)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shm.name, layout)) as executor:
+                chunksize = max(1, len(jobs) // (workers * 4))
+                job_results = list(executor.map(_run_job, jobs, chunksize=chunksize))
+        finally:
+            shm.close()
+            shm.unlink()
+
+        worker_cache_stats = {pid: cache_stats for _, pid, cache_stats in job_results}
+        print(f"Indicator cache across workers: {merge_stats(worker_cache_stats.values())}")
+
+        for (symbol, name, params), (stats, _, _) in zip(jobs, job_results):
+            stored[(symbol, name, params_key(params))] = stats
+            if store is not None:
+                store.put(symbol, data_keys[symbol], STRATEGY_GRIDS[name][0], params, stats, **BACKTEST_KWARGS)
+        if store is not None:
+            store.commit()
+
+    best = {}
+    for symbol, name, params in grid_jobs:
+        stats = stored[(symbol, name, params_key(params))]
+        current = best.get((symbol, name))
+        if current is None or stats['Return [%]'] > current[0]['Return [%]']:
+            best[(symbol, name)] = (stats, params)
 
-# Backtest and optimize each strategy for each stock
-def run_backtests_and_optimization(symbols, start, end):
-    data = fetch_15min_data(symbols, start, end)
     results = {}
+    for (symbol, name), (_, params) in best.items():
+        bt = Backtest(frames[symbol], STRATEGY_GRIDS[name][0], **BACKTEST_KWARGS)
+        results.setdefault(symbol, {})[name] = {'result': bt.run(**params), 'params': params}
+    return results
 
-    for symbol in symbols:
-        df = data[data['symbol'] == symbol].drop(columns='symbol')
-        
+# Fraction of equity backtesting.py's buy()/sell() commit by default
+FULL_EQUITY = 1 - sys.float_info.epsilon
+
+# Stats the vectorized engine reproduces, checked by validate_vectorized
+VALIDATED_STATS = ['Return [%]', 'Equity Final [$]', 'Equity Peak [$]', 'Max. Drawdown [%]', 'Buy & Hold Return [%]']
+
+# Index of the first non-NaN value in each column, like Backtest's warm-up detection
+def _first_valid(values):
+    return np.isnan(values).argmin(axis=0)
+
+# EMA-ADX rules for every parameter set at once. Returns a (bars x param-sets) array of
+# +1 where next() would call buy() and -1 where it would call sell(), and the bar each
+# column's Backtest would start calling next() at.
+def emadx_signals(df, grid):
+    close = df['Close'].to_numpy(np.float64)
+    high = df['High'].to_numpy(np.float64)
+    low = df['Low'].to_numpy(np.float64)
+    emas = {w: EMA(close, w) for w in {p['ema_window'] for p in grid}}
+    adxs = {w: ADX(high, low, close, timeperiod=w) for w in {p['adx_window'] for p in grid}}
+    ema = np.column_stack([emas[p['ema_window']] for p in grid])
+    adx = np.column_stack([adxs[p['adx_window']] for p in grid])
+    threshold = np.array([p['adx_threshold'] for p in grid], dtype=np.float64)
+
+    c = close[:, None]
+    cross_up = np.zeros(ema.shape, dtype=bool)
+    cross_down = np.zeros(ema.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        cross_up[1:] = (c[:-1] < ema[:-1]) & (c[1:] > ema[1:])
+        cross_down[1:] = (ema[:-1] < c[:-1]) & (ema[1:] > c[1:])
+        buy = (adx > threshold) & cross_up
+    sell = ~buy & cross_down
+
+    starts = 1 + np.maximum(_first_valid(ema), _first_valid(adx))
+    return buy.astype(np.float64) - sell.astype(np.float64), starts
+
+# Bollinger Bands rules for every parameter set at once, in the same form as emadx_signals
+def bollinger_signals(df, grid):
+    close = df['Close'].to_numpy(np.float64)
+    bands = {
+        (p['window'], p['num_std_dev']): BBANDS(close, timeperiod=p['window'], nbdevup=p['num_std_dev'], nbdevdn=p['num_std_dev'], matype=0)
+        for p in grid
+    }
+    upper = np.column_stack([bands[(p['window'], p['num_std_dev'])][0] for p in grid])
+    lower = np.column_stack([bands[(p['window'], p['num_std_dev'])][2] for p in grid])
+
+    c = close[:, None]
+    with np.errstate(invalid='ignore'):
+        buy = c < lower
+        sell = ~buy & (c > upper)
+
+    starts = 1 + np.maximum(_first_valid(upper), _first_valid(lower))
+    return buy.astype(np.float64) - sell.astype(np.float64), starts
+
+# Signal builders of the vectorized engine by strategy name
+VECTOR_SIGNALS = {
+    'emadx': emadx_signals,
+    'bollinger': bollinger_signals
+}
+
+# Fill one bar's market orders for every parameter set the way backtesting.py's broker
+# does for buy()/sell() with the default size: units = floor(margin available * FULL_EQUITY /
+# (price * (1 + commission))); opposite positions are reduced first, and the remainder
+# only opens if the margin left covers it. Commission is charged on every unit opened or
+# closed. K is cash net of the cost basis of open units, so equity is K + pos * close.
+def _fill_orders(K, pos, side, price, mark, commission):
+    price_with_commission = price * (1 + commission)
+    margin = np.maximum(0.0, K + pos * mark - np.abs(pos) * mark)
+    need = side * np.floor(margin * FULL_EQUITY / price_with_commission)
+
+    closed = np.where(need * pos < 0, np.minimum(np.abs(need), np.abs(pos)), 0.0)
+    delta = -np.sign(pos) * closed
+    K = K - delta * price - closed * price * commission
+    pos = pos + delta
+    need = need - np.sign(need) * closed
+
+    margin = np.maximum(0.0, K + pos * mark - np.abs(pos) * mark)
+    need = np.where(np.abs(need) * price_with_commission <= margin, need, 0.0)
+    return K - need * price - np.abs(need) * price * commission, pos + need
+
+# Step every parameter set through the bars together and return the (bars x param-sets)
+# equity curves. Orders placed on bar i fill at bar i+1's open, a column whose equity
+# drops to zero stops trading, and positions still open at the end stay open, as in
+# Backtest.run with its default finalize_trades=False.
+# Only bars with a pending order in some column are stepped; the state in between is
+# constant, so equity is filled in from the last fill with one vectorized gather.
+def simulate_signals(df, signals, starts, cash=10000, commission=.002):
+    open_ = df['Open'].to_numpy(np.float64)
+    close = df['Close'].to_numpy(np.float64)
+    n, sets = signals.shape
+    if n == 0 or sets == 0:
+        return np.full((n, sets), float(cash))
+
+    bars = np.arange(n)
+    orders = np.where(bars[:, None] >= starts, signals, 0.0)
+    fills = np.flatnonzero(np.any(orders[:-1] != 0, axis=1)) + 1
+
+    K_rows = np.empty((len(fills) + 1, sets))
+    pos_rows = np.empty((len(fills) + 1, sets))
+    K_rows[0] = cash
+    pos_rows[0] = 0.0
+    for j, i in enumerate(fills, 1):
+        K_rows[j], pos_rows[j] = _fill_orders(K_rows[j - 1], pos_rows[j - 1], orders[i - 1], open_[i], close[i], commission)
+
+    state = np.searchsorted(fills, bars, side='right')
+    equity = K_rows[state] + pos_rows[state] * close[:, None]
+    if (equity <= 0).any():
+        return _simulate_bar_by_bar(open_, close, orders, starts, cash, commission)
+    return equity
+
+# Exact per-bar stepping, needed once some column runs out of money and must stop
+def _simulate_bar_by_bar(open_, close, orders, starts, cash, commission):
+    n, sets = orders.shape
+    K = np.full(sets, float(cash))
+    pos = np.zeros(sets)
+    pending = np.zeros(sets)
+    alive = np.ones(sets, dtype=bool)
+    equity = np.full((n, sets), float(cash))
+
+    for i in range(int(starts.min()), n):
+        active = alive & (starts <= i)
+        K, pos = _fill_orders(K, pos, np.where(active, pending, 0.0), open_[i], close[i], commission)
+        value = K + pos * close[i]
+        equity[i] = np.where(active, value, equity[i])
+
+        broke = active & (value <= 0)
+        if broke.any():
+            K[broke] = 0.0
+            pos[broke] = 0.0
+            alive &= ~broke
+            equity[i:, broke] = 0.0
+        pending = np.where(alive, orders[i], 0.0)
+    return equity
+
+# Backtest-style stats for every column of an equity matrix
+def equity_stats(equity, close, starts):
+    peak = np.maximum.accumulate(equity, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drawdown = 1 - equity / peak
+    first_trading_bar = np.minimum(starts - 1, len(close) - 1)
+    return pd.DataFrame({
+        'Equity Final [$]': equity[-1],
+        'Equity Peak [$]': equity.max(axis=0),
+        'Return [%]': (equity[-1] - equity[0]) / equity[0] * 100,
+        'Buy & Hold Return [%]': (close[-1] - close[first_trading_bar]) / close[first_trading_bar] * 100,
+        'Max. Drawdown [%]': -np.nan_to_num(drawdown.max(axis=0)) * 100
+    })
+
+# Evaluate a whole parameter grid for one symbol in a single pass.
+# Returns a DataFrame with one row per parameter set (params + stats) and the
+# (bars x param-sets) equity curves.
+def vectorized_backtest(df, name, grid=None, cash=BACKTEST_KWARGS['cash'], commission=BACKTEST_KWARGS['commission']):
+    grid = grid or STRATEGY_GRIDS[name][1]
+    signals, starts = VECTOR_SIGNALS[name](df, grid)
+    equity = simulate_signals(df, signals, starts, cash, commission)
+    stats = equity_stats(equity, df['Close'].to_numpy(np.float64), starts)
+    return pd.concat([pd.DataFrame(grid), stats], axis=1), equity
+
+# Optimize one strategy with the vectorized engine, then re-run the winner through
+# Backtest so the returned stats are the full backtesting.py report
+def optimize_vectorized(df, name, grid=None):
+    grid = grid or STRATEGY_GRIDS[name][1]
+    stats, _ = vectorized_backtest(df, name, grid)
+    params = grid[int(np.argmax(stats['Return [%]'].to_numpy()))]
+    bt = Backtest(df, STRATEGY_GRIDS[name][0], **BACKTEST_KWARGS)
+    return bt.run(**params), params
+
+# Wider spaces for the adaptive searches, in steps of 1 where the grids step by 5
+SEARCH_SPACES = {
+    'emadx': ParameterSpace({'ema_window': range(5, 100), 'adx_window': range(5, 40), 'adx_threshold': range(10, 50)}),
+    'bollinger': ParameterSpace({'window': range(5, 100), 'num_std_dev': [1, 1.5, 2, 2.5, 3, 3.5]})
+}
+
+# Objective for the searches: a strategy's return on the first `fidelity` fraction of the
+# bars (but at least min_bars), scored with the vectorized engine
+def make_objective(df, name, metric='Return [%]', min_bars=200):
+    def objective(params, fidelity=1.0):
+        bars = df if fidelity >= 1.0 else df.iloc[:max(min_bars, int(len(df) * fidelity))]
+        stats, _ = vectorized_backtest(bars, name, [params])
+        return stats[metric].iat[0]
+    return objective
+
+# Optimize one strategy with an adaptive search (see search.py) over a parameter space.
+# The budget defaults to the number of backtests the fixed grid runs.
+def optimize_search(df, name, search, space=None, budget=None, patience=None, seed=0):
+    space = space or SEARCH_SPACES[name]
+    budget = budget or len(STRATEGY_GRIDS[name][1])
+    found = search.run(space, make_objective(df, name), budget=budget, patience=patience, seed=seed)
+    if found.params is None:
+        raise ValueError(f"Search budget {budget} is too small for a single trial of {type(search).__name__}")
+    bt = Backtest(df, STRATEGY_GRIDS[name][0], **BACKTEST_KWARGS)
+    return bt.run(**found.params), found.params
+
+# Validation mode: run the vectorized engine and backtesting.Backtest on every parameter
+# set (or a random sample of `sample` sets) and report both side by side
+def validate_vectorized(df, name, grid=None, sample=None, rtol=1e-9, seed=0):
+    strategy, default_grid = STRATEGY_GRIDS[name]
+    grid = grid or default_grid
+    stats, _ = vectorized_backtest(df, name, grid)
+
+    indices = range(len(grid))
+    if sample is not None and sample < len(grid):
+        indices = sorted(np.random.default_rng(seed).choice(len(grid), sample, replace=False))
+
+    rows = []
+    for i in indices:
+        reference = Backtest(df, strategy, **BACKTEST_KWARGS).run(**grid[i])
+        row = dict(grid[i])
+        match = True
+        for key in VALIDATED_STATS:
+            row[key] = stats[key].iat[i]
+            row[f"{key} (Backtest)"] = reference[key]
+            match = match and bool(np.isclose(stats[key].iat[i], reference[key], rtol=rtol, atol=1e-9))
+        row['match'] = match
+        rows.append(row)
+
+    report = pd.DataFrame(rows)
+    print(f"Vectorized {name} engine matches Backtest on {int(report['match'].sum())}/{len(report)} parameter sets")
+    return report
+
+# Backtest and optimize each strategy for each stock
+# With a BarCache, each symbol's bars come from the local cache and only missing ranges hit the DB.
+# workers != 1 runs the grids on a process pool (None uses every core);
+# engine='vectorized' evaluates each grid in one NumPy pass instead, and a search
+# (e.g. search.TPESearch()) replaces the grids with an adaptive search of SEARCH_SPACES.
+# A ResultStore skips every grid backtest already stored for the same bars (Backtest engine only).
+def run_backtests_and_optimization(symbols, start, end, cache=None, workers=1, engine='backtesting', search=None, store=None):
+    # Each symbol's frame comes straight off the stream, which yields the symbols one after
+    # another, rather than filtering one concatenated frame again for every symbol
+    if cache is not None:
+        frames = {symbol: cache.load_frame(symbol, '15min', start, end, load_symbol_bars) for symbol in symbols}
+    else:
+        frames = dict(stream_15min_bars(symbols, start, end))
+
+    if search is not None:
+        return {
+            symbol: {
+                name: dict(zip(('result', 'params'), optimize_search(df, name, search)))
+                for name in STRATEGY_GRIDS
+            }
+            for symbol, df in frames.items()
+        }
+    if engine == 'vectorized':
+        return {
+            symbol: {
+                name: dict(zip(('result', 'params'), optimize_vectorized(df, name)))
+                for name in STRATEGY_GRIDS
+            }
+            for symbol, df in frames.items()
+        }
+    if workers != 1:
+        return optimize_parallel(frames, workers, store=store)
+
+    results = {}
+    for symbol, df in frames.items():
         # Optimize EMADX Strategy
-        optimized_emadx, params_emadx = optimize_emadx_strategy(df)
+        optimized_emadx, params_emadx = optimize_emadx_strategy(df, store, symbol)
         
         # Optimize Bollinger Bands Strategy
-        optimized_bollinger, params_bollinger = optimize_bollinger_strategy(df)
+        optimized_bollinger, params_bollinger = optimize_bollinger_strategy(df, store, symbol)
         
         results[symbol] = {
             'emadx': {'result': optimized_emadx, 'params': params_emadx},
@@ -127,21 +670,26 @@ def run_backtests_and_optimization(symbols, start, end):
     
     return results
 
-# Parameters
-symbols = ['MCD', 'PEP', 'KO']
-start = '2023-05-15'
-end = '2023-08-23'
+if __name__ == '__main__':
+    # Parameters
+    symbols = ['MCD', 'PEP', 'KO']
+    start = '2023-05-15'
+    end = '2023-08-23'
 
-# Run backtests and optimization
-results = run_backtests_and_optimization(symbols, start, end)
+    # Run backtests and optimization on every core, reusing stored results for unchanged bars
+    store = ResultStore()
+    results = run_backtests_and_optimization(symbols, start, end, cache=BarCache(high_water=minute_high_water), workers=None, store=store)
+    print(f"Indicator cache: {INDICATOR_CACHE.stats()}")
+    print(f"Result store: {store.stats()}")
+    store.close()
 
-# Print results
-for symbol, strategies in results.items():
-    print(f"\nResults for {symbol}:")
-    print("Optimized EMA-ADX Strategy:")
-    print(f"Parameters: {strategies['emadx']['params']}")
-    print(strategies['emadx']['result'])
-    
-    print("Optimized Bollinger Bands Strategy:")
-    print(f"Parameters: {strategies['bollinger']['params']}")
-    print(strategies['bollinger']['result'])
+    # Print results
+    for symbol, strategies in results.items():
+        print(f"\nResults for {symbol}:")
+        print("Optimized EMA-ADX Strategy:")
+        print(f"Parameters: {strategies['emadx']['params']}")
+        print(strategies['emadx']['result'])
+        
+        print("Optimized Bollinger Bands Strategy:")
+        print(f"Parameters: {strategies['bollinger']['params']}")
+        print(strategies['bollinger']['result'])
@@ -0,0 +1,75 @@
+import asyncio
+import collections
+import logging
+import time
+import pandas as pd
+
+# A completed time bar; timestamp is the interval start in epoch nanoseconds,
+# the same left label backtest.resample_bars gives its bars
+Bar = collections.namedtuple('Bar', ['symbol', 'timestamp', 'open', 'high', 'low', 'close', 'volume'])
+
+# Builds time-based OHLCV bars from a stream of trades, one open bar per symbol.
+# A bar closes as soon as a trade for a later interval arrives, or on the clock once
+# its interval has ended (plus `grace` for trades still in flight), whichever comes
+# first. Intervals without trades produce no bar, like the dropna in resample_bars.
+# Trades for an interval that has already closed are dropped and counted.
+class BarAggregator:
+    def __init__(self, freq='15min', grace='2s'):
+        self.interval = pd.Timedelta(freq).value
+        self.grace = pd.Timedelta(grace).value
+        self.open_bars = {}  # symbol -> [start, open, high, low, close, volume]
+        self.closed_until = {}  # symbol -> end of the last closed interval
+        self.trades = 0
+        self.late_trades = 0
+        self.bars = 0
+
+    # Add one trade; returns the bar it closed, if any
+    def add_trade(self, symbol, timestamp, price, size=0):
+        self.trades += 1
+        start = timestamp - timestamp % self.interval
+        if start < self.closed_until.get(symbol, start):
+            self.late_trades += 1
+            return None
+
+        bar = self.open_bars.get(symbol)
+        if bar is not None and start == bar[0]:
+            if price > bar[2]:
+                bar[2] = price
+            if price < bar[3]:
+                bar[3] = price
+            bar[4] = price
+            bar[5] += size
+            return None
+
+        closed = self._close(symbol) if bar is not None else None
+        self.open_bars[symbol] = [start, price, price, price, price, size]
+        return closed
+
+    # Close every open bar whose interval ended at least `grace` before now_ns
+    def flush(self, now_ns=None):
+        now_ns = time.time_ns() if now_ns is None else now_ns
+        due = [symbol for symbol, bar in self.open_bars.items() if bar[0] + self.interval + self.grace <= now_ns]
+        return [self._close(symbol) for symbol in due]
+
+    # Clock task for the live engines: wakes up at each interval boundary (plus grace)
+    # and passes the bars closed by the clock to on_bar. An exception from on_bar is
+    # logged and the remaining bars still go out, so one failing symbol can't stop the
+    # clock for every symbol.
+    async def run_clock(self, on_bar):
+        while True:
+            now = time.time_ns()
+            wake = now - now % self.interval + self.grace
+            if wake <= now:
+                wake += self.interval
+            await asyncio.sleep((wake - now) / 1e9)
+            for bar in self.flush():
+                try:
+                    on_bar(bar)
+                except Exception:
+                    logging.exception(f"on_bar failed for {bar.symbol} bar at {pd.Timestamp(bar.timestamp, tz='UTC')}")
+
+    def _close(self, symbol):
+        start, open_, high, low, close, volume = self.open_bars.pop(symbol)
+        self.closed_until[symbol] = start + self.interval
+        self.bars += 1
+        return Bar(symbol, start, open_, high, low, close, volume)
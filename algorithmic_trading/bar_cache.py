@@ -0,0 +1,222 @@
+import collections
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Column arrays of one symbol's bars. On a warm read these are views into a
+# memory-mapped Arrow IPC file, so nothing is copied until a DataFrame is built.
+Bars = collections.namedtuple('Bars', ['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+
+# Convert a date string, datetime or Timestamp to UTC epoch nanoseconds
+def to_ns(ts):
+    ts = pd.Timestamp(ts)
+    ts = ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+    return ts.value
+
+# Build the DataFrame Backtest expects from cached bar arrays
+# (prices are widened back to float64, which talib requires)
+def to_frame(bars):
+    index = pd.DatetimeIndex(pd.to_datetime(bars.timestamp, unit='ns', utc=True), name='timestamp')
+    return pd.DataFrame({
+        'Open': bars.open.astype(np.float64),
+        'High': bars.high.astype(np.float64),
+        'Low': bars.low.astype(np.float64),
+        'Close': bars.close.astype(np.float64),
+        'Volume': bars.volume
+    }, index=index)
+
+# On-disk columnar cache of resampled bars, one Arrow IPC file per
+# (symbol, timeframe, covered date range). Prices are stored as price_dtype
+# (float32 by default), timestamps and volume as int64. Requests only fetch the
+# parts of the range that no file covers yet, and the fetched pieces are merged
+# with the overlapping files into one, so the next read is a single mmap.
+# Files are evicted least-recently-used once the cache grows past max_bytes.
+# A range only counts as covered up to the last bar the loader returned, or, with
+# high_water(symbol) -> time the source is complete up to (exclusive, None if it has
+# nothing), up to the last whole bar before that. Whoever rewrites data the cache may
+# already hold calls invalidate() for that range.
+class BarCache:
+    def __init__(self, root='bar_cache', max_bytes=2 * 1024 ** 3, price_dtype='float32', high_water=None):
+        self.root = root
+        self.high_water = high_water
+        self.max_bytes = max_bytes
+        self.price_dtype = np.dtype(price_dtype)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self.entries = self._read_manifest()
+
+    # Bars for symbol between start and end (inclusive). loader(symbol, start, end, timeframe)
+    # must return a DataFrame of Open/High/Low/Close/Volume indexed by bar timestamp.
+    def load(self, symbol, timeframe, start, end, loader):
+        freq = pd.Timedelta(timeframe).value
+        start_ns, end_ns = to_ns(start), to_ns(end)
+        lo = start_ns - start_ns % freq
+        hi = end_ns - end_ns % freq + freq
+
+        overlapping = sorted(
+            (key for key, e in self.entries.items()
+             if e['symbol'] == symbol and e['timeframe'] == timeframe and e['start'] <= hi and e['end'] >= lo),
+            key=lambda key: self.entries[key]['start'])
+        missing = self._missing(lo, hi, [self.entries[key] for key in overlapping])
+
+        if missing or len(overlapping) != 1:
+            self.misses += 1
+            key = self._fill(symbol, timeframe, lo, hi, overlapping, missing, loader)
+        else:
+            self.hits += 1
+            key = overlapping[0]
+
+        self.entries[key]['last_access'] = time.time()
+        self._evict(keep=key)
+        self._write_manifest()
+
+        bars = self._read(self.entries[key]['file'])
+        i = np.searchsorted(bars.timestamp, lo, side='left')
+        j = np.searchsorted(bars.timestamp, end_ns, side='right')
+        return Bars(*(column[i:j] for column in bars))
+
+    # Same as load, as a DataFrame ready for Backtest
+    def load_frame(self, symbol, timeframe, start, end, loader):
+        return to_frame(self.load(symbol, timeframe, start, end, loader))
+
+    # Forget coverage of symbol's bars (every timeframe unless one is given) from start
+    # on, so the next load refetches them; end bounds which files are affected
+    def invalidate(self, symbol, timeframe=None, start=None, end=None):
+        start_ns = to_ns(start) if start is not None else None
+        end_ns = to_ns(end) if end is not None else None
+        for key, e in list(self.entries.items()):
+            if e['symbol'] != symbol or (timeframe is not None and e['timeframe'] != timeframe):
+                continue
+            freq = pd.Timedelta(e['timeframe']).value
+            cut = start_ns - start_ns % freq if start_ns is not None else e['start']
+            if e['end'] <= cut or (end_ns is not None and e['start'] > end_ns):
+                continue
+            if e['start'] >= cut:
+                self._remove(key)
+            else:
+                e['end'] = cut
+        self._write_manifest()
+
+    def stats(self):
+        size = sum(e['size'] for e in self.entries.values())
+        return {'hits': self.hits, 'misses': self.misses, 'files': len(self.entries), 'bytes': size}
+
+    # Gaps in [lo, hi) not covered by the given entries (sorted by start)
+    def _missing(self, lo, hi, entries):
+        missing = []
+        cursor = lo
+        for e in entries:
+            if e['start'] > cursor:
+                missing.append((cursor, min(e['start'], hi)))
+            cursor = max(cursor, e['end'])
+        if cursor < hi:
+            missing.append((cursor, hi))
+        return missing
+
+    # Fetch the gaps and merge them with the overlapping files into one new file
+    def _fill(self, symbol, timeframe, lo, hi, overlapping, missing, loader):
+        pieces = [self._read(self.entries[key]['file']) for key in overlapping]
+        for a, b in missing:
+            df = loader(symbol, pd.Timestamp(a, unit='ns', tz='UTC'), pd.Timestamp(b - 1000, unit='ns', tz='UTC'), timeframe)
+            pieces.append(self._from_frame(df))
+
+        merged = Bars(*(np.concatenate(columns) for columns in zip(*pieces)))
+        order = np.argsort(merged.timestamp, kind='stable')
+        merged = Bars(*(column[order] for column in merged))
+        keep = np.concatenate([merged.timestamp[1:] != merged.timestamp[:-1], [True]])
+        merged = Bars(*(column[keep] for column in merged))
+
+        # Only mark the range covered as far as the source is known to be complete, and
+        # never the still-forming present, so anything later is refetched next time
+        freq = pd.Timedelta(timeframe).value
+        now = time.time_ns()
+        if self.high_water is not None:
+            complete = self.high_water(symbol)
+            complete = to_ns(complete) if complete is not None else lo
+            complete -= complete % freq
+        else:
+            complete = int(merged.timestamp[-1]) + freq if len(merged.timestamp) else lo
+        start = min([lo] + [self.entries[key]['start'] for key in overlapping])
+        end = min(max([min(hi, complete)] + [self.entries[key]['end'] for key in overlapping]), now - now % freq)
+        end = max(start, end)
+        key = f"{symbol}/{timeframe}/{start}-{end}"
+        path = os.path.join(self.root, f"{symbol}_{timeframe}_{start}_{end}.arrow")
+        self._write(path, merged)
+
+        # A refill that found nothing new writes the same key and file as before
+        for old in overlapping:
+            if old != key:
+                self._remove(old)
+        self.entries[key] = {
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'start': start,
+            'end': end,
+            'file': path,
+            'size': os.path.getsize(path),
+            'last_access': time.time()
+        }
+        return key
+
+    def _from_frame(self, df):
+        index = pd.DatetimeIndex(df.index)
+        index = index.tz_localize('UTC') if index.tz is None else index.tz_convert('UTC')
+        return Bars(
+            np.asarray(index.tz_localize(None), dtype='datetime64[ns]').view('int64'),
+            df['Open'].to_numpy(self.price_dtype),
+            df['High'].to_numpy(self.price_dtype),
+            df['Low'].to_numpy(self.price_dtype),
+            df['Close'].to_numpy(self.price_dtype),
+            df['Volume'].to_numpy('int64')
+        )
+
+    # Write bars as a single uncompressed record batch so every column maps to one buffer
+    def _write(self, path, bars):
+        batch = pa.record_batch([pa.array(column) for column in bars], names=list(Bars._fields))
+        tmp = path + '.tmp'
+        with pa.OSFile(tmp, 'wb') as sink:
+            with pa.ipc.new_file(sink, batch.schema) as writer:
+                writer.write_batch(batch)
+        os.replace(tmp, path)
+
+    # Memory-map a cache file and expose its columns as zero-copy NumPy arrays
+    def _read(self, path):
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        return Bars(*(table.column(name).chunk(0).to_numpy(zero_copy_only=True) if table.num_rows
+                      else table.column(name).to_numpy() for name in Bars._fields))
+
+    # Drop least-recently-used files until the cache fits in max_bytes
+    def _evict(self, keep):
+        total = sum(e['size'] for e in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.entries[key]['size']
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        try:
+            os.remove(entry['file'])
+        except OSError:
+            pass
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            entries = json.load(f)
+        return {key: e for key, e in entries.items() if os.path.exists(e['file'])}
+
+    def _write_manifest(self):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.manifest_path)
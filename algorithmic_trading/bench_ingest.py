@@ -0,0 +1,45 @@
+import argparse
+from data_retrieval import connect_db, create_schema, insert_data_to_db
+from synthetic_data import synthetic_minute_bars
+
+# Compare ingestion throughput of the row-by-row, execute_values and COPY paths
+# against a scratch hypertable on the local TimescaleDB, and time the refresh of its
+# rollups that follows each insert.
+BENCH_TABLE = 'alpaca_minute_data_bench'
+
+def run_ingest_benchmark(num_symbols, days, methods):
+    symbols = [f"SYM{i:03d}" for i in range(num_symbols)]
+    data = synthetic_minute_bars(symbols, days=days)
+    conn = connect_db()
+    results = {}
+    try:
+        for method in methods:
+            cursor = conn.cursor()
+            cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE} CASCADE;")
+            conn.commit()
+            cursor.close()
+            create_schema(conn, table=BENCH_TABLE)
+            results[method] = insert_data_to_db(data, conn, method=method, table=BENCH_TABLE)
+
+        cursor = conn.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE} CASCADE;")
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark insert_data_to_db ingestion paths')
+    parser.add_argument('--symbols', type=int, default=5)
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--methods', nargs='+', default=['row', 'values', 'copy'])
+    args = parser.parse_args()
+
+    results = run_ingest_benchmark(args.symbols, args.days, args.methods)
+
+    baseline = results.get('row')
+    print(f"\n{'method':<8} {'rows':>10} {'seconds':>10} {'rows/s':>12} {'speedup':>8} {'refresh s':>10}")
+    for method, result in results.items():
+        speedup = result['rows_per_sec'] / baseline['rows_per_sec'] if baseline else float('nan')
+        print(f"{method:<8} {result['rows']:>10} {result['seconds']:>10.2f} {result['rows_per_sec']:>12,.0f} {speedup:>7.1f}x {result['refresh_seconds']:>10.2f}")
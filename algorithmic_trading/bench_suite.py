@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from unittest import mock
+import numpy as np
+import pandas as pd
+import backtest
+from bar_cache import BarCache
+from bench_ingest import run_ingest_benchmark
+from data_retrieval import insert_data_to_db
+from fake_broker import FakeBroker
+from indicator_cache import INDICATOR_CACHE
+from metrics import METRICS
+from replay import load_engine, replay
+from synthetic_data import FakeConnection, synthetic_minute_bars, synthetic_trades
+
+# Offline benchmark suite for the data, backtest and live paths, on synthetic minute bars
+# and trades. Every result is one number named for its unit: *_seconds and *_us are
+# lower-is-better, *_per_sec higher-is-better. A run is written as JSON, can be saved as
+# the baseline, and is otherwise compared against the saved baseline so that any result
+# worse than it by more than the tolerance fails the run.
+BASELINE_PATH = 'bench_baseline.json'
+START = '2023-05-15'
+SECTIONS = ['ingest', 'load', 'optimize', 'live']
+
+# Fastest of `repeat` calls, in seconds
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def symbol_names(n):
+    return [f"SYM{i:03d}" for i in range(n)]
+
+# synthetic_minute_bars output as one frame in the loaders' column naming
+def minute_frame(minute):
+    return pd.concat(minute.values()).rename(columns={
+        'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'volume': 'Volume'})
+
+# insert_data_to_db rows/s per method, against the local TimescaleDB (scratch table of
+# bench_ingest.py) with db=True, otherwise against FakeConnection, which measures only the
+# client side: building, adapting and serializing the rows
+def bench_ingest(args):
+    methods = ['row', 'values', 'copy']
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.db:
+            reports = run_ingest_benchmark(args.symbols, args.days, methods)
+        else:
+            data = synthetic_minute_bars(symbol_names(args.symbols), days=args.days, start=START)
+            reports = {}
+            for method in methods:
+                reports[method] = max((insert_data_to_db(data, FakeConnection(), method=method) for _ in range(args.repeat)),
+                                      key=lambda report: report['rows_per_sec'])
+    return {f"ingest_{method}_rows_per_sec": report['rows_per_sec'] for method, report in reports.items()}
+
+# fetch_15min_data from the 15-minute rollup, with bucketing in the database and with
+# bucketing in pandas (client side, against FakeConnection), resample_bars on its own, and
+# BarCache loads from cold and warm
+def bench_load(args):
+    symbols = symbol_names(args.symbols)
+    minute = synthetic_minute_bars(symbols, days=args.days, start=START)
+    end = max(df['timestamp'].iat[-1] for df in minute.values())
+    results = {}
+
+    with mock.patch.object(backtest.psycopg2, 'connect', return_value=FakeConnection(minute)):
+        for label, kwargs in (('rollup', {}), ('db', {'rollup': False}), ('pandas', {'aggregate_in_db': False})):
+            fetch = lambda: backtest.fetch_15min_data(symbols, START, end, **kwargs)
+            fetch()  # the stand-in builds its result rows on first use
+            results[f"load_fetch_{label}_seconds"] = best_of(fetch, args.repeat)
+
+    frame = minute_frame(minute)
+    results['load_resample_seconds'] = best_of(lambda: backtest.resample_bars(frame), args.repeat)
+
+    bars = backtest.resample_bars(frame)
+    frames = {symbol: df.droplevel('symbol') for symbol, df in bars.groupby(level='symbol')}
+    loader = lambda symbol, start, end, timeframe: frames[symbol]
+    load_all = lambda cache: [cache.load_frame(symbol, '15min', START, end, loader) for symbol in symbols]
+    cold, warm = [], []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as root:
+            cache = BarCache(root)
+            cold.append(best_of(lambda: load_all(cache), 1))
+            warm.append(best_of(lambda: load_all(cache), 1))
+    results['load_cache_cold_seconds'] = min(cold)
+    results['load_cache_warm_seconds'] = min(warm)
+    return results
+
+# Per-symbol cost of the grid optimizers, with a cold indicator cache for every symbol,
+# and of the vectorized engine over the same grids
+def bench_optimize(args):
+    minute = synthetic_minute_bars(symbol_names(args.optimize_symbols), days=args.optimize_days, start=START)
+    bars = backtest.resample_bars(minute_frame(minute))
+    frames = [df.droplevel('symbol') for _, df in bars.groupby(level='symbol')]
+
+    timings = {'emadx': [], 'bollinger': [], 'vectorized': []}
+    for df in frames:
+        INDICATOR_CACHE.clear()
+        timings['emadx'].append(best_of(lambda: backtest.optimize_emadx_strategy(df), 1))
+        INDICATOR_CACHE.clear()
+        timings['bollinger'].append(best_of(lambda: backtest.optimize_bollinger_strategy(df), 1))
+        timings['vectorized'].append(best_of(lambda: [backtest.optimize_vectorized(df, name) for name in backtest.STRATEGY_GRIDS], args.repeat))
+    return {f"optimize_{name}_symbol_seconds": float(np.mean(values)) for name, values in timings.items()}
+
+# Throughput and per-tick latency of trade_callback in both live engines, replaying
+# synthetic trades with a FakeBroker (see replay.py)
+def bench_live(args):
+    logging.disable(logging.INFO)
+    results = {}
+    for name in ('streaming', 'risk'):
+        engine = load_engine(name, FakeBroker())
+        trades = synthetic_trades(list(engine.STRATEGY_PARAMS), args.trades, args.rate)
+        METRICS.reset()
+        report = asyncio.run(replay(engine, trades))
+        results[f"live_{name}_messages_per_sec"] = report['messages_per_sec']
+        results[f"live_{name}_p50_us"] = report['latency_us']['p50']
+        results[f"live_{name}_p99_us"] = report['latency_us']['p99']
+    logging.disable(logging.NOTSET)
+    return results
+
+BENCHMARKS = {'ingest': bench_ingest, 'load': bench_load, 'optimize': bench_optimize, 'live': bench_live}
+
+def run_suite(args):
+    results = {}
+    for section in args.only:
+        started = time.perf_counter()
+        results.update(BENCHMARKS[section](args))
+        print(f"{section} done in {time.perf_counter() - started:.1f}s")
+    meta = {
+        'time': pd.Timestamp.now(tz='UTC').isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('only', 'out', 'baseline', 'save_baseline', 'tolerance')}
+    }
+    return {'meta': meta, 'results': results}
+
+# One row per result present in both runs: (name, baseline, current, relative change,
+# regressed), where regressed means worse than the baseline by more than tolerance
+def compare(results, baseline, tolerance=0.2):
+    rows = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = value / base - 1
+        worse = -change if name.endswith('_per_sec') else change
+        rows.append((name, base, value, change, worse > tolerance))
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks with baseline comparison')
+    parser.add_argument('--only', nargs='+', choices=SECTIONS, default=SECTIONS)
+    parser.add_argument('--symbols', type=int, default=5, help='symbols for the ingest and load benchmarks')
+    parser.add_argument('--days', type=int, default=5, help='sessions of minute bars for the ingest and load benchmarks')
+    parser.add_argument('--optimize-symbols', type=int, default=2)
+    parser.add_argument('--optimize-days', type=int, default=20)
+    parser.add_argument('--trades', type=int, default=200000, help='synthetic trades replayed per live engine')
+    parser.add_argument('--rate', type=float, default=5.0, help='synthetic trades per second (sets how many bars close)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per timing, the fastest is kept')
+    parser.add_argument('--db', action='store_true', help='benchmark ingestion against the local TimescaleDB')
+    parser.add_argument('--out', help='also write this run as JSON to this path')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown counted as a regression')
+    args = parser.parse_args()
+
+    run = run_suite(args)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        for name, value in run['results'].items():
+            print(f"{name:<36} {value:>14,.3f}")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['meta']['config'] != run['meta']['config']:
+        print(f"\nWarning: baseline was run with {baseline['meta']['config']}")
+    if baseline['meta']['platform'] != run['meta']['platform'] or baseline['meta']['cpus'] != run['meta']['cpus']:
+        print(f"Warning: baseline is from {baseline['meta']['platform']} with {baseline['meta']['cpus']} CPUs")
+
+    rows = compare(run['results'], baseline['results'], args.tolerance)
+    print(f"\n{'benchmark':<36} {'baseline':>14} {'current':>14} {'change':>8}")
+    for name, base, value, change, regressed in rows:
+        print(f"{name:<36} {base:>14,.3f} {value:>14,.3f} {change:>+7.1%}{'  REGRESSION' if regressed else ''}")
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.tolerance:.0%}")
@@ -0,0 +1,297 @@
+import argparse
+import math
+import numpy as np
+import pandas as pd
+import psycopg2
+from numpy.lib.stride_tricks import sliding_window_view
+from backtest import (BACKTEST_KWARGS, BAR_COLUMNS, BUCKET_QUERY, ROLLUP_QUERY, ROLLUP_VIEWS, STRATEGY_GRIDS,
+                      VALIDATED_STATS, _fill_orders, conn_params, rollup_params, to_utc, vectorized_backtest)
+from live_indicators import ADX, EMA
+
+# Out-of-core version of the vectorized engine: a symbol's bars are read in time-ordered
+# chunks and the whole parameter grid is stepped through one chunk at a time. Indicator
+# state, cash/positions, the order pending from the previous bar and the running stats
+# are carried across chunk boundaries, so memory is bounded by the chunk size rather than
+# the length of the history, and the stats are those vectorized_backtest (and so Backtest)
+# reports over the full history.
+
+# One symbol's bars in time order as DataFrames of at most chunk_size bars, through a named
+# (server-side) cursor so only one chunk is held at a time. Reads the rollup of the
+# timeframe when there is one, otherwise buckets the minute bars in the database.
+def stream_bar_chunks(symbol, start, end, freq='15min', chunk_size=50000):
+    conn = psycopg2.connect(**conn_params)
+    cursor = conn.cursor(name='stream_bar_chunks')
+    cursor.itersize = chunk_size
+    start, end = to_utc(start), to_utc(end)
+    try:
+        if freq in ROLLUP_VIEWS:
+            cursor.execute(ROLLUP_QUERY.format(view=ROLLUP_VIEWS[freq]), rollup_params(start, end, freq, [symbol]))
+        else:
+            cursor.execute(BUCKET_QUERY, (pd.Timedelta(freq).to_pytimedelta(), start, end, [symbol]))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            df = pd.DataFrame.from_records(rows, columns=['timestamp', 'symbol'] + BAR_COLUMNS)
+            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+            yield df.set_index('timestamp').drop(columns='symbol')
+    finally:
+        cursor.close()
+        conn.close()
+
+# An in-memory (or memory-mapped, e.g. BarCache) frame as chunks of chunk_size bars
+def frame_chunks(df, chunk_size=50000):
+    for i in range(0, len(df), chunk_size):
+        yield df.iloc[i:i + chunk_size]
+
+# EMA-ADX rules of emadx_signals, one chunk at a time. EMA and ADX come from the
+# incremental indicators of the live engines, which are bitwise equal to talib's, and the
+# last bar of the previous chunk is kept for the crossovers.
+class EMADXChunks:
+    def __init__(self, grid):
+        self.ema_windows = [p['ema_window'] for p in grid]
+        self.adx_windows = [p['adx_window'] for p in grid]
+        self.threshold = np.array([p['adx_threshold'] for p in grid], dtype=np.float64)
+        self.emas = {w: EMA(w) for w in set(self.ema_windows)}
+        self.adxs = {w: ADX(w) for w in set(self.adx_windows)}
+        self.prev_close = math.nan
+        self.prev_ema = np.full(len(grid), math.nan)
+
+    # (chunk bars x param-sets) signals as emadx_signals builds them, and whether every
+    # indicator of each set has a value at each bar
+    def signals(self, chunk):
+        close = chunk['Close'].to_numpy(np.float64)
+        high = chunk['High'].to_numpy(np.float64)
+        low = chunk['Low'].to_numpy(np.float64)
+        emas = {w: np.array([ema.update(c) for c in close.tolist()]) for w, ema in self.emas.items()}
+        adxs = {w: np.array([adx.update(h, l, c) for h, l, c in zip(high.tolist(), low.tolist(), close.tolist())])
+                for w, adx in self.adxs.items()}
+        ema = np.column_stack([emas[w] for w in self.ema_windows])
+        adx = np.column_stack([adxs[w] for w in self.adx_windows])
+
+        c = close[:, None]
+        prev_c = np.concatenate([[self.prev_close], close[:-1]])[:, None]
+        prev_ema = np.vstack([self.prev_ema, ema[:-1]])
+        with np.errstate(invalid='ignore'):
+            cross_up = (prev_c < prev_ema) & (c > ema)
+            cross_down = (prev_ema < prev_c) & (ema > c)
+            buy = (adx > self.threshold) & cross_up
+        sell = ~buy & cross_down
+
+        self.prev_close = close[-1]
+        self.prev_ema = ema[-1]
+        return buy.astype(np.float64) - sell.astype(np.float64), ~(np.isnan(ema) | np.isnan(adx))
+
+# Bollinger Bands rules of bollinger_signals, one chunk at a time. The middle band repeats
+# talib's running-sum SMA exactly (its running total is carried across chunks); the
+# deviation is computed over each window from the last window - 1 closes of the previous
+# chunks. talib's own deviation also depends on running state it does not expose, so the
+# bands agree with talib's to ~1e-13 rather than bitwise.
+class BollingerChunks:
+    def __init__(self, grid):
+        self.windows = [p['window'] for p in grid]
+        self.num_std_dev = np.array([p['num_std_dev'] for p in grid], dtype=np.float64)
+        self.totals = {w: 0.0 for w in set(self.windows)}
+        self.history = max(self.windows) - 1
+        self.tail = np.empty(0)
+        self.count = 0
+
+    def signals(self, chunk):
+        close = chunk['Close'].to_numpy(np.float64)
+        closes = np.concatenate([self.tail, close])
+        offset = len(self.tail)
+        m = len(close)
+
+        middles, deviations = {}, {}
+        for w in self.totals:
+            middle = np.full(m, math.nan)
+            total = self.totals[w]
+            values = closes.tolist()
+            for i in range(m):
+                total += values[offset + i]
+                if self.count + i >= w - 1:
+                    middle[i] = total / w
+                    total -= values[offset + i - w + 1]
+            self.totals[w] = total
+
+            deviation = np.full(m, math.nan)
+            first = max(w - 1 - self.count, 0)
+            if first < m:
+                windows = sliding_window_view(closes[offset + first - w + 1:], w)
+                variance = ((windows - middle[first:, None]) ** 2).sum(axis=1) / w
+                deviation[first:] = np.where(variance >= 1e-8, np.sqrt(np.maximum(variance, 0.0)), 0.0)
+            middles[w], deviations[w] = middle, deviation
+
+        middle = np.column_stack([middles[w] for w in self.windows])
+        band = np.column_stack([deviations[w] for w in self.windows]) * self.num_std_dev
+        upper, lower = middle + band, middle - band
+        c = close[:, None]
+        with np.errstate(invalid='ignore'):
+            buy = c < lower
+            sell = ~buy & (c > upper)
+
+        self.tail = closes[len(closes) - min(self.history, len(closes)):]
+        self.count += m
+        return buy.astype(np.float64) - sell.astype(np.float64), ~(np.isnan(upper) | np.isnan(lower))
+
+# Chunked signal builders by strategy name, as VECTOR_SIGNALS for the in-memory engine
+CHUNK_SIGNALS = {
+    'emadx': EMADXChunks,
+    'bollinger': BollingerChunks
+}
+
+# A whole parameter grid for one symbol, fed chunk by chunk with update(); stats() gives
+# the same table as vectorized_backtest over all bars seen
+class ChunkedBacktest:
+    def __init__(self, name, grid=None, cash=BACKTEST_KWARGS['cash'], commission=BACKTEST_KWARGS['commission']):
+        self.grid = grid or STRATEGY_GRIDS[name][1]
+        self.rules = CHUNK_SIGNALS[name](self.grid)
+        self.cash = cash
+        self.commission = commission
+        sets = len(self.grid)
+        self.K = np.full(sets, float(cash))
+        self.pos = np.zeros(sets)
+        self.pending = np.zeros(sets)
+        self.alive = np.ones(sets, dtype=bool)
+        self.ready = np.zeros(sets, dtype=bool)
+        self.hold_start = np.full(sets, math.nan)
+        self.bars = 0
+        self.first_close = self.last_close = None
+        self.first_equity = self.peak = self.max_drawdown = self.final_equity = None
+
+    def update(self, chunk):
+        if not len(chunk):
+            return
+        open_ = chunk['Open'].to_numpy(np.float64)
+        close = chunk['Close'].to_numpy(np.float64)
+        signals, ready = self.rules.signals(chunk)
+
+        # Orders start the bar after every indicator has a value (Backtest's warm-up), and the
+        # buy & hold benchmark starts at that first ready bar
+        orders = np.where(np.vstack([self.ready, ready[:-1]]), signals, 0.0)
+        newly_ready = ready.any(axis=0) & ~self.ready
+        self.hold_start[newly_ready] = close[ready.argmax(axis=0)[newly_ready]]
+        self.ready = ready[-1]
+
+        equity = self._simulate(open_, close, orders)
+
+        if self.first_equity is None:
+            self.first_equity = equity[0]
+            self.first_close = close[0]
+            self.peak = np.full(len(self.grid), -math.inf)
+        peak = np.maximum.accumulate(np.vstack([self.peak, equity]), axis=0)[1:]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            drawdown = (1 - equity / peak).max(axis=0)
+        self.max_drawdown = drawdown if self.max_drawdown is None else np.maximum(self.max_drawdown, drawdown)
+        self.peak = peak[-1]
+        self.final_equity = equity[-1]
+        self.last_close = close[-1]
+        self.bars += len(chunk)
+
+    # Equity of every set over the chunk, continuing from the carried state. Same fills as
+    # simulate_signals: orders placed on bar i fill at bar i+1's open, only bars with a fill
+    # are stepped unless a set runs out of money, which then needs exact per-bar stepping.
+    def _simulate(self, open_, close, orders):
+        m, sets = orders.shape
+        placed = np.vstack([self.pending, orders[:-1]])
+
+        if self.alive.all():
+            fills = np.flatnonzero(np.any(placed != 0, axis=1))
+            K_rows = np.empty((len(fills) + 1, sets))
+            pos_rows = np.empty((len(fills) + 1, sets))
+            K_rows[0], pos_rows[0] = self.K, self.pos
+            for j, i in enumerate(fills, 1):
+                K_rows[j], pos_rows[j] = _fill_orders(K_rows[j - 1], pos_rows[j - 1], placed[i], open_[i], close[i], self.commission)
+            state = np.searchsorted(fills, np.arange(m), side='right')
+            equity = K_rows[state] + pos_rows[state] * close[:, None]
+            if (equity > 0).all():
+                self.K, self.pos = K_rows[-1], pos_rows[-1]
+                self.pending = orders[-1]
+                return equity
+
+        K, pos, alive = self.K.copy(), self.pos.copy(), self.alive.copy()
+        equity = np.empty((m, sets))
+        for i in range(m):
+            K, pos = _fill_orders(K, pos, np.where(alive, placed[i], 0.0), open_[i], close[i], self.commission)
+            value = K + pos * close[i]
+            broke = alive & (value <= 0)
+            if broke.any():
+                K[broke] = 0.0
+                pos[broke] = 0.0
+                alive &= ~broke
+            equity[i] = np.where(alive, value, 0.0)
+        self.K, self.pos, self.alive = K, pos, alive
+        self.pending = np.where(alive, orders[-1], 0.0)
+        return equity
+
+    # One row per parameter set (params + the stats of equity_stats)
+    def stats(self):
+        hold_start = np.where(np.isnan(self.hold_start), self.first_close, self.hold_start)
+        stats = pd.DataFrame({
+            'Equity Final [$]': self.final_equity,
+            'Equity Peak [$]': self.peak,
+            'Return [%]': (self.final_equity - self.first_equity) / self.first_equity * 100,
+            'Buy & Hold Return [%]': (self.last_close - hold_start) / hold_start * 100,
+            'Max. Drawdown [%]': -np.nan_to_num(self.max_drawdown) * 100
+        })
+        return pd.concat([pd.DataFrame(self.grid), stats], axis=1)
+
+# Backtest a grid over an iterable of bar chunks (stream_bar_chunks or frame_chunks)
+def chunked_backtest(chunks, name, grid=None, cash=BACKTEST_KWARGS['cash'], commission=BACKTEST_KWARGS['commission']):
+    engine = ChunkedBacktest(name, grid, cash, commission)
+    for chunk in chunks:
+        engine.update(chunk)
+    return engine.stats()
+
+# Compare the chunked engine against vectorized_backtest over the whole frame in memory.
+# Returns a DataFrame with one row per parameter set: whether every VALIDATED_STATS value
+# is bitwise equal, and the largest relative difference.
+def validate_chunked(df, name, chunk_size=1000, grid=None):
+    grid = grid or STRATEGY_GRIDS[name][1]
+    chunked = chunked_backtest(frame_chunks(df, chunk_size), name, grid)
+    in_memory, _ = vectorized_backtest(df, name, grid)
+    a = chunked[VALIDATED_STATS].to_numpy()
+    b = in_memory[VALIDATED_STATS].to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rel = np.nan_to_num(np.abs(a - b) / np.abs(b))
+    report = pd.DataFrame(grid)
+    report['exact'] = (a == b).all(axis=1)
+    report['max_rel_diff'] = rel.max(axis=1)
+    return report
+
+# Optimize every strategy for every symbol with the chunked engine, streaming each symbol's
+# bars from the database. The result per (symbol, strategy) is the stats row of the best
+# parameter set (first highest return, as the other engines pick it).
+def optimize_chunked(symbols, start, end, freq='15min', chunk_size=50000, strategies=('emadx', 'bollinger')):
+    results = {}
+    for symbol in symbols:
+        for name in strategies:
+            stats = chunked_backtest(stream_bar_chunks(symbol, start, end, freq, chunk_size), name)
+            best = int(np.argmax(stats['Return [%]'].to_numpy()))
+            results.setdefault(symbol, {})[name] = {'result': stats.iloc[best], 'params': STRATEGY_GRIDS[name][1][best]}
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest the strategy grids over bars streamed in chunks')
+    parser.add_argument('--symbols', nargs='+', default=['MCD', 'PEP', 'KO'])
+    parser.add_argument('--start', default='2023-05-15')
+    parser.add_argument('--end', default='2023-08-23')
+    parser.add_argument('--freq', default='15min')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='bars per chunk')
+    parser.add_argument('--validate', type=int, metavar='DAYS', help='check against the in-memory engine on DAYS of synthetic bars instead')
+    args = parser.parse_args()
+
+    if args.validate:
+        from synthetic_data import synthetic_minute_bars
+        from backtest import resample_bars
+        minute = synthetic_minute_bars(['SYN'], days=args.validate)['SYN'].rename(columns=str.capitalize)
+        df = resample_bars(minute.rename(columns={'Timestamp': 'timestamp', 'Symbol': 'symbol'}), args.freq).droplevel('symbol')
+        for name in STRATEGY_GRIDS:
+            report = validate_chunked(df, name, args.chunk_size)
+            print(f"{name}: {int(report['exact'].sum())}/{len(report)} parameter sets bitwise equal, "
+                  f"max relative difference {report['max_rel_diff'].max():.2e}")
+    else:
+        results = optimize_chunked(args.symbols, args.start, args.end, args.freq, args.chunk_size)
+        for symbol, strategies in results.items():
+            for name, result in strategies.items():
+                print(f"{symbol} {name}: {result['params']} return {result['result']['Return [%]']:.2f}%")
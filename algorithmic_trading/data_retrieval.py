@@ -1,31 +1,40 @@
+import asyncio
+import collections
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import psycopg2
+from psycopg2.extras import execute_values
 from decouple import config
+from bar_cache import BarCache
 from alpaca.data.historical import StockHistoricalDataClient
 from alpaca.data.requests import StockBarsRequest
 from alpaca.data.timeframe import TimeFrame
 from datetime import datetime, timedelta
 
-# Alpaca API credentials
-API_KEY = config("ALPACA_KEY")
-SECRET_KEY = config("ALPACA_SECRET")
+# Database connection parameters
+conn_params = {
+    'dbname': 'algo_trading',
+    'user': 'Archit',
+    'password': 'Archit@1',
+    'host': 'localhost',
+    'port': '5432'
+}
 
-# Initialize Alpaca client
-client = StockHistoricalDataClient(API_KEY, SECRET_KEY)
+# Columns of the minute bar table, in insert order
+MINUTE_COLUMNS = ['timestamp', 'symbol', 'open', 'high', 'low', 'close', 'volume']
 
-# Calculate start and end dates for older data
-end_date = datetime.now() - timedelta(days=365)  # Adjust the date to be a year ago
-start_date = end_date - timedelta(days=100)
+# OHLCV rollups of the minute bars, kept as TimescaleDB continuous aggregates named
+# {table}_{timeframe}: timeframe -> bucket width
+ROLLUPS = {'5min': '5 minutes', '15min': '15 minutes', '1h': '1 hour', '1d': '1 day'}
 
-# Format dates as strings
-start = start_date.strftime('%Y-%m-%d')
-end = end_date.strftime('%Y-%m-%d')
-
-# Print start and end dates for verification
-print(f"Fetching data from {start} to {end}")
+# A slice of the historical fetch: one batch of symbols over one time window.
+# seq orders the windows of a batch so they can be written in time order.
+FetchChunk = collections.namedtuple('FetchChunk', ['batch', 'seq', 'symbols', 'start', 'end'])
 
 # Fetch minute-level data from Alpaca
-def fetch_alpaca_data(symbols, start, end):
+def fetch_alpaca_data(symbols, start, end, client):
     try:
         request_params = StockBarsRequest(
             symbol_or_symbols=symbols,
@@ -46,49 +55,357 @@ def fetch_alpaca_data(symbols, start, end):
         print(f"Error fetching data from Alpaca: {e}")
         return None
 
+# Normalize a date string or datetime to a UTC timestamp
+def to_utc(ts):
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+# Fetch one chunk of minute bars, retrying with exponential backoff (e.g. on HTTP 429)
+def fetch_chunk(client, symbols, start, end, retries=3, backoff=1.0):
+    request_params = StockBarsRequest(
+        symbol_or_symbols=symbols,
+        timeframe=TimeFrame.Minute,
+        start=start,
+        end=end
+    )
+    for attempt in range(retries + 1):
+        try:
+            bars = client.get_stock_bars(request_params).df
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"Error fetching {len(symbols)} symbols from {start} to {end}, retrying: {e}")
+            time.sleep(backoff * 2 ** attempt)
+
+    data = {}
+    if bars.empty:
+        return data
+    for symbol in bars.index.get_level_values('symbol').unique():
+        df = bars.xs(symbol, level='symbol').reset_index()
+        df['symbol'] = symbol
+        data[symbol] = df[MINUTE_COLUMNS]
+    return data
+
+# Latest stored bar per symbol, used to resume an interrupted fetch
+def get_last_timestamps(conn, symbols, table='alpaca_minute_data'):
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT symbol, MAX(timestamp)
+        FROM {table}
+        WHERE symbol = ANY(%s)
+        GROUP BY symbol;
+    """, (list(symbols),))
+    last_timestamps = {symbol: to_utc(timestamp) for symbol, timestamp in cursor.fetchall()}
+    cursor.close()
+    return last_timestamps
+
+# Split [start, end] into symbol batches x time windows, starting each symbol
+# one minute after its last stored bar
+def plan_chunks(symbols, start, end, last_timestamps=None, chunk_days=7, symbols_per_chunk=50):
+    start, end = to_utc(start), to_utc(end)
+    last_timestamps = last_timestamps or {}
+
+    resume = {}
+    for symbol in symbols:
+        last = last_timestamps.get(symbol)
+        resume[symbol] = max(start, last + pd.Timedelta(minutes=1)) if last is not None else start
+    pending = sorted((s for s in symbols if resume[s] < end), key=lambda s: resume[s])
+
+    chunks = []
+    step = pd.Timedelta(days=chunk_days)
+    for batch, i in enumerate(range(0, len(pending), symbols_per_chunk)):
+        batch_symbols = pending[i:i + symbols_per_chunk]
+        window_start = resume[batch_symbols[0]]
+        seq = 0
+        while window_start < end:
+            window_end = min(window_start + step, end)
+            chunks.append(FetchChunk(batch, seq, batch_symbols, window_start, window_end))
+            window_start = window_end
+            seq += 1
+    return chunks
+
+# Sliding-window rate limiter shared by the concurrent fetchers
+class RateLimiter:
+    def __init__(self, max_calls, period=60.0):
+        self.max_calls = max_calls
+        self.period = period
+        self.calls = collections.deque()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                while self.calls and now - self.calls[0] >= self.period:
+                    self.calls.popleft()
+                if len(self.calls) < self.max_calls:
+                    self.calls.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self.calls[0]))
+
+# Fetch [start, end] in concurrent chunks and write each chunk as soon as it arrives.
+# Fetches run on a thread pool under the rate limit; a single writer thread owns the
+# connection. Windows of a batch are committed strictly in time order, so after a failure
+# the last stored timestamp per symbol is a safe point to resume from on the next run.
+# With a BarCache, each written symbol's range is invalidated there so cached bars are refetched.
+async def fetch_and_store(client, conn, symbols, start, end, chunk_days=7, symbols_per_chunk=50,
+                          max_concurrency=4, max_calls_per_minute=180, method='copy',
+                          table='alpaca_minute_data', rollups=ROLLUPS, cache=None):
+    last_timestamps = get_last_timestamps(conn, symbols, table)
+    chunks = plan_chunks(symbols, start, end, last_timestamps, chunk_days, symbols_per_chunk)
+    print(f"Fetching {len(chunks)} chunks for {len(symbols)} symbols ({len(last_timestamps)} resumed)")
+
+    loop = asyncio.get_running_loop()
+    fetch_pool = ThreadPoolExecutor(max_workers=max_concurrency)
+    write_pool = ThreadPoolExecutor(max_workers=1)
+    limiter = RateLimiter(max_calls_per_minute)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    queue = asyncio.Queue(maxsize=max_concurrency * 2)
+
+    async def fetch(chunk):
+        async with semaphore:
+            await limiter.acquire()
+            try:
+                data = await loop.run_in_executor(fetch_pool, fetch_chunk, client, chunk.symbols, chunk.start, chunk.end)
+            except Exception as e:
+                print(f"Giving up on chunk {chunk.start} - {chunk.end} for {len(chunk.symbols)} symbols: {e}")
+                data = None
+        await queue.put((chunk, data))
+
+    async def write():
+        summary = {'chunks': len(chunks), 'written': 0, 'rows': 0, 'failed_batches': [], 'first': None, 'last': None}
+        next_seq = collections.defaultdict(int)
+        arrived = {}
+        failed_at = {}
+        for _ in range(len(chunks)):
+            chunk, data = await queue.get()
+            stop = failed_at.get(chunk.batch, float('inf'))
+            if chunk.seq > stop:
+                continue
+            if data is None:
+                # Nothing after the failed window may be written, or the resume point would skip it
+                if chunk.batch not in failed_at:
+                    summary['failed_batches'].append(chunk.symbols)
+                failed_at[chunk.batch] = stop = min(stop, chunk.seq)
+                for key in [key for key in arrived if key[0] == chunk.batch and key[1] > stop]:
+                    del arrived[key]
+                continue
+
+            arrived[(chunk.batch, chunk.seq)] = data
+            while next_seq[chunk.batch] < stop and (chunk.batch, next_seq[chunk.batch]) in arrived:
+                ready = arrived.pop((chunk.batch, next_seq[chunk.batch]))
+                if ready:
+                    result = await loop.run_in_executor(write_pool, insert_data_to_db, ready, conn, method, table, {})
+                    summary['rows'] += result['rows']
+                    first, last = data_range(ready)
+                    summary['first'] = first if summary['first'] is None else min(summary['first'], first)
+                    summary['last'] = last if summary['last'] is None else max(summary['last'], last)
+                    if cache is not None:
+                        for symbol, df in ready.items():
+                            if len(df):
+                                cache.invalidate(symbol, None, df['timestamp'].min(), df['timestamp'].max())
+                summary['written'] += 1
+                next_seq[chunk.batch] += 1
+        return summary
+
+    try:
+        # The writer runs alongside the fetchers: if it fails (e.g. a DB error), the fetchers
+        # would otherwise block on the full queue forever, so the rest is cancelled and its
+        # error raised
+        writer = asyncio.create_task(write())
+        tasks = [writer] + [asyncio.create_task(fetch(chunk)) for chunk in chunks]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        summary = writer.result()
+        # Chunks are written without refreshing; bring the rollups up to date once, over everything written
+        if summary['rows']:
+            await loop.run_in_executor(write_pool, refresh_rollups, conn, summary['first'], summary['last'], table, rollups)
+        return summary
+    finally:
+        fetch_pool.shutdown(cancel_futures=True)
+        write_pool.shutdown()
+
 # Connect to TimescaleDB
-conn = psycopg2.connect(
-    dbname='algo_trading',
-    user='Archit',
-    password='Archit@1',
-    host='localhost',
-    port='5432'
-)
-cursor = conn.cursor()
-
-# Create table if it doesn't exist
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS alpaca_minute_data (
-        timestamp TIMESTAMPTZ,
-        symbol TEXT,
-        open FLOAT,
-        high FLOAT,
-        low FLOAT,
-        close FLOAT,
-        volume BIGINT,
-        PRIMARY KEY (timestamp, symbol)
-    );
-    SELECT create_hypertable('alpaca_minute_data', 'timestamp', if_not_exists => TRUE);
-""")
-conn.commit()
+def connect_db():
+    return psycopg2.connect(**conn_params)
+
+# Create table if it doesn't exist, with a continuous aggregate per rollup timeframe
+def create_schema(conn, table='alpaca_minute_data', rollups=ROLLUPS):
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            timestamp TIMESTAMPTZ,
+            symbol TEXT,
+            open FLOAT,
+            high FLOAT,
+            low FLOAT,
+            close FLOAT,
+            volume BIGINT,
+            PRIMARY KEY (timestamp, symbol)
+        );
+        SELECT create_hypertable('{table}', 'timestamp', if_not_exists => TRUE);
+    """)
+    conn.commit()
+    cursor.close()
+    create_rollups(conn, table, rollups)
+
+# Name of the continuous aggregate holding `table` rolled up to `timeframe`
+def rollup_view(table, timeframe):
+    return f"{table}_{timeframe}"
+
+# Continuous aggregates of OHLCV per (symbol, bucket), created empty and filled by
+# refresh_rollups. Real-time aggregation is on, so rows newer than the last refresh are
+# still aggregated on read. TimescaleDB indexes each aggregate on (symbol, bucket) for the
+# GROUP BY, so reading a symbol's range is a single index scan.
+def create_rollups(conn, table='alpaca_minute_data', rollups=ROLLUPS):
+    cursor = conn.cursor()
+    for timeframe, bucket in rollups.items():
+        view = rollup_view(table, timeframe)
+        cursor.execute(f"""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+            WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+            SELECT time_bucket(INTERVAL '{bucket}', timestamp) AS bucket, symbol,
+                   first(open, timestamp) AS open, MAX(high) AS high, MIN(low) AS low,
+                   last(close, timestamp) AS close, SUM(volume)::BIGINT AS volume
+            FROM {table}
+            GROUP BY symbol, bucket
+            WITH NO DATA;
+        """)
+    conn.commit()
+    cursor.close()
+
+# Earliest and latest bar timestamp in {symbol: DataFrame}
+def data_range(data):
+    return (min(df['timestamp'].min() for df in data.values()),
+            max(df['timestamp'].max() for df in data.values()))
+
+# Re-materialize the rollup buckets touched by minute bars between first and last.
+# refresh_continuous_aggregate only refreshes buckets lying entirely inside its window, so
+# the window is widened to whole buckets; it also cannot run inside a transaction, so the
+# refresh runs in autocommit mode.
+def refresh_rollups(conn, first, last, table='alpaca_minute_data', rollups=ROLLUPS):
+    if not rollups:
+        return
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        for timeframe in rollups:
+            width = pd.Timedelta(timeframe)
+            start = to_utc(first).floor(width)
+            end = to_utc(last).floor(width) + width
+            cursor.execute("CALL refresh_continuous_aggregate(%s, %s, %s);",
+                           (rollup_view(table, timeframe), start.to_pydatetime(), end.to_pydatetime()))
+    finally:
+        cursor.close()
+        conn.autocommit = autocommit
+
+# Insert minute-level data into TimescaleDB one row at a time
+def insert_rows(cursor, data, table='alpaca_minute_data'):
+    for symbol, df in data.items():
+        for index, row in df.iterrows():
+            cursor.execute(f"""
+                INSERT INTO {table} (timestamp, symbol, open, high, low, close, volume)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (timestamp, symbol) DO NOTHING;
+            """, (row['timestamp'], row['symbol'], row['open'], row['high'], row['low'], row['close'], row['volume']))
+
+# Stream each symbol's bars into the staging table with COPY FROM STDIN
+def copy_to_staging(cursor, data, staging):
+    columns = ', '.join(MINUTE_COLUMNS)
+    for symbol, df in data.items():
+        buffer = io.StringIO()
+        df[MINUTE_COLUMNS].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+# Load each symbol's bars into the staging table with batched multi-row INSERTs
+def values_to_staging(cursor, data, staging, page_size=5000):
+    columns = ', '.join(MINUTE_COLUMNS)
+    for symbol, df in data.items():
+        rows = list(df[MINUTE_COLUMNS].itertuples(index=False, name=None))
+        execute_values(cursor, f"INSERT INTO {staging} ({columns}) VALUES %s", rows, page_size=page_size)
 
 # Insert minute-level data into TimescaleDB
-def insert_data_to_db(data):
-    if data:
-        for symbol, df in data.items():
-            for index, row in df.iterrows():
-                cursor.execute("""
-                    INSERT INTO alpaca_minute_data (timestamp, symbol, open, high, low, close, volume)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (timestamp, symbol) DO NOTHING;
-                """, (row['timestamp'], row['symbol'], row['open'], row['high'], row['low'], row['close'], row['volume']))
-        conn.commit()
-
-# Fetch and insert data
-symbols = ['MCD', 'PEP', 'KO']
-data = fetch_alpaca_data(symbols, start, end)
-insert_data_to_db(data)
-
-# Close connection
-cursor.close()
-conn.close()
+# method='copy' and method='values' load every symbol into a temporary staging table and
+# merge it into the hypertable with a single set-based upsert; method='row' is the
+# original one-INSERT-per-bar path, kept for comparison. The rollups covering the inserted
+# range are refreshed after the commit (pass rollups={} to skip, e.g. when the caller
+# refreshes once after many inserts).
+def insert_data_to_db(data, conn, method='copy', table='alpaca_minute_data', rollups=ROLLUPS):
+    if not data:
+        return None
+
+    started = time.perf_counter()
+    rows = sum(len(df) for df in data.values())
+    cursor = conn.cursor()
+
+    if method == 'row':
+        insert_rows(cursor, data, table)
+    elif method in ('copy', 'values'):
+        staging = f"{table}_staging"
+        cursor.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {staging}
+            (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+        """)
+        if method == 'copy':
+            copy_to_staging(cursor, data, staging)
+        else:
+            values_to_staging(cursor, data, staging)
+        columns = ', '.join(MINUTE_COLUMNS)
+        cursor.execute(f"""
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM {staging}
+            ON CONFLICT (timestamp, symbol) DO NOTHING;
+        """)
+    else:
+        raise ValueError(f"Unknown insert method: {method}")
+
+    conn.commit()
+    cursor.close()
+
+    elapsed = time.perf_counter() - started
+    rows_per_sec = rows / elapsed if elapsed > 0 else float('inf')
+    print(f"Inserted {rows} rows with method '{method}' in {elapsed:.2f}s ({rows_per_sec:,.0f} rows/s)")
+
+    started = time.perf_counter()
+    refresh_rollups(conn, *data_range(data), table, rollups)
+    refresh_seconds = time.perf_counter() - started
+    return {'rows': rows, 'seconds': elapsed, 'rows_per_sec': rows_per_sec, 'refresh_seconds': refresh_seconds}
+
+if __name__ == '__main__':
+    # Alpaca API credentials
+    API_KEY = config("ALPACA_KEY")
+    SECRET_KEY = config("ALPACA_SECRET")
+
+    # Initialize Alpaca client
+    client = StockHistoricalDataClient(API_KEY, SECRET_KEY)
+
+    # Calculate start and end dates for older data
+    end_date = datetime.now() - timedelta(days=365)  # Adjust the date to be a year ago
+    start_date = end_date - timedelta(days=100)
+
+    # Format dates as strings
+    start = start_date.strftime('%Y-%m-%d')
+    end = end_date.strftime('%Y-%m-%d')
+
+    # Print start and end dates for verification
+    print(f"Fetching data from {start} to {end}")
+
+    # Connect to TimescaleDB
+    conn = connect_db()
+    create_schema(conn)
+
+    # Fetch and insert data, resuming from whatever is already stored
+    symbols = ['MCD', 'PEP', 'KO']
+    summary = asyncio.run(fetch_and_store(client, conn, symbols, start, end, cache=BarCache()))
+    print(f"Wrote {summary['rows']} rows from {summary['written']}/{summary['chunks']} chunks")
+
+    # Close connection
+    conn.close()
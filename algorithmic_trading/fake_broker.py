@@ -0,0 +1,107 @@
+import asyncio
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+
+# Offline stand-in for alpaca's REST client, for tests and replays of the live engines.
+# submit_order sleeps `latency` seconds like an HTTP round trip and returns a new order;
+# orders fill `fill_delay` seconds later (in `partial_fills` equal steps), and a
+# `reject_rate` fraction is rejected. Order state is visible through get_order and
+# list_orders, and stream_trade_updates pushes the same events the trade-updates
+# stream would.
+class FakeBroker:
+    def __init__(self, latency=0.0, fill_delay=0.0, partial_fills=1, reject_rate=0.0, price=None, seed=0):
+        self.latency = latency
+        self.fill_delay = fill_delay
+        self.partial_fills = partial_fills
+        self.reject_rate = reject_rate
+        self.price = price  # optional price(symbol) -> fill price
+        self.rng = np.random.default_rng(seed)
+        self.ids = itertools.count(1)
+        self.orders = {}
+        self.events = []
+        self.lock = threading.Lock()
+        self.submitted = 0
+
+    def submit_order(self, symbol, qty, side, type='market', time_in_force='gtc', **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.submitted += 1
+            order = SimpleNamespace(
+                id=f"fake-{next(self.ids)}",
+                symbol=symbol,
+                qty=str(qty),
+                filled_qty='0',
+                filled_avg_price=None,
+                side=side,
+                type=type,
+                time_in_force=time_in_force,
+                status='new',
+                submitted_at=time.time(),
+                fills_done=0,
+                rejected=self.rng.random() < self.reject_rate
+            )
+            self.orders[order.id] = order
+            self._advance(order)
+            return self._snapshot(order)
+
+    def get_order(self, order_id):
+        with self.lock:
+            order = self.orders[order_id]
+            self._advance(order)
+            return self._snapshot(order)
+
+    def list_orders(self, status='open', limit=50, after=None, direction='desc', **kwargs):
+        with self.lock:
+            orders = list(self.orders.values())
+            for order in orders:
+                self._advance(order)
+            if status == 'open':
+                orders = [o for o in orders if o.status in ('new', 'partially_filled')]
+            elif status == 'closed':
+                orders = [o for o in orders if o.status not in ('new', 'partially_filled')]
+            if direction == 'desc':
+                orders = orders[::-1]
+            return [self._snapshot(o) for o in orders[:limit]]
+
+    # Push trade-updates events to handler(data) as orders fill, like stream.subscribe_trade_updates
+    async def stream_trade_updates(self, handler, interval=0.01):
+        sent = 0
+        while True:
+            with self.lock:
+                for order in list(self.orders.values()):
+                    self._advance(order)
+                events = self.events[sent:]
+                sent = len(self.events)
+            for event in events:
+                await handler(event)
+            await asyncio.sleep(interval)
+
+    # Move an order forward to the state it should have reached by now
+    def _advance(self, order):
+        if order.status not in ('new', 'partially_filled'):
+            return
+        if order.rejected:
+            order.status = 'rejected'
+            self._event('rejected', order)
+            return
+
+        elapsed = time.time() - order.submitted_at
+        steps = self.partial_fills if self.fill_delay <= 0 else min(self.partial_fills, int(elapsed / self.fill_delay * self.partial_fills))
+        while order.fills_done < steps:
+            order.fills_done += 1
+            qty = float(order.qty)
+            order.filled_qty = str(qty if order.fills_done == self.partial_fills else qty * order.fills_done // self.partial_fills)
+            if self.price is not None:
+                order.filled_avg_price = str(self.price(order.symbol))
+            order.status = 'filled' if order.fills_done == self.partial_fills else 'partially_filled'
+            self._event('fill' if order.status == 'filled' else 'partial_fill', order)
+
+    def _event(self, event, order):
+        self.events.append({'event': event, 'order': vars(self._snapshot(order))})
+
+    def _snapshot(self, order):
+        return SimpleNamespace(**{k: v for k, v in vars(order).items() if k not in ('fills_done', 'rejected')})
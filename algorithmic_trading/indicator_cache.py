@@ -0,0 +1,93 @@
+import collections
+import functools
+import hashlib
+import time
+import numpy as np
+
+# Memoizes indicator outputs keyed by (data fingerprint, indicator, params).
+# Parameter sweeps rebuild the same EMA/ADX/BBANDS series over and over (the EMA
+# only depends on ema_window, not on the ADX settings), so each distinct series is
+# computed once and served from memory afterwards. Entries are evicted least
+# recently used once their arrays exceed max_bytes.
+class IndicatorCache:
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.compute_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    # Wrap an indicator function (e.g. talib.EMA) so its results are memoized
+    def __call__(self, func):
+        @functools.wraps(func)
+        def cached(*args, **kwargs):
+            arrays = [arg for arg in args if isinstance(arg, np.ndarray)]
+            params = tuple((i, arg) for i, arg in enumerate(args) if not isinstance(arg, np.ndarray))
+            key = (self.fingerprint(*arrays), func.__name__, params, tuple(sorted(kwargs.items())))
+
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[2]
+                return entry[0]
+
+            started = time.perf_counter()
+            value = func(*args, **kwargs)
+            elapsed = time.perf_counter() - started
+            self.misses += 1
+            self.compute_seconds += elapsed
+            self._store(key, value, elapsed)
+            return value
+        return cached
+
+    # Content hash of the input arrays; cheap next to the indicators themselves
+    @staticmethod
+    def fingerprint(*arrays):
+        digest = hashlib.blake2b(digest_size=16)
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update(str((array.dtype.str, array.shape)).encode())
+            digest.update(memoryview(array).cast('B'))
+        return digest.digest()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'compute_seconds': self.compute_seconds,
+            'saved_seconds': self.saved_seconds
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def _store(self, key, value, elapsed):
+        size = sum(v.nbytes for v in value) if isinstance(value, tuple) else getattr(value, 'nbytes', 0)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size, elapsed)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+
+# Add up stats() from several caches, e.g. one per optimization worker process
+def merge_stats(stats_list):
+    merged = {key: 0 for key in ('hits', 'misses', 'entries', 'bytes', 'compute_seconds', 'saved_seconds')}
+    for stats in stats_list:
+        for key in merged:
+            merged[key] += stats[key]
+    lookups = merged['hits'] + merged['misses']
+    merged['hit_rate'] = merged['hits'] / lookups if lookups else 0.0
+    return merged
+
+# Process-wide cache shared by the backtest strategies
+INDICATOR_CACHE = IndicatorCache()
@@ -0,0 +1,184 @@
+import collections
+import json
+import math
+
+# Incremental indicators for the live engines. Each update() takes one bar in O(1)
+# and returns the latest value, which is NaN until talib would produce its first
+# output and from then on matches talib run over every bar seen so far.
+
+# Same thresholds as TA-Lib's TA_IS_ZERO / TA_IS_ZERO_OR_NEG
+def _is_zero(x):
+    return -1e-8 < x < 1e-8
+
+# Exponential moving average seeded with the SMA of the first `period` closes (talib.EMA)
+class EMA:
+    def __init__(self, period):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.count = 0
+        self.total = 0.0
+        self.value = math.nan
+
+    def update(self, close):
+        self.count += 1
+        if self.count < self.period:
+            self.total += close
+        elif self.count == self.period:
+            self.value = (self.total + close) / self.period
+        else:
+            self.value += (close - self.value) * self.k
+        return self.value
+
+# Wilder-smoothed +DI/-DI and ADX, following TA-Lib's ADX: directional movement and
+# true range are summed over the first period-1 bars and smoothed from then on, and the
+# first ADX (bar 2*period-1) is the mean of the first `period` DX values. The arithmetic
+# is done in TA-Lib's order, so the values are bitwise equal to talib.ADX.
+class ADX:
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.prev_high = self.prev_low = self.prev_close = None
+        self.plus_dm = 0.0
+        self.minus_dm = 0.0
+        self.tr = 0.0
+        self.sum_dx = 0.0
+        self.plus_di = math.nan
+        self.minus_di = math.nan
+        self.value = math.nan
+
+    def update(self, high, low, close):
+        n = self.period
+        self.count += 1
+        if self.count == 1:
+            self.prev_high, self.prev_low, self.prev_close = high, low, close
+            return self.value
+
+        diff_plus = high - self.prev_high
+        diff_minus = self.prev_low - low
+        true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_high, self.prev_low, self.prev_close = high, low, close
+
+        if self.count > n:
+            self.plus_dm -= self.plus_dm / n
+            self.minus_dm -= self.minus_dm / n
+            self.tr -= self.tr / n
+        if diff_minus > 0 and diff_plus < diff_minus:
+            self.minus_dm += diff_minus
+        elif diff_plus > 0 and diff_plus > diff_minus:
+            self.plus_dm += diff_plus
+        self.tr += true_range
+        if self.count <= n:
+            return self.value
+
+        dx = None
+        if not _is_zero(self.tr):
+            self.plus_di = 100.0 * (self.plus_dm / self.tr)
+            self.minus_di = 100.0 * (self.minus_dm / self.tr)
+            di_sum = self.minus_di + self.plus_di
+            if not _is_zero(di_sum):
+                dx = 100.0 * (abs(self.minus_di - self.plus_di) / di_sum)
+
+        if self.count <= 2 * n:
+            if dx is not None:
+                self.sum_dx += dx
+            if self.count == 2 * n:
+                self.value = self.sum_dx / n
+        elif dx is not None:
+            self.value = (self.value * (n - 1) + dx) / n
+        return self.value
+
+# Bollinger Bands over a simple moving average (talib.BBANDS with matype=0), from running
+# sums of the window's closes and squared closes. The sums are rebuilt from the window
+# every `resum_every` updates so rounding errors cannot accumulate on long streams.
+class BollingerBands:
+    def __init__(self, period, num_std_dev=2.0, resum_every=1024):
+        self.period = period
+        self.num_std_dev = num_std_dev
+        self.resum_every = resum_every
+        self.window = collections.deque(maxlen=period)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.updates = 0
+        self.upper = self.middle = self.lower = math.nan
+
+    def update(self, close):
+        if len(self.window) == self.period:
+            oldest = self.window[0]
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+        self.window.append(close)
+        self.total += close
+        self.total_sq += close * close
+
+        self.updates += 1
+        if self.updates % self.resum_every == 0:
+            self.total = math.fsum(self.window)
+            self.total_sq = math.fsum(x * x for x in self.window)
+        if len(self.window) < self.period:
+            return self.upper, self.middle, self.lower
+
+        mean = self.total / self.period
+        variance = self.total_sq / self.period - mean * mean
+        deviation = math.sqrt(variance) if variance >= 1e-8 else 0.0
+        self.middle = mean
+        self.upper = mean + self.num_std_dev * deviation
+        self.lower = mean - self.num_std_dev * deviation
+        return self.upper, self.middle, self.lower
+
+# Bars of history a STRATEGY_PARAMS entry needs: its longest window
+def history_length(params):
+    return max(value for key, value in params.items() if key.endswith('window'))
+
+# Indicator state for one symbol, built from its STRATEGY_PARAMS entry
+class StrategyIndicators:
+    def __init__(self, params):
+        self.params = params
+        self.strategy = params['strategy']
+        if self.strategy == 'ema_adx':
+            self.ema = EMA(params['ema_window'])
+            self.adx = ADX(params['adx_window'])
+        elif self.strategy == 'bollinger_bands':
+            self.bbands = BollingerBands(params['window'], params['num_std_dev'])
+        else:
+            raise ValueError(f"Unknown strategy: {self.strategy}")
+
+    def update(self, high, low, close):
+        if self.strategy == 'ema_adx':
+            self.ema.update(close)
+            self.adx.update(high, low, close)
+        else:
+            self.bbands.update(close)
+
+    # True once every indicator of the strategy has a value
+    def ready(self):
+        if self.strategy == 'ema_adx':
+            return not (math.isnan(self.ema.value) or math.isnan(self.adx.value))
+        return not math.isnan(self.bbands.middle)
+
+    # Trading signal for the latest bar close, with the same rules as the live engines'
+    # execute_ema_adx / execute_bollinger_bands: 'buy', 'sell' or None
+    def signal(self, price):
+        if not self.ready():
+            return None
+        if self.strategy == 'ema_adx':
+            if self.adx.value > self.params['adx_threshold']:
+                if price > self.ema.value:
+                    return 'buy'
+                if price < self.ema.value:
+                    return 'sell'
+            return None
+        if price < self.bbands.lower:
+            return 'buy'
+        if price > self.bbands.upper:
+            return 'sell'
+        return None
+
+# Load live-engine configuration from a JSON file of the form
+# {"strategies": {symbol: STRATEGY_PARAMS entry}, "risk": {RISK_MANAGEMENT_PARAMS overrides}}
+def load_live_config(path):
+    with open(path) as f:
+        live_config = json.load(f)
+    for symbol, params in live_config['strategies'].items():
+        StrategyIndicators(params)  # validates the strategy name and parameters
+    live_config.setdefault('risk', {})
+    return live_config
@@ -0,0 +1,176 @@
+import asyncio
+import collections
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Low-overhead latency and counter instrumentation for the live engines.
+# Stages of the tick-to-order path are timed with perf_counter_ns into HDR-style
+# histograms per (stage, symbol); snapshots are logged periodically and/or served as
+# JSON from a local HTTP endpoint.
+
+# Log-linear latency histogram in nanoseconds: values below 64 are exact, above that
+# every power of two is split into 32 buckets, so any recorded value is within ~3%.
+# Recording is an integer bucket increment; values past ~18 minutes land in the last bucket.
+class LatencyHistogram:
+    SUB_BITS = 5
+    MAX_SHIFT = 34
+
+    def __init__(self):
+        self.counts = [0] * (64 + self.MAX_SHIFT * 32)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        if ns < 64:
+            index = ns if ns > 0 else 0
+        else:
+            shift = min(ns.bit_length() - 6, self.MAX_SHIFT)
+            index = min(64 + (shift - 1) * 32 + (ns >> shift) - 32, len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    # Lowest value of a bucket
+    @staticmethod
+    def bucket_value(index):
+        if index < 64:
+            return index
+        shift = (index - 64) // 32 + 1
+        return (32 + (index - 64) % 32) << shift
+
+    def percentile(self, q):
+        if not self.count:
+            return 0
+        rank = max(1, int(round(q / 100 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_value(index), self.max)
+        return self.max
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count / 1e3 if self.count else 0.0,
+            'p50_us': self.percentile(50) / 1e3,
+            'p90_us': self.percentile(90) / 1e3,
+            'p99_us': self.percentile(99) / 1e3,
+            'p99.9_us': self.percentile(99.9) / 1e3,
+            'max_us': self.max / 1e3
+        }
+
+# Histograms and counters per (name, symbol). lap() is the hot-path call:
+#     t = METRICS.now()
+#     ...stage work...
+#     t = METRICS.lap('indicators', symbol, t)
+# With enabled=False both calls return immediately.
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = collections.Counter()
+        self.started = time.time()
+
+    def now(self):
+        return time.perf_counter_ns() if self.enabled else 0
+
+    # Record the time since `started` for a stage and return the current time
+    def lap(self, stage, symbol, started):
+        if not self.enabled:
+            return 0
+        now = time.perf_counter_ns()
+        histogram = self.histograms.get((stage, symbol))
+        if histogram is None:
+            histogram = self.histograms[(stage, symbol)] = LatencyHistogram()
+        histogram.record(now - started)
+        return now
+
+    def count(self, name, symbol, n=1):
+        if self.enabled:
+            self.counters[(name, symbol)] += n
+
+    # {'stages': {stage: {'all': summary, symbol: summary}}, 'counters': {name: {'all': n, symbol: n}}}
+    def snapshot(self):
+        stages = {}
+        for (stage, symbol), histogram in list(self.histograms.items()):
+            entry = stages.setdefault(stage, {'all': LatencyHistogram()})
+            entry['all'].merge(histogram)
+            entry[symbol] = histogram.summary()
+        for entry in stages.values():
+            entry['all'] = entry['all'].summary()
+
+        counters = {}
+        for (name, symbol), n in list(self.counters.items()):
+            entry = counters.setdefault(name, {'all': 0})
+            entry['all'] += n
+            entry[symbol] = n
+        return {'uptime_s': time.time() - self.started, 'stages': stages, 'counters': counters}
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+        self.started = time.time()
+
+    # Log a one-line summary per stage every `interval` seconds
+    async def run_snapshots(self, interval=60.0):
+        while True:
+            await asyncio.sleep(interval)
+            snapshot = self.snapshot()
+            for stage, entry in snapshot['stages'].items():
+                s = entry['all']
+                logging.info(f"[metrics] {stage}: n={s['count']} p50={s['p50_us']:.1f}us "
+                             f"p99={s['p99_us']:.1f}us max={s['max_us']:.1f}us")
+            logging.info(f"[metrics] counters: " + ', '.join(f"{name}={entry['all']}" for name, entry in snapshot['counters'].items()))
+
+    # Serve snapshot() as JSON on http://host:port/ from a daemon thread
+    def serve(self, port, host='127.0.0.1'):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+# Logs every `every`-th call (0 disables it), with lazy %-formatting so skipped calls
+# cost one counter increment; replaces unconditional per-trade logging
+class SampledLog:
+    def __init__(self, every=0, level=logging.INFO):
+        self.every = every
+        self.level = level
+        self.calls = 0
+
+    def __call__(self, message, *args):
+        if not self.every:
+            return
+        self.calls += 1
+        if self.calls % self.every == 0:
+            logging.log(self.level, message, *args)
+
+# Process-wide metrics shared by the live engine modules
+METRICS = Metrics()
@@ -0,0 +1,171 @@
+import asyncio
+import collections
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Order updates from the trade-updates stream are dicts, REST orders are entities
+def _field(obj, name, default=None):
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+# Order states after which no further fills arrive
+FINAL_STATUSES = {'filled', 'canceled', 'expired', 'rejected', 'done_for_day', 'replaced'}
+
+# Notional of an order signed by side: positive for buys, negative for sells
+def signed_notional(qty, price, side):
+    return qty * price if side == 'buy' else -qty * price
+
+# Pre-trade position check shared by risk.py, sharded_engine.py and portfolio_backtest.py.
+# An order is blocked if it would take the position plus the signed notional of orders in
+# flight past max_position_size. Sells only shrink the position, so they always pass.
+# Also works elementwise on arrays of positions and signed notionals.
+def exceeds_position_limit(position, pending, notional, max_position_size):
+    return (notional > 0) & (position + pending + notional > max_position_size)
+
+# Non-blocking order handling for the live engines. Orders are submitted through a
+# thread pool so the blocking REST call never runs on the event loop, and fills are
+# tracked from the trade-updates stream (on_trade_update), with batched list_orders
+# polling as a fallback for updates the stream missed. Many orders can be in flight at
+# once; on_fill(symbol, side, qty, entry_price) is called for every newly filled
+# quantity and finished orders are removed from active_orders.
+class OrderManager:
+    def __init__(self, rest_api, active_orders=None, on_fill=None, max_workers=4, poll_interval=1.0, metrics=None):
+        self.rest_api = rest_api
+        self.active_orders = {} if active_orders is None else active_orders
+        self.on_fill = on_fill
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.orders = {}  # order id -> {'symbol', 'side', 'qty', 'entry_price', 'filled', 'submitted_at'}
+        self.early_updates = {}  # updates that arrived before submit_order returned
+        self.submitting = collections.Counter()  # symbol -> signed notional of orders not yet acknowledged
+        self.tasks = set()
+
+    # Submit an order in the background and return immediately; safe to call from
+    # synchronous code running on the event loop
+    def submit_nowait(self, symbol, qty, side, entry_price):
+        self.submitting[symbol] += signed_notional(qty, entry_price, side)
+        task = asyncio.get_running_loop().create_task(self._submit_reserved(symbol, qty, side, entry_price))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _submit_reserved(self, symbol, qty, side, entry_price):
+        try:
+            return await self.submit(symbol, qty, side, entry_price)
+        finally:
+            self.submitting[symbol] -= signed_notional(qty, entry_price, side)
+
+    async def submit(self, symbol, qty, side, entry_price):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter_ns()
+        try:
+            order = await loop.run_in_executor(self.executor, lambda: self.rest_api.submit_order(
+                symbol=symbol,
+                qty=qty,
+                side=side,
+                type='market',
+                time_in_force='gtc'
+            ))
+        except Exception as e:
+            logging.error(f"Error placing order for {symbol}: {e}")
+            if self.metrics is not None:
+                self.metrics.count('order_errors', symbol)
+            return None
+        if self.metrics is not None:
+            self.metrics.lap('order_ack', symbol, started)
+            self.metrics.count('orders_submitted', symbol)
+
+        self.active_orders[order.id] = order
+        self.orders[order.id] = {
+            'symbol': symbol,
+            'side': side,
+            'qty': float(qty),
+            'entry_price': entry_price,
+            'filled': 0.0,
+            'submitted_at': time.time()
+        }
+        logging.info(f"Order placed: {side} {qty} shares of {symbol} at {entry_price}")
+
+        # Apply the order as returned, then any stream update that beat the REST response
+        self._apply(order)
+        update = self.early_updates.pop(order.id, None)
+        if update is not None:
+            self._apply(update)
+        return order
+
+    # Handler for stream.subscribe_trade_updates
+    async def on_trade_update(self, data):
+        order = _field(data, 'order')
+        if order is None:
+            return
+        order_id = _field(order, 'id')
+        if order_id in self.orders:
+            self._apply(order)
+        else:
+            # Probably an order whose submit_order call hasn't returned yet; keep a bounded
+            # number so updates for orders placed elsewhere don't pile up
+            self.early_updates[order_id] = order
+            if len(self.early_updates) > 1000:
+                self.early_updates.pop(next(iter(self.early_updates)))
+
+    # Fallback: fetch the state of every in-flight order with one list_orders call
+    async def poll(self):
+        if not self.orders:
+            return
+        loop = asyncio.get_running_loop()
+        oldest = min(record['submitted_at'] for record in self.orders.values())
+        after = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(oldest - 60))
+        try:
+            orders = await loop.run_in_executor(self.executor, lambda: self.rest_api.list_orders(
+                status='all', after=after, limit=500, direction='asc'))
+        except Exception as e:
+            logging.error(f"Error polling orders: {e}")
+            return
+        for order in orders:
+            if _field(order, 'id') in self.orders:
+                self._apply(order)
+
+    # Poll every poll_interval seconds while the engine runs
+    async def run_polling(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.poll()
+
+    # Signed notional of orders submitted but not yet filled (buys add, sells subtract),
+    # for the pre-trade position check
+    def pending_exposure(self, symbol):
+        return self.submitting[symbol] + sum(signed_notional(record['qty'] - record['filled'], record['entry_price'], record['side'])
+                                             for record in self.orders.values() if record['symbol'] == symbol)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    # Record fills from an order snapshot; snapshots can arrive out of order and twice
+    # (stream and poll), so only quantity beyond what was already recorded counts
+    def _apply(self, order):
+        order_id = _field(order, 'id')
+        record = self.orders.get(order_id)
+        if record is None:
+            return
+
+        filled = float(_field(order, 'filled_qty') or 0)
+        if filled > record['filled']:
+            new_qty = filled - record['filled']
+            record['filled'] = filled
+            if self.metrics is not None:
+                self.metrics.count('fills', record['symbol'])
+            if self.on_fill is not None:
+                self.on_fill(record['symbol'], record['side'], new_qty, record['entry_price'])
+
+        status = _field(order, 'status')
+        if record['filled'] >= record['qty']:
+            logging.info(f"Order fully filled for {record['symbol']}.")
+        elif status in FINAL_STATUSES:
+            logging.warning(f"Order for {record['symbol']} was {status}.")
+        else:
+            return
+        del self.orders[order_id]
+        self.active_orders.pop(order_id, None)
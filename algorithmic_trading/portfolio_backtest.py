@@ -0,0 +1,253 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import talib
+from backtest import BACKTEST_KWARGS, load_symbol_bars, minute_high_water
+from bar_cache import BarCache
+from live_indicators import load_live_config
+from order_manager import exceeds_position_limit
+
+# Portfolio backtest of the live risk engine (risk.py) over many symbols at once: every
+# symbol trades out of one shared cash balance on the union of their bar timestamps, with
+# the live strategy rules (StrategyIndicators.signal: EMA/ADX and Bollinger levels, `qty`
+# shares per signal) and the checks of place_order_with_var before each order:
+# - per-symbol historical VaR of the order must not exceed max_position_size
+# - dollar exposure (risk.update_positions bookkeeping) plus orders in flight plus the order must not
+#   exceed max_position_size, by the same order_manager.exceeds_position_limit check (sells always pass)
+# - portfolio VaR with the order added must not exceed max_portfolio_var, when set
+# Held positions are closed at stop_loss_pct below / take_profit_pct above their average
+# entry price. Orders placed at a bar's close fill at the symbol's next open, as in Backtest.
+# Positions are long only: a sell signal sells up to `qty` of the shares held.
+# Indicators, VaR and the return scenarios are precomputed as (bars x symbols) arrays, and
+# the bar loop only does array operations across symbols, so the cost grows with the
+# number of bars rather than one Backtest per symbol.
+
+# Risk limits, as in risk.py's RISK_MANAGEMENT_PARAMS; a config file's "risk" section overrides them
+DEFAULT_RISK_PARAMS = {
+    'max_position_size': 10000,
+    'stop_loss_pct': 0.02,
+    'take_profit_pct': 0.05,
+    'var_confidence_level': 0.95,
+    'var_lookback': 100,
+    'max_portfolio_var': None
+}
+
+# Reasons an order can be blocked or skipped, counted in the results
+BLOCK_REASONS = ['var', 'position_size', 'portfolio_var', 'cash']
+
+# Buy (+1) / sell (-1) signals of one symbol's bars under the live rules of its
+# STRATEGY_PARAMS entry; 0 while its indicators are warming up
+def live_signals(df, params):
+    close = df['Close'].to_numpy(np.float64)
+    with np.errstate(invalid='ignore'):
+        if params['strategy'] == 'ema_adx':
+            ema = talib.EMA(close, params['ema_window'])
+            adx = talib.ADX(df['High'].to_numpy(np.float64), df['Low'].to_numpy(np.float64), close, timeperiod=params['adx_window'])
+            trending = adx > params['adx_threshold']
+            buy = trending & (close > ema)
+            sell = trending & (close < ema)
+        else:
+            upper, _, lower = talib.BBANDS(close, timeperiod=params['window'], nbdevup=params['num_std_dev'],
+                                           nbdevdn=params['num_std_dev'], matype=0)
+            buy = close < lower
+            sell = ~buy & (close > upper)
+    return buy.astype(np.int8) - sell.astype(np.int8)
+
+# Historical VaR of one share at each bar of one symbol, as RollingVaR.var(): the
+# (1 - confidence_level) quantile of the last lookback - 1 log returns times the close;
+# NaN until there are lookback closes
+def rolling_var(close, lookback=100, confidence_level=0.95):
+    returns = np.log(close).diff()
+    quantile = returns.rolling(lookback - 1).quantile(1 - confidence_level)
+    return (close * quantile.abs()).to_numpy(np.float64)
+
+# Bars of every symbol as (bars x symbols) arrays on the union of their timestamps
+class PortfolioBars:
+    def __init__(self, frames, strategies, risk_params):
+        self.symbols = list(frames)
+        self.index = pd.DatetimeIndex(sorted(set().union(*(df.index for df in frames.values()))))
+        n, m = len(self.index), len(self.symbols)
+        self.open = np.full((n, m), np.nan)
+        self.high = np.full((n, m), np.nan)
+        self.low = np.full((n, m), np.nan)
+        self.close = np.full((n, m), np.nan)
+        self.signal = np.zeros((n, m), dtype=np.int8)
+        self.var = np.full((n, m), np.nan)
+        lookback, confidence_level = risk_params['var_lookback'], risk_params['var_confidence_level']
+        for j, (symbol, df) in enumerate(frames.items()):
+            rows = self.index.get_indexer(df.index)
+            self.open[rows, j] = df['Open'].to_numpy(np.float64)
+            self.high[rows, j] = df['High'].to_numpy(np.float64)
+            self.low[rows, j] = df['Low'].to_numpy(np.float64)
+            self.close[rows, j] = df['Close'].to_numpy(np.float64)
+            self.signal[rows, j] = live_signals(df, strategies[symbol])
+            self.var[rows, j] = rolling_var(df['Close'], lookback, confidence_level)
+
+        self.has_bar = ~np.isnan(self.close)
+        # Mark-to-market price: the latest close, carried over bars a symbol has no trade in
+        self.mark = pd.DataFrame(self.close).ffill().to_numpy()
+        # Joint return scenarios for portfolio VaR: simple returns of the marks (0 where a
+        # symbol has no bar), and whether a symbol has lookback closes of its own yet
+        with np.errstate(invalid='ignore'):
+            self.scenarios = np.nan_to_num(np.vstack([np.zeros((1, m)), self.mark[1:] / self.mark[:-1] - 1]))
+        self.var_ready = np.cumsum(self.has_bar, axis=0) >= lookback
+
+# Loss at the confidence level of each candidate order added to the current exposures,
+# replaying the last lookback - 1 bars of returns as joint scenarios (see portfolio_var)
+def _portfolio_var(window, exposure, candidates, deltas, confidence_level):
+    pnl = (window @ exposure)[:, None] + window[:, candidates] * deltas
+    return np.maximum(0.0, -np.percentile(pnl, (1 - confidence_level) * 100, axis=0))
+
+# Step the whole portfolio through the bars. Returns the equity curve (Series), the
+# per-symbol results (DataFrame) and portfolio stats (dict).
+def portfolio_backtest(frames, strategies, risk_params=None, cash=100000, commission=BACKTEST_KWARGS['commission'], qty=1):
+    risk = {**DEFAULT_RISK_PARAMS, **(risk_params or {})}
+    bars = PortfolioBars(frames, strategies, risk)
+    n, m = bars.close.shape
+    max_position_size = risk['max_position_size']
+    stop_loss, take_profit = risk['stop_loss_pct'], risk['take_profit_pct']
+    max_portfolio_var = risk['max_portfolio_var']
+    window = risk['var_lookback'] - 1
+    confidence_level = risk['var_confidence_level']
+
+    shares = np.zeros(m)
+    entry = np.zeros(m)  # average entry price of the shares held
+    exposure = np.zeros(m)  # dollars, as risk.open_positions
+    pending = np.zeros(m)  # shares to buy (+) / sell (-) at each symbol's next open
+    equity = np.empty(n)
+    counts = {name: np.zeros(m, dtype=np.int64) for name in ['buys', 'sells', 'stop_losses', 'take_profits'] + BLOCK_REASONS}
+
+    for t in range(n):
+        has_bar = bars.has_bar[t]
+        price = bars.open[t]
+
+        # Fill orders from the previous bar, sells first so their cash is available to buys
+        fill = (pending != 0) & has_bar
+        if fill.any():
+            sell = fill & (pending < 0)
+            sold = np.where(sell, np.minimum(-pending, shares), 0.0)
+            cash += np.sum(sold * np.where(sell, price, 0.0) * (1 - commission))
+            shares -= sold
+            exposure = np.where(sell, np.maximum(0.0, exposure - sold * np.where(sell, price, 0.0)), exposure)
+            counts['sells'] += sell & (sold > 0)
+
+            buy = np.flatnonzero(fill & (pending > 0))
+            cost = pending[buy] * price[buy] * (1 + commission)
+            # Shared cash: buys fill in symbol order, skipping those the remaining cash can't cover
+            affordable = np.cumsum(cost) <= cash
+            if not affordable.all():
+                left = cash
+                for i, c in enumerate(cost.tolist()):
+                    affordable[i] = c <= left
+                    left -= c if affordable[i] else 0.0
+            counts['cash'][buy[~affordable]] += 1
+            buy, cost = buy[affordable], cost[affordable]
+            bought = pending[buy]
+            cash -= cost.sum()
+            entry[buy] = (entry[buy] * shares[buy] + bought * price[buy]) / (shares[buy] + bought)
+            shares[buy] += bought
+            exposure[buy] += bought * price[buy]
+            counts['buys'][buy] += 1
+            pending[fill] = 0.0
+
+        # Stop-loss / take-profit on the bar's range; gaps through a level fill at the open,
+        # and a bar reaching both is counted as the stop (the worse case)
+        held = (shares > 0) & has_bar
+        if held.any() and (stop_loss is not None or take_profit is not None):
+            with np.errstate(invalid='ignore'):
+                stopped = held & (bars.low[t] <= entry * (1 - stop_loss)) if stop_loss is not None else np.zeros(m, dtype=bool)
+                taken = held & ~stopped & (bars.high[t] >= entry * (1 + take_profit)) if take_profit is not None else np.zeros(m, dtype=bool)
+            if stopped.any() or taken.any():
+                exit_price = np.where(stopped, np.minimum(price, entry * (1 - (stop_loss or 0))),
+                                      np.maximum(price, entry * (1 + (take_profit or 0))))
+                out = stopped | taken
+                cash += np.sum(shares[out] * exit_price[out] * (1 - commission))
+                shares[out] = 0.0
+                exposure[out] = 0.0
+                counts['stop_losses'] += stopped
+                counts['take_profits'] += taken
+
+        equity[t] = cash + shares @ np.nan_to_num(bars.mark[t])
+
+        # New orders on this bar's signals, through the checks of place_order_with_var
+        signal = bars.signal[t]
+        candidates = np.flatnonzero(((signal > 0) | ((signal < 0) & (shares > 0))) & has_bar)
+        if not len(candidates):
+            continue
+        close = bars.close[t, candidates]
+        side = signal[candidates].astype(np.float64)
+        var = bars.var[t, candidates] * qty
+        ok = ~(np.isnan(var) | (var > max_position_size))
+        counts['var'][candidates[~ok]] += 1
+
+        notional = side * qty * close
+        over = ok & exceeds_position_limit(exposure[candidates], pending[candidates] * close, notional, max_position_size)
+        counts['position_size'][candidates[over]] += 1
+        ok &= ~over
+
+        if max_portfolio_var is not None and ok.any():
+            held = exposure > 0
+            if bars.var_ready[t][held].all() and t >= window:
+                scenarios = bars.scenarios[t - window + 1:t + 1]
+                ready = bars.var_ready[t, candidates]
+                var = _portfolio_var(scenarios, exposure, candidates, notional, confidence_level)
+                over = ok & ~(ready & (var <= max_portfolio_var))
+            else:
+                over = ok
+            counts['portfolio_var'][candidates[over]] += 1
+            ok &= ~over
+
+        pending[candidates[ok]] = side[ok] * qty
+
+    equity = pd.Series(equity, index=bars.index, name='Equity')
+    last_mark = np.nan_to_num(bars.mark[-1]) if n else np.zeros(m)
+    per_symbol = pd.DataFrame({'shares': shares, 'value': shares * last_mark, **counts}, index=pd.Index(bars.symbols, name='symbol'))
+    return equity, per_symbol, portfolio_stats(equity)
+
+# Backtest-style stats of a portfolio equity curve
+def portfolio_stats(equity):
+    if equity.empty:
+        return {}
+    peak = equity.cummax()
+    return {
+        'Start': equity.index[0],
+        'End': equity.index[-1],
+        'Equity Final [$]': equity.iat[-1],
+        'Equity Peak [$]': peak.iat[-1],
+        'Return [%]': (equity.iat[-1] - equity.iat[0]) / equity.iat[0] * 100,
+        'Max. Drawdown [%]': -(1 - equity / peak).max() * 100
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shared-cash portfolio backtest with the live risk checks')
+    parser.add_argument('--config', default='strategy_params.json', help='live config file (strategies and risk)')
+    parser.add_argument('--start', default='2023-05-15')
+    parser.add_argument('--end', default='2023-08-23')
+    parser.add_argument('--cash', type=float, default=100000)
+    parser.add_argument('--qty', type=int, default=1, help='shares per signal, 1 as in the live engines')
+    parser.add_argument('--synthetic', type=int, default=0, help='run on this many synthetic symbols instead')
+    parser.add_argument('--days', type=int, default=60, help='sessions of synthetic bars')
+    args = parser.parse_args()
+
+    live_config = load_live_config(args.config)
+    if args.synthetic:
+        from backtest import resample_bars
+        from sharded_engine import synthetic_strategies
+        from synthetic_data import synthetic_minute_bars
+        strategies = synthetic_strategies(args.synthetic)
+        minute = pd.concat(synthetic_minute_bars(list(strategies), days=args.days, start=args.start).values())
+        bars = resample_bars(minute.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'volume': 'Volume'}))
+        frames = {symbol: df.droplevel('symbol') for symbol, df in bars.groupby(level='symbol', sort=False)}
+    else:
+        strategies = live_config['strategies']
+        cache = BarCache(high_water=minute_high_water)
+        frames = {symbol: cache.load_frame(symbol, '15min', args.start, args.end, load_symbol_bars) for symbol in strategies}
+
+    started = time.perf_counter()
+    equity, per_symbol, stats = portfolio_backtest(frames, strategies, live_config['risk'], args.cash, qty=args.qty)
+    elapsed = time.perf_counter() - started
+    print(f"{len(frames)} symbols, {len(equity)} bars in {elapsed:.2f}s")
+    for key, value in stats.items():
+        print(f"{key:<20} {value}")
+    print(per_symbol.sum().to_string())
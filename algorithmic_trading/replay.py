@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import time
+import numpy as np
+from fake_broker import FakeBroker
+from metrics import METRICS
+from ring_buffer import timestamp_ns
+from synthetic_data import TRADE_DTYPE, synthetic_trades
+
+# Record/replay harness for the live engines (streaming.py, risk.py).
+# TradeRecorder appends the trade messages a live engine receives to a binary log of
+# TRADE_DTYPE records; replay() feeds a log, or synthetic trades, through the engine's
+# trade_callback with the REST client swapped for a FakeBroker, and reports throughput
+# and per-message latency.
+
+# Appends trade messages to `path` as fixed-size TRADE_DTYPE records, buffered in memory
+# and written every flush_every messages
+class TradeRecorder:
+    def __init__(self, path, flush_every=10000):
+        self.path = path
+        self.buffer = np.zeros(flush_every, dtype=TRADE_DTYPE)
+        self.size = 0
+        self.recorded = 0
+
+    def record(self, data):
+        self.buffer[self.size] = (timestamp_ns(data['t']), time.time_ns(), data['p'], data['s'], data['S'])
+        self.size += 1
+        if self.size == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        with open(self.path, 'ab') as f:
+            self.buffer[:self.size].tofile(f)
+        self.recorded += self.size
+        self.size = 0
+
+    # Wrap a trade callback so every message is recorded before it is handled
+    def wrap(self, callback):
+        async def recording_callback(data):
+            self.record(data)
+            await callback(data)
+        return recording_callback
+
+def load_trades(path):
+    return np.fromfile(path, dtype=TRADE_DTYPE)
+
+# Trade records as the message dicts trade_callback receives
+def trade_messages(trades):
+    return [{'S': symbol.decode(), 'p': price, 's': size, 't': t}
+            for t, price, size, symbol in zip(trades['t'].tolist(), trades['price'].tolist(),
+                                              trades['size'].tolist(), trades['symbol'].tolist())]
+
+# Import a live engine module offline: dummy credentials satisfy config(), and orders go
+# to the given broker instead of Alpaca
+def load_engine(name, broker):
+    os.environ.setdefault('ALPACA_KEY', 'replay')
+    os.environ.setdefault('ALPACA_SECRET', 'replay')
+    engine = importlib.import_module(name)
+    engine.rest_api = broker
+    if hasattr(engine, 'order_manager'):
+        engine.order_manager.rest_api = broker
+    return engine
+
+# Feed trades through engine.trade_callback. speed=None replays as fast as possible,
+# otherwise at `speed` times real time (1.0 = as recorded), tracking how far the engine
+# falls behind the schedule.
+async def replay(engine, trades, speed=None):
+    messages = trade_messages(trades)
+    event_times = trades['t']
+    latencies = np.empty(len(messages), dtype=np.int64)
+    max_lag = 0
+    start = time.perf_counter_ns()
+
+    for i, message in enumerate(messages):
+        if speed:
+            due = start + (event_times[i] - event_times[0]) / speed
+            wait = due - time.perf_counter_ns()
+            if wait > 0:
+                await asyncio.sleep(wait / 1e9)
+            else:
+                max_lag = max(max_lag, -wait)
+        elif i % 256 == 0:
+            await asyncio.sleep(0)  # let order submissions and fills make progress
+        received = time.perf_counter_ns()
+        await engine.trade_callback(message)
+        latencies[i] = time.perf_counter_ns() - received
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+
+    # Close the last bars as the clock would, and let in-flight orders finish
+    aggregator = engine.aggregator
+    for bar in aggregator.flush(int(event_times[-1]) + aggregator.interval + aggregator.grace):
+        engine.on_bar(bar)
+    if hasattr(engine, 'order_manager') and engine.order_manager.tasks:
+        await asyncio.gather(*engine.order_manager.tasks)
+
+    return {
+        'messages': len(messages),
+        'seconds': elapsed,
+        'messages_per_sec': len(messages) / elapsed if elapsed else float('inf'),
+        'latency_us': {f"p{q:g}": float(np.percentile(latencies, q)) / 1e3 for q in (50, 90, 99, 99.9)} | {'max': float(latencies.max()) / 1e3},
+        'max_lag_ms': max_lag / 1e6,
+        'bars': aggregator.bars,
+        'orders': engine.rest_api.submitted,
+        'stages': {stage: entry['all'] for stage, entry in METRICS.snapshot()['stages'].items()}
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded or synthetic trades through a live engine')
+    parser.add_argument('--engine', choices=['streaming', 'risk'], default='risk')
+    parser.add_argument('--log', help='trade log written by TradeRecorder (default: synthetic trades)')
+    parser.add_argument('--synthetic', type=int, default=100000, help='number of synthetic trades')
+    parser.add_argument('--rate', type=float, default=5.0, help='synthetic trades per second (sets how many bars close)')
+    parser.add_argument('--speed', type=float, default=0.0, help='replay speed vs real time, 0 for maximum')
+    parser.add_argument('--verbose', action='store_true', help='keep per-trade INFO logging')
+    args = parser.parse_args()
+
+    engine = load_engine(args.engine, FakeBroker())
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    trades = load_trades(args.log) if args.log else synthetic_trades(list(engine.STRATEGY_PARAMS), args.synthetic, args.rate)
+
+    report = asyncio.run(replay(engine, trades, args.speed or None))
+    print(f"{report['messages']} messages in {report['seconds']:.2f}s: {report['messages_per_sec']:,.0f} msg/s, "
+          f"{report['bars']} bars, {report['orders']} orders")
+    print('latency (us): ' + ', '.join(f"{k} {v:.1f}" for k, v in report['latency_us'].items()))
+    for stage, summary in report['stages'].items():
+        print(f"  {stage:<13} n={summary['count']:<8} p50 {summary['p50_us']:.1f}us  p99 {summary['p99_us']:.1f}us  max {summary['max_us']:.1f}us")
+    if args.speed:
+        print(f"max lag behind feed: {report['max_lag_ms']:.1f} ms")
@@ -0,0 +1,169 @@
+import argparse
+import hashlib
+import inspect
+import json
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+# Persistent store of backtest stats in SQLite. A result is keyed by the symbol, a content
+# hash of its bars (with their first and last timestamp), the strategy (class name plus a
+# hash of its source, so editing a strategy invalidates its results), the params, cash and
+# commission. Re-running an optimization over unchanged bars only runs the parameter sets
+# that are not stored yet; any change to the bars or the strategy code gives a new key.
+# Only the scalar stats are kept (the _trades/_equity_curve/_strategy entries are dropped).
+# The key covers the whole frame, because a backtest's stats depend on every bar of it: a
+# frame with one more day appended is a different backtest, and nothing stored for the
+# shorter frame is reused for it. Reuse comes from re-running the same bars, e.g. a fixed
+# start/end, or folds of a fixed, aligned calendar (walk_forward_folds) that end before
+# the new data.
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS results (
+        symbol TEXT NOT NULL,
+        data_hash TEXT NOT NULL,
+        start TEXT NOT NULL,
+        end TEXT NOT NULL,
+        strategy TEXT NOT NULL,
+        strategy_hash TEXT NOT NULL,
+        params TEXT NOT NULL,
+        cash REAL NOT NULL,
+        commission REAL NOT NULL,
+        stats TEXT NOT NULL,
+        created REAL NOT NULL,
+        PRIMARY KEY (symbol, data_hash, strategy, strategy_hash, cash, commission, params)
+    );
+    CREATE INDEX IF NOT EXISTS results_strategy ON results (strategy, symbol);
+"""
+
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Stats values that JSON can't hold natively are tagged so they load back as the same type
+def _encode(value):
+    if isinstance(value, pd.Timestamp):
+        return {'__timestamp__': value.isoformat()}
+    if isinstance(value, pd.Timedelta):
+        return {'__timedelta__': value.value}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot store {type(value).__name__} in stats")
+
+def _decode(obj):
+    if '__timestamp__' in obj:
+        return pd.Timestamp(obj['__timestamp__'])
+    if '__timedelta__' in obj:
+        return pd.Timedelta(obj['__timedelta__'])
+    return obj
+
+def dump_stats(stats):
+    return json.dumps({key: value for key, value in stats.items() if not key.startswith('_')}, default=_encode)
+
+def load_stats(text):
+    return pd.Series(json.loads(text, object_hook=_decode), dtype=object)
+
+# Canonical text of a parameter set, the same for any key order
+def params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+class ResultStore:
+    def __init__(self, path='backtest_results.sqlite'):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.strategy_hashes = {}
+
+    # (content hash, first timestamp, last timestamp) of a bar frame; any change to the
+    # frame, including appended bars, gives a new key
+    @staticmethod
+    def data_key(df):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(df.index.asi8).view(np.uint8))
+        digest.update(np.ascontiguousarray(df[BAR_COLUMNS].to_numpy(np.float64)).view(np.uint8))
+        if not len(df):
+            return digest.hexdigest(), '', ''
+        return digest.hexdigest(), df.index[0].isoformat(), df.index[-1].isoformat()
+
+    # Hash of a strategy class's source code
+    def strategy_hash(self, strategy):
+        if strategy not in self.strategy_hashes:
+            source = inspect.getsource(strategy)
+            self.strategy_hashes[strategy] = hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+        return self.strategy_hashes[strategy]
+
+    # Stored results for the parameter sets of a grid over one (symbol, bars, strategy,
+    # cash, commission), as {params_key: stats}, from one query
+    def lookup(self, symbol, data_key, strategy, grid, cash, commission):
+        rows = self.conn.execute("""
+            SELECT params, stats FROM results
+            WHERE symbol = ? AND data_hash = ? AND strategy = ? AND strategy_hash = ? AND cash = ? AND commission = ?
+        """, (symbol, data_key[0], strategy.__name__, self.strategy_hash(strategy), cash, commission)).fetchall()
+        wanted = {params_key(params) for params in grid}
+        found = {params: load_stats(stats) for params, stats in rows if params in wanted}
+        self.hits += len(found)
+        self.misses += len(wanted) - len(found)
+        return found
+
+    # Store one result; written on the next commit()
+    def put(self, symbol, data_key, strategy, params, stats, cash, commission):
+        self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                          (symbol, *data_key, strategy.__name__, self.strategy_hash(strategy), params_key(params),
+                           cash, commission, dump_stats(stats), time.time()))
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    # Stored results as a DataFrame, one row per result with the params and stats expanded
+    # into columns, optionally filtered and sorted by a stat (best first)
+    def query(self, symbol=None, strategy=None, sort_by='Return [%]', limit=None):
+        where, args = [], []
+        if symbol is not None:
+            where.append('symbol = ?')
+            args.append(symbol)
+        if strategy is not None:
+            where.append('strategy = ?')
+            args.append(strategy)
+        rows = self.conn.execute(
+            'SELECT symbol, strategy, start, end, cash, commission, params, stats FROM results'
+            + (' WHERE ' + ' AND '.join(where) if where else ''), args).fetchall()
+
+        records = []
+        for symbol, strategy, start, end, cash, commission, params, stats in rows:
+            record = {'symbol': symbol, 'strategy': strategy, 'start': start, 'end': end,
+                      'cash': cash, 'commission': commission}
+            record.update(json.loads(params))
+            record.update(json.loads(stats, object_hook=_decode))
+            records.append(record)
+        df = pd.DataFrame.from_records(records)
+        if sort_by and sort_by in df:
+            df = df.sort_values(sort_by, ascending=False, kind='stable')
+        return df.head(limit) if limit else df
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query stored backtest results')
+    parser.add_argument('--path', default='backtest_results.sqlite')
+    parser.add_argument('--symbol')
+    parser.add_argument('--strategy', help='strategy class name, e.g. EMADXStrategy')
+    parser.add_argument('--sort-by', default='Return [%]')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    store = ResultStore(args.path)
+    results = store.query(args.symbol, args.strategy, args.sort_by, args.top)
+    store.close()
+    if results.empty:
+        print('No stored results')
+    else:
+        columns = [column for column in results.columns if column not in ('cash', 'commission')]
+        print(results[columns[:12]].to_string(index=False))
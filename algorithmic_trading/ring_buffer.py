@@ -0,0 +1,57 @@
+import collections
+import numpy as np
+import pandas as pd
+
+# Zero-copy views of the most recent bars in a BarBuffer, oldest first
+BarWindow = collections.namedtuple('BarWindow', ['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+
+# Trade/bar timestamp (epoch nanoseconds, msgpack Timestamp from the stream,
+# datetime or string) as UTC epoch nanoseconds
+def timestamp_ns(t):
+    if isinstance(t, (int, np.integer)):
+        return int(t)
+    if hasattr(t, 'to_unix_nano'):
+        return t.to_unix_nano()
+    return pd.Timestamp(t).value
+
+# Fixed-capacity ring buffer of bars for one symbol, backed by preallocated arrays.
+# Every bar is written twice, at i and i + capacity, so the last n bars are always one
+# contiguous slice: appends are O(1) and last(n) returns views without copying.
+class BarBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self.values = np.zeros((5, 2 * capacity), dtype=np.float64)  # open, high, low, close, volume
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, open_, high, low, close, volume=0.0):
+        i = self.count % self.capacity
+        j = i + self.capacity
+        self.timestamps[i] = self.timestamps[j] = timestamp
+        values = self.values
+        values[0, i] = values[0, j] = open_
+        values[1, i] = values[1, j] = high
+        values[2, i] = values[2, j] = low
+        values[3, i] = values[3, j] = close
+        values[4, i] = values[4, j] = volume
+        self.count += 1
+
+    # The last n bars (all buffered bars by default)
+    def last(self, n=None):
+        n = len(self) if n is None else min(n, len(self))
+        end = (self.count - 1) % self.capacity + 1 + self.capacity if self.count else self.capacity
+        window = slice(end - n, end)
+        return BarWindow(self.timestamps[window], *self.values[:, window])
+
+    # Close prices of the last n bars
+    def closes(self, n=None):
+        return self.last(n).close
+
+    # Most recent close, or None while the buffer is empty
+    def latest_close(self):
+        if not self.count:
+            return None
+        return float(self.values[3, (self.count - 1) % self.capacity])
@@ -1,9 +1,15 @@
 import asyncio
 import logging
 from alpaca_trade_api.stream import Stream
-from alpaca_trade_api.rest import REST, APIError
+from alpaca_trade_api.rest import REST
 from decouple import config
-import talib
+from live_indicators import StrategyIndicators, load_live_config
+from ring_buffer import timestamp_ns
+from bar_aggregator import BarAggregator
+from replay import TradeRecorder
+from metrics import METRICS, SampledLog
+from order_manager import OrderManager, exceeds_position_limit, signed_notional
+from rolling_var import RollingVaR, portfolio_var
 import numpy as np
 
 # Configure logging
@@ -14,6 +20,15 @@ API_KEY = config('ALPACA_KEY')
 SECRET_KEY = config('ALPACA_SECRET')
 BASE_URL = 'https://paper-api.alpaca.markets'
 
+# Optional path to record incoming trades to, for offline replay (see replay.py)
+TRADE_LOG = config('TRADE_LOG', default='')
+
+# Log every Nth trade (0 turns per-trade logging off), and where to report latency metrics
+TRADE_LOG_EVERY = config('TRADE_LOG_EVERY', default=0, cast=int)
+METRICS_PORT = config('METRICS_PORT', default=0, cast=int)
+METRICS_INTERVAL = config('METRICS_INTERVAL', default=60.0, cast=float)
+trade_log = SampledLog(TRADE_LOG_EVERY)
+
 # Initialize Alpaca API clients
 rest_api = REST(API_KEY, SECRET_KEY, base_url=BASE_URL)
 stream = Stream(API_KEY, SECRET_KEY, base_url='https://stream.data.alpaca.markets/v2/sip')
@@ -30,11 +45,31 @@ RISK_MANAGEMENT_PARAMS = {
     'max_position_size': 10000,  # Maximum dollars to risk in any one position
     'stop_loss_pct': 0.02,  # Stop loss at 2% below the entry price
     'take_profit_pct': 0.05,  # Take profit at 5% above the entry price
-    'var_confidence_level': 0.95  # Confidence level for VaR calculation
+    'var_confidence_level': 0.95,  # Confidence level for VaR calculation
+    'var_lookback': 100,  # Bars of history used for VaR
+    'max_portfolio_var': None  # Maximum portfolio VaR in dollars (None to disable the check)
 }
 
-# Store historical bars for strategy calculation
-historical_data = {symbol: [] for symbol in STRATEGY_PARAMS.keys()}
+# Optional JSON config (see live_indicators.load_live_config), e.g. the parameters exported
+# by walk_forward.py, replacing the parameters above
+STRATEGY_CONFIG = config('STRATEGY_CONFIG', default='')
+if STRATEGY_CONFIG:
+    live_config = load_live_config(STRATEGY_CONFIG)
+    STRATEGY_PARAMS = live_config['strategies']
+    RISK_MANAGEMENT_PARAMS.update(live_config['risk'])
+
+# Incremental indicator state per symbol, updated once per bar
+indicators = {symbol: StrategyIndicators(params) for symbol, params in STRATEGY_PARAMS.items()}
+
+# Strategies run on completed bars of this size, the same 15-minute bars backtest.py optimizes on
+BAR_FREQ = '15min'
+aggregator = BarAggregator(BAR_FREQ)
+
+# Rolling VaR per symbol, updated once per bar
+var_estimators = {
+    symbol: RollingVaR(RISK_MANAGEMENT_PARAMS['var_lookback'], RISK_MANAGEMENT_PARAMS['var_confidence_level'])
+    for symbol in STRATEGY_PARAMS.keys()
+}
 
 # Track positions and orders
 open_positions = {}
@@ -42,77 +77,63 @@ active_orders = {}
 
 # Function to calculate Historical VaR at a specified confidence level
 def calculate_historical_var(symbol, confidence_level=0.95):
-    if len(historical_data[symbol]) < 100:  # Ensure enough data points for VaR calculation
+    estimator = var_estimators[symbol]
+    if not estimator.ready():  # Ensure enough data points for VaR calculation
         return None
-    
-    close_prices = [bar['c'] for bar in historical_data[symbol]]
-    returns = np.diff(np.log(close_prices))  # Calculate logarithmic returns
-    var = np.percentile(returns, (1 - confidence_level) * 100)
-    
-    # Convert VaR back to a monetary value
-    last_price = close_prices[-1]
-    var_value = last_price * abs(var)
-    return var_value
+    if confidence_level == estimator.confidence_level:
+        return estimator.var()
+
+    # Other confidence levels are computed from the same return window
+    var = np.percentile(estimator.returns(), (1 - confidence_level) * 100)
+    return estimator.last_close * abs(var)
+
+# Function to calculate Historical VaR of all open positions together
+def calculate_portfolio_var(positions=None, confidence_level=0.95):
+    return portfolio_var(var_estimators, open_positions if positions is None else positions, confidence_level)
 
 # Function to place an order with risk management and event handling, including VaR check
 def place_order_with_var(symbol, qty, side, entry_price):
+    started = METRICS.now()
     # Calculate VaR for the asset
     var_value = calculate_historical_var(symbol, RISK_MANAGEMENT_PARAMS['var_confidence_level'])
     if var_value is None:
         logging.warning(f"Not enough data to calculate VaR for {symbol}. Order not placed.")
+        METRICS.count('orders_blocked', symbol)
         return
 
     # Check if the calculated VaR exceeds a risk threshold
     if var_value > RISK_MANAGEMENT_PARAMS['max_position_size']:
         logging.warning(f"VaR for {symbol} exceeds risk threshold. Order not placed.")
+        METRICS.count('orders_blocked', symbol)
         return
 
-    # Check existing position size
-    position_size = open_positions.get(symbol, 0)
-    if position_size + (qty * entry_price) > RISK_MANAGEMENT_PARAMS['max_position_size']:
+    # Check the VaR of the portfolio with this order added
+    max_portfolio_var = RISK_MANAGEMENT_PARAMS['max_portfolio_var']
+    if max_portfolio_var is not None:
+        positions = dict(open_positions)
+        positions[symbol] = positions.get(symbol, 0) + signed_notional(qty, entry_price, side)
+        portfolio_var_value = calculate_portfolio_var(positions, RISK_MANAGEMENT_PARAMS['var_confidence_level'])
+        if portfolio_var_value is None or portfolio_var_value > max_portfolio_var:
+            logging.warning(f"Portfolio VaR with {symbol} order exceeds risk threshold. Order not placed.")
+            METRICS.count('orders_blocked', symbol)
+            return
+
+    # Check existing position size, including orders still in flight
+    if exceeds_position_limit(open_positions.get(symbol, 0), order_manager.pending_exposure(symbol),
+                              signed_notional(qty, entry_price, side), RISK_MANAGEMENT_PARAMS['max_position_size']):
         logging.warning(f"Position size for {symbol} exceeds maximum allowed. Order not placed.")
+        METRICS.count('orders_blocked', symbol)
         return
 
     # Place the order if VaR is within acceptable limits
+    started = METRICS.lap('risk_check', symbol, started)
     place_order(symbol, qty, side, entry_price)
+    METRICS.lap('order_submit', symbol, started)
 
-# Function to place an order (simplified)
+# Function to place an order without blocking the data stream; fills are tracked by
+# order_manager, which calls update_positions as they arrive
 def place_order(symbol, qty, side, entry_price):
-    try:
-        order = rest_api.submit_order(
-            symbol=symbol,
-            qty=qty,
-            side=side,
-            type='market',
-            time_in_force='gtc'
-        )
-        active_orders[order.id] = order
-        logging.info(f"Order placed: {side} {qty} shares of {symbol} at {entry_price}")
-
-        # Reconfirm trade after order is filled
-        asyncio.run(reconfirm_trade(order, symbol, entry_price, side, qty))
-
-    except APIError as e:
-        logging.error(f"API Error placing order for {symbol}: {e}")
-    except Exception as e:
-        logging.error(f"Error placing order for {symbol}: {e}")
-
-# Function to reconfirm a trade and track positions
-async def reconfirm_trade(order, symbol, entry_price, side, qty):
-    try:
-        while True:
-            # Check the order status
-            updated_order = rest_api.get_order(order.id)
-            if updated_order.filled_qty == updated_order.qty:
-                logging.info(f"Order fully filled for {symbol}.")
-                update_positions(symbol, side, qty, entry_price)
-                break
-            elif updated_order.status == 'canceled':
-                logging.warning(f"Order for {symbol} was canceled.")
-                break
-            await asyncio.sleep(1)  # Retry every second
-    except APIError as e:
-        logging.error(f"API Error reconfirming trade for {symbol}: {e}")
+    order_manager.submit_nowait(symbol, qty, side, entry_price)
 
 # Update the open positions based on the order filled
 def update_positions(symbol, side, qty, entry_price):
@@ -122,6 +143,9 @@ def update_positions(symbol, side, qty, entry_price):
         open_positions[symbol] = max(0, open_positions.get(symbol, 0) - (qty * entry_price))
     logging.info(f"Updated positions for {symbol}: {open_positions[symbol]}")
 
+# Submits orders off the event loop and applies fills to open_positions
+order_manager = OrderManager(rest_api, active_orders, on_fill=update_positions, metrics=METRICS)
+
 # Basic market data validation
 def validate_market_data(latest_price, symbol):
     if latest_price <= 0 or np.isnan(latest_price):
@@ -131,19 +155,17 @@ def validate_market_data(latest_price, symbol):
 
 # EMA-ADX strategy execution
 def execute_ema_adx(symbol, latest_price):
+    started = METRICS.now()
     if not validate_market_data(latest_price, symbol):
         return
 
     params = STRATEGY_PARAMS[symbol]
-    if len(historical_data[symbol]) < max(params['ema_window'], params['adx_window']):
+    if not indicators[symbol].ready():
         return  # Not enough data to calculate indicators
 
-    close_prices = [bar['c'] for bar in historical_data[symbol]]
-    high_prices = [bar['h'] for bar in historical_data[symbol]]
-    low_prices = [bar['l'] for bar in historical_data[symbol]]
-
-    ema = talib.EMA(close_prices, timeperiod=params['ema_window'])[-1]
-    adx = talib.ADX(high_prices, low_prices, close_prices, timeperiod=params['adx_window'])[-1]
+    ema = indicators[symbol].ema.value
+    adx = indicators[symbol].adx.value
+    METRICS.lap('signal', symbol, started)
 
     if adx > params['adx_threshold']:
         if latest_price > ema:
@@ -153,53 +175,80 @@ def execute_ema_adx(symbol, latest_price):
 
 # Bollinger Bands strategy execution
 def execute_bollinger_bands(symbol, latest_price):
+    started = METRICS.now()
     if not validate_market_data(latest_price, symbol):
         return
 
     params = STRATEGY_PARAMS[symbol]
-    if len(historical_data[symbol]) < params['window']:
+    if not indicators[symbol].ready():
         return  # Not enough data to calculate indicators
 
-    close_prices = [bar['c'] for bar in historical_data[symbol]]
-
-    upper_band, middle_band, lower_band = talib.BBANDS(
-        close_prices, timeperiod=params['window'], nbdevup=params['num_std_dev'], nbdevdn=params['num_std_dev'], matype=0)
+    upper_band, lower_band = indicators[symbol].bbands.upper, indicators[symbol].bbands.lower
+    METRICS.lap('signal', symbol, started)
 
-    if latest_price < lower_band[-1]:
+    if latest_price < lower_band:
         place_order_with_var(symbol, 1, 'buy', latest_price)
-    elif latest_price > upper_band[-1]:
+    elif latest_price > upper_band:
         place_order_with_var(symbol, 1, 'sell', latest_price)
 
+# Update the symbol's indicators with a completed bar and run its strategy on it
+def on_bar(bar):
+    started = METRICS.now()
+    indicators[bar.symbol].update(bar.high, bar.low, bar.close)
+    var_estimators[bar.symbol].update(bar.close)
+    METRICS.lap('indicators', bar.symbol, started)
+
+    # Execute the appropriate strategy
+    if STRATEGY_PARAMS[bar.symbol]['strategy'] == 'ema_adx':
+        execute_ema_adx(bar.symbol, bar.close)
+    elif STRATEGY_PARAMS[bar.symbol]['strategy'] == 'bollinger_bands':
+        execute_bollinger_bands(bar.symbol, bar.close)
+
 # Callback for trade updates
 async def trade_callback(data):
+    started = METRICS.now()
     symbol = data['S']
     latest_price = data['p']
-    logging.info(f"Received trade update for {symbol} at price {latest_price}")
+    trade_log("Received trade update for %s at price %s", symbol, latest_price)
 
-    # Store the latest trade data
-    bar = {'c': latest_price, 'h': latest_price, 'l': latest_price, 't': data['t']}
-    if len(historical_data[symbol]) >= STRATEGY_PARAMS[symbol]['window']:
-        historical_data[symbol].pop(0)
-    historical_data[symbol].append(bar)
+    if not validate_market_data(latest_price, symbol):
+        return
 
-    # Execute the appropriate strategy
-    if STRATEGY_PARAMS[symbol]['strategy'] == 'ema_adx':
-        execute_ema_adx(symbol, latest_price)
-    elif STRATEGY_PARAMS[symbol]['strategy'] == 'bollinger_bands':
-        execute_bollinger_bands(symbol, latest_price)
+    # Aggregate trades into bars; the strategy only runs when a bar closes
+    bar = aggregator.add_trade(symbol, timestamp_ns(data['t']), latest_price, data['s'])
+    METRICS.lap('receive', symbol, started)
+    if bar is not None:
+        on_bar(bar)
 
 # Main function to start the stream
 async def main():
+    # Close bars on the clock even when no further trades arrive
+    clock = asyncio.create_task(aggregator.run_clock(on_bar))
+    # Log latency metrics periodically and optionally serve them over HTTP
+    snapshots = asyncio.create_task(METRICS.run_snapshots(METRICS_INTERVAL))
+    if METRICS_PORT:
+        METRICS.serve(METRICS_PORT)
+    recorder = TradeRecorder(TRADE_LOG) if TRADE_LOG else None
+    # Poll in-flight orders in case the trade-updates stream misses an event
+    polling = asyncio.create_task(order_manager.run_polling())
     try:
+        callback = recorder.wrap(trade_callback) if recorder else trade_callback
         for symbol in STRATEGY_PARAMS.keys():
             logging.info(f"Subscribing to trade updates for {symbol}")
-            stream.subscribe_trades(trade_callback, symbol)
+            stream.subscribe_trades(callback, symbol)
+        stream.subscribe_trade_updates(order_manager.on_trade_update)
         
         # Run the stream without asyncio.run() to avoid conflicts with the existing event loop
         await stream._run_forever()
     except Exception as e:
         logging.error(f"Error during stream execution: {e}")
     finally:
+        clock.cancel()
+        snapshots.cancel()
+        if recorder:
+            recorder.flush()
+        polling.cancel()
+        order_manager.shutdown()
         await stream.close()
 
 if __name__ == '__main__':
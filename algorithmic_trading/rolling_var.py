@@ -0,0 +1,157 @@
+import collections
+import heapq
+import math
+import numpy as np
+
+# Linear interpolation exactly as np.percentile does it (numpy's _lerp)
+def _lerp(a, b, t):
+    diff = b - a
+    return b - diff * (1 - t) if t >= 0.5 else a + diff * t
+
+# Quantile of a sliding window of values, equal to np.percentile(window, q * 100).
+# The window is split into a max-heap holding the lowest floor(q * (n - 1)) + 1 values
+# and a min-heap holding the rest, so the two order statistics the percentile
+# interpolates between are the heap tops. Insert and remove are O(log n); removals are
+# lazy (recorded in `delayed` and dropped once they reach the top of a heap).
+class RollingQuantile:
+    def __init__(self, q):
+        self.q = q
+        self.low = []  # max-heap of negated values
+        self.high = []  # min-heap
+        self.low_size = 0
+        self.high_size = 0
+        self.delayed = collections.Counter()
+
+    def __len__(self):
+        return self.low_size + self.high_size
+
+    def add(self, x):
+        if not self.low or x <= -self.low[0]:
+            heapq.heappush(self.low, -x)
+            self.low_size += 1
+        else:
+            heapq.heappush(self.high, x)
+            self.high_size += 1
+        self._rebalance()
+
+    def remove(self, x):
+        self.delayed[x] += 1
+        if self.low and x <= -self.low[0]:
+            self.low_size -= 1
+            if x == -self.low[0]:
+                self._prune(self.low, -1)
+        else:
+            self.high_size -= 1
+            if self.high and x == self.high[0]:
+                self._prune(self.high, 1)
+        self._rebalance()
+        if len(self.low) + len(self.high) > 2 * len(self) + 64:
+            self._compact()
+
+    def value(self):
+        n = len(self)
+        if not n:
+            return math.nan
+        position = self.q * (n - 1)
+        fraction = position - math.floor(position)
+        lower = -self.low[0]
+        if fraction == 0:
+            return lower
+        return _lerp(lower, self.high[0], fraction)
+
+    # Move values between the heaps until the low heap holds the target count
+    def _rebalance(self):
+        n = len(self)
+        target = math.floor(self.q * (n - 1)) + 1 if n else 0
+        while self.low_size > target:
+            heapq.heappush(self.high, -heapq.heappop(self.low))
+            self.low_size -= 1
+            self.high_size += 1
+            self._prune(self.low, -1)
+        while self.low_size < target:
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+            self.high_size -= 1
+            self.low_size += 1
+            self._prune(self.high, 1)
+
+    # Rebuild both heaps without the lazily removed values buried below their tops, which
+    # would otherwise pile up; runs once per O(n) removals, so it stays amortized O(log n)
+    def _compact(self):
+        values = sorted([-x for x in self.low] + self.high)
+        kept = []
+        for x in values:
+            if self.delayed[x]:
+                self.delayed[x] -= 1
+            else:
+                kept.append(x)
+        self.delayed.clear()
+        split = self.low_size
+        self.low = [-x for x in kept[:split]]
+        self.high = kept[split:]
+        heapq.heapify(self.low)
+        heapq.heapify(self.high)
+
+    # Drop removed values from the top of a heap (sign -1 for the negated max-heap)
+    def _prune(self, heap, sign):
+        while heap and self.delayed[sign * heap[0]]:
+            self.delayed[sign * heap[0]] -= 1
+            if not self.delayed[sign * heap[0]]:
+                del self.delayed[sign * heap[0]]
+            heapq.heappop(heap)
+
+# Historical VaR for one symbol, updated once per bar. Keeps the log returns of the last
+# `lookback` closes in a mirrored ring buffer (so returns() is a zero-copy view) and their
+# (1 - confidence_level) quantile in a RollingQuantile. var() matches the original
+# np.percentile over the last `lookback` closes, scaled by the latest close.
+class RollingVaR:
+    def __init__(self, lookback=100, confidence_level=0.95):
+        self.window = lookback - 1
+        self.confidence_level = confidence_level
+        self.quantile = RollingQuantile(1 - confidence_level)
+        self.buffer = np.zeros(2 * self.window)
+        self.count = 0
+        self.last_log_close = None
+        self.last_close = None
+
+    def update(self, close):
+        log_close = math.log(close)
+        if self.last_log_close is not None:
+            r = log_close - self.last_log_close
+            i = self.count % self.window
+            if self.count >= self.window:
+                self.quantile.remove(float(self.buffer[i]))
+            self.buffer[i] = self.buffer[i + self.window] = r
+            self.quantile.add(r)
+            self.count += 1
+        self.last_log_close = log_close
+        self.last_close = close
+
+    def ready(self):
+        return self.count >= self.window
+
+    # The last `lookback - 1` log returns, oldest first
+    def returns(self):
+        n = min(self.count, self.window)
+        end = (self.count - 1) % self.window + 1 + self.window if self.count else self.window
+        return self.buffer[end - n:end]
+
+    # Monetary VaR of one share, or None until there are lookback closes
+    def var(self):
+        if not self.ready():
+            return None
+        return self.last_close * abs(self.quantile.value())
+
+# Historical-simulation VaR of a portfolio: positions maps symbol -> dollar exposure, and
+# each of the last lookback - 1 bars is replayed as a joint scenario across every held
+# symbol (returns are aligned by bar position in each symbol's buffer). Returns the loss
+# at the confidence level in dollars, or None if a held symbol has too little history.
+def portfolio_var(estimators, positions, confidence_level=0.95):
+    held = [symbol for symbol, exposure in positions.items() if exposure]
+    if not held:
+        return 0.0
+    if not all(estimators[symbol].ready() for symbol in held):
+        return None
+    returns = np.vstack([estimators[symbol].returns() for symbol in held])
+    exposures = np.array([positions[symbol] for symbol in held], dtype=np.float64)
+    pnl = exposures @ np.expm1(returns)
+    return max(0.0, -float(np.percentile(pnl, (1 - confidence_level) * 100)))
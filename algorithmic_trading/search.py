@@ -0,0 +1,266 @@
+import collections
+import itertools
+import math
+import numpy as np
+
+# Pluggable parameter search for the strategy optimizers.
+#
+# A search strategy gets a ParameterSpace and an objective(params, fidelity) -> score
+# (higher is better), where fidelity in (0, 1] is the fraction of the data to evaluate
+# on. Evaluations are charged to the budget by fidelity, so one full-data backtest
+# costs 1 and a backtest on a quarter of the bars costs 0.25.
+
+# One objective evaluation
+Trial = collections.namedtuple('Trial', ['params', 'fidelity', 'score'])
+
+# Outcome of a search: best params and score at the highest fidelity reached (full
+# fidelity unless the budget ran out first), that fidelity, every trial, budget spent
+SearchResult = collections.namedtuple('SearchResult', ['params', 'score', 'trials', 'cost', 'fidelity'])
+
+# Discrete, ordered parameter space, e.g. {'ema_window': range(5, 100), 'adx_threshold': range(10, 50)}.
+# An optional constraint(params) -> bool rules out invalid combinations.
+class ParameterSpace:
+    def __init__(self, dimensions, constraint=None):
+        self.names = list(dimensions)
+        self.values = [list(values) for values in dimensions.values()]
+        self.constraint = constraint
+
+    def size(self):
+        return math.prod(len(values) for values in self.values)
+
+    def params(self, indices):
+        return {name: values[i] for name, values, i in zip(self.names, self.values, indices)}
+
+    def valid(self, indices):
+        return self.constraint is None or self.constraint(self.params(indices))
+
+    def sample(self, rng):
+        for _ in range(1000):
+            indices = tuple(int(rng.integers(len(values))) for values in self.values)
+            if self.valid(indices):
+                return indices
+        raise ValueError("Could not sample parameters satisfying the constraint")
+
+    # Every combination, taking every stride-th value of each dimension
+    def grid(self, stride=1):
+        axes = [range(0, len(values), stride) for values in self.values]
+        return [indices for indices in itertools.product(*axes) if self.valid(indices)]
+
+    # Combinations within radius index steps of a point, every stride-th step
+    def neighborhood(self, center, radius, stride=1):
+        axes = [range(max(0, c - radius), min(len(values), c + radius + 1), stride)
+                for c, values in zip(center, self.values)]
+        return [indices for indices in itertools.product(*axes) if self.valid(indices)]
+
+# Raised internally once the budget is spent or the search has stopped improving
+class _StopSearch(Exception):
+    pass
+
+# Runs the objective for a search: memoizes repeated points, charges the budget and
+# applies early stopping after `patience` full-fidelity trials without improvement
+class _Evaluator:
+    def __init__(self, space, objective, budget=None, patience=None, min_improvement=0.0):
+        self.space = space
+        self.objective = objective
+        self.budget = budget
+        self.patience = patience
+        self.min_improvement = min_improvement
+        self.trials = []
+        self.scores = {}
+        self.cost = 0.0
+        self.best = None
+        self.stale = 0
+
+    def __call__(self, indices, fidelity=1.0):
+        key = (indices, fidelity)
+        if key in self.scores:
+            return self.scores[key]
+        if self.budget is not None and self.cost + fidelity > self.budget + 1e-9:
+            raise _StopSearch()
+
+        params = self.space.params(indices)
+        score = self.objective(params, fidelity)
+        score = float('-inf') if score is None or np.isnan(score) else float(score)
+        self.cost += fidelity
+        self.scores[key] = score
+        self.trials.append(Trial(params, fidelity, score))
+
+        if fidelity >= 1.0:
+            if self.best is None or score > self.best[1] + self.min_improvement:
+                self.best = (indices, score)
+                self.stale = 0
+            else:
+                self.stale += 1
+                if self.patience is not None and self.stale >= self.patience:
+                    raise _StopSearch()
+        return score
+
+    # Best full-fidelity trial; if the search stopped before any (e.g. successive halving
+    # with a small budget), the best trial at the highest fidelity it reached
+    def result(self):
+        if self.best is not None:
+            return SearchResult(self.space.params(self.best[0]), self.best[1], self.trials, self.cost, 1.0)
+        if not self.trials:
+            return SearchResult(None, float('-inf'), self.trials, self.cost, 0.0)
+        fidelity = max(trial.fidelity for trial in self.trials)
+        best = max((trial for trial in self.trials if trial.fidelity == fidelity), key=lambda trial: trial.score)
+        return SearchResult(best.params, best.score, self.trials, self.cost, fidelity)
+
+# Base class: subclasses implement _search(space, evaluate, rng) and call
+# evaluate(indices, fidelity) for each point they want scored
+class Search:
+    def run(self, space, objective, budget=None, patience=None, min_improvement=0.0, seed=0):
+        evaluate = _Evaluator(space, objective, budget, patience, min_improvement)
+        try:
+            self._search(space, evaluate, np.random.default_rng(seed))
+        except _StopSearch:
+            pass
+        return evaluate.result()
+
+    def _search(self, space, evaluate, rng):
+        raise NotImplementedError
+
+# Exhaustive search, in the same order as the original nested loops
+class GridSearch(Search):
+    def __init__(self, stride=1):
+        self.stride = stride
+
+    def _search(self, space, evaluate, rng):
+        for indices in space.grid(self.stride):
+            evaluate(indices)
+
+# Uniform random sampling, mostly a baseline for the adaptive searches
+class RandomSearch(Search):
+    def __init__(self, n_trials=100):
+        self.n_trials = n_trials
+
+    def _search(self, space, evaluate, rng):
+        for _ in range(self.n_trials):
+            evaluate(space.sample(rng))
+
+# Successive halving: score many candidates on a short slice of the data, keep the best
+# 1/eta of them and re-score those on eta times more data, until the survivors are
+# scored on all of it
+class SuccessiveHalving(Search):
+    # min_fidelity keeps the first rung long enough for the slowest indicators to warm up
+    def __init__(self, n_candidates=81, eta=3, min_fidelity=0.1):
+        self.n_candidates = n_candidates
+        self.eta = eta
+        self.min_fidelity = min_fidelity
+
+    def _search(self, space, evaluate, rng):
+        if self.n_candidates >= space.size():
+            candidates = space.grid()
+        else:
+            candidates = list(dict.fromkeys(space.sample(rng) for _ in range(self.n_candidates * 2)))[:self.n_candidates]
+        if not candidates:
+            return
+        rungs = int(math.log(len(candidates), self.eta)) + 1
+        fidelity = max(self.min_fidelity, self.eta ** -(rungs - 1))
+
+        while True:
+            fidelity = min(fidelity, 1.0)
+            scored = sorted(((evaluate(c, fidelity), i, c) for i, c in enumerate(candidates)), reverse=True)
+            if fidelity >= 1.0 or len(candidates) == 1:
+                if fidelity < 1.0:
+                    evaluate(scored[0][2])
+                return
+            candidates = [c for _, _, c in scored[:max(1, len(candidates) // self.eta)]]
+            fidelity *= self.eta
+
+# Tree-structured Parzen estimator (TPE) style Bayesian search. After n_startup random
+# trials, trials are split into the best gamma fraction and the rest; each dimension gets
+# a smoothed histogram over its value indices for both groups, and the next point is the
+# one of n_samples draws from the "good" model with the highest good/bad density ratio.
+class TPESearch(Search):
+    def __init__(self, n_trials=100, n_startup=20, gamma=0.25, n_samples=64, prior_weight=1.0):
+        self.n_trials = n_trials
+        self.n_startup = n_startup
+        self.gamma = gamma
+        self.n_samples = n_samples
+        self.prior_weight = prior_weight
+
+    def _search(self, space, evaluate, rng):
+        observed = []
+        for trial in range(self.n_trials):
+            if trial < self.n_startup or len(observed) < 2:
+                indices = space.sample(rng)
+            else:
+                indices = self._suggest(space, observed, rng)
+            observed.append((indices, evaluate(indices)))
+
+    # Parzen estimate over one dimension's value indices: a Gaussian kernel per observation
+    # plus a uniform prior, normalized to a probability vector
+    def _density(self, points, size):
+        grid = np.arange(size)
+        bandwidth = max(1.0, size / (1 + len(points)) ** 0.5 / 2)
+        density = np.full(size, self.prior_weight / size)
+        for point in points:
+            density += np.exp(-0.5 * ((grid - point) / bandwidth) ** 2) / bandwidth
+        return density / density.sum()
+
+    def _suggest(self, space, observed, rng):
+        ranked = sorted(observed, key=lambda item: item[1], reverse=True)
+        n_good = max(1, int(math.ceil(self.gamma * len(ranked))))
+        good = [indices for indices, _ in ranked[:n_good]]
+        bad = [indices for indices, _ in ranked[n_good:]] or good
+
+        l = [self._density([point[d] for point in good], len(values)) for d, values in enumerate(space.values)]
+        g = [self._density([point[d] for point in bad], len(values)) for d, values in enumerate(space.values)]
+        log_ratio = [np.log(l_d) - np.log(g_d) for l_d, g_d in zip(l, g)]
+
+        samples = np.column_stack([rng.choice(len(l_d), size=self.n_samples, p=l_d) for l_d in l])
+        ratios = sum(log_ratio[d][samples[:, d]] for d in range(len(l)))
+        seen = {indices for indices, _ in observed}
+        for k in np.argsort(-ratios, kind='stable'):
+            indices = tuple(int(i) for i in samples[k])
+            if indices not in seen and space.valid(indices):
+                return indices
+        return space.sample(rng)
+
+# Coarse-to-fine refinement: score a sparse grid (every stride-th value), then repeatedly
+# halve the stride and search the neighborhood of the top_k points so far
+class CoarseToFine(Search):
+    # stride=None picks the finest power-of-two stride whose coarse grid takes at most
+    # coarse_share of the budget, so the rest is left for refinement (8 without a budget).
+    # An explicit stride whose coarse grid alone uses up the budget is an error rather
+    # than a silently truncated grid.
+    def __init__(self, stride=None, top_k=3, coarse_share=0.5):
+        self.stride = stride
+        self.top_k = top_k
+        self.coarse_share = coarse_share
+
+    def _coarse_stride(self, space, budget):
+        if self.stride is not None:
+            if budget is not None and len(space.grid(self.stride)) >= budget:
+                raise ValueError(f"Budget {budget} is spent by the stride-{self.stride} coarse grid "
+                                 f"({len(space.grid(self.stride))} points) before refinement")
+            return self.stride
+        if budget is None:
+            return 8
+        stride, widest = 2, max(len(values) for values in space.values)
+        while len(space.grid(stride)) > budget * self.coarse_share:
+            if stride >= widest:
+                raise ValueError(f"Budget {budget} is too small for a coarse grid plus refinement")
+            stride *= 2
+        return stride
+
+    def _search(self, space, evaluate, rng):
+        stride = self._coarse_stride(space, evaluate.budget)
+        scores = {indices: evaluate(indices) for indices in space.grid(stride)}
+        while stride > 1:
+            radius, stride = stride, max(1, stride // 2)
+            top = sorted(scores, key=scores.get, reverse=True)[:self.top_k]
+            for center in top:
+                for indices in space.neighborhood(center, radius, stride):
+                    if indices not in scores:
+                        scores[indices] = evaluate(indices)
+
+# Search strategies by name
+SEARCHES = {
+    'grid': GridSearch,
+    'random': RandomSearch,
+    'halving': SuccessiveHalving,
+    'tpe': TPESearch,
+    'coarse_to_fine': CoarseToFine
+}
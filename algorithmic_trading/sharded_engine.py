@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import logging
+import math
+import multiprocessing as mp
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from bar_aggregator import BarAggregator
+from fake_broker import FakeBroker
+from live_indicators import StrategyIndicators, load_live_config
+from order_manager import OrderManager, exceeds_position_limit, signed_notional
+from ring_buffer import timestamp_ns
+from rolling_var import RollingVaR
+from synthetic_data import synthetic_trades
+
+# Symbol-sharded live engine. The feed handler (the parent process) receives the trade
+# stream and routes each trade by symbol to one of N strategy worker processes through a
+# shared-memory ring queue. Each worker owns the bar aggregator, indicators and VaR
+# estimators of its symbols and sends order intents back through a second queue;
+# the parent holds positions and applies the risk checks centrally before submitting.
+
+# Trade routed from the feed handler to a worker
+TICK_DTYPE = np.dtype([('t', 'i8'), ('price', 'f8'), ('size', 'f8'), ('symbol', 'i4'), ('pad', 'i4')])
+
+# Order intent from a worker to the central risk check (side 1 = buy, -1 = sell)
+SIGNAL_DTYPE = np.dtype([('t', 'i8'), ('price', 'f8'), ('var', 'f8'), ('symbol', 'i4'), ('side', 'i4')])
+
+# Risk limits, as in risk.py's RISK_MANAGEMENT_PARAMS; a config file's "risk" section overrides them
+DEFAULT_RISK_PARAMS = {
+    'max_position_size': 10000,
+    'var_confidence_level': 0.95,
+    'var_lookback': 100
+}
+
+# Single-producer single-consumer ring queue of fixed-size records in shared memory.
+# The producer only writes `head` and the consumer only writes `tail` (kept on separate
+# cache lines), so no lock is needed: a record is written before head is advanced past it.
+class RingQueue:
+    HEADER_BYTES = 128
+
+    def __init__(self, shm, dtype, capacity):
+        self.shm = shm
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.head = np.ndarray(1, np.int64, shm.buf, 0)
+        self.tail = np.ndarray(1, np.int64, shm.buf, 64)
+        self.records = np.ndarray(capacity, self.dtype, shm.buf, self.HEADER_BYTES)
+
+    @classmethod
+    def create(cls, dtype, capacity):
+        size = cls.HEADER_BYTES + capacity * np.dtype(dtype).itemsize
+        ring = cls(shared_memory.SharedMemory(create=True, size=size), dtype, capacity)
+        ring.head[0] = ring.tail[0] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, dtype, capacity):
+        return cls(shared_memory.SharedMemory(name=name), dtype, capacity)
+
+    # (name, dtype, capacity), enough for another process to attach
+    def spec(self):
+        return self.shm.name, self.dtype.descr, self.capacity
+
+    def __len__(self):
+        return int(self.head[0] - self.tail[0])
+
+    def push(self, record):
+        head = int(self.head[0])
+        if head - int(self.tail[0]) >= self.capacity:
+            return False
+        self.records[head % self.capacity] = record
+        self.head[0] = head + 1
+        return True
+
+    # Push as many records as fit; returns how many were pushed
+    def push_many(self, records):
+        head = int(self.head[0])
+        n = min(len(records), self.capacity - (head - int(self.tail[0])))
+        if n <= 0:
+            return 0
+        start = head % self.capacity
+        first = min(n, self.capacity - start)
+        self.records[start:start + first] = records[:first]
+        self.records[:n - first] = records[first:n]
+        self.head[0] = head + n
+        return n
+
+    # Copy out up to max_records queued records
+    def pop_many(self, max_records):
+        tail = int(self.tail[0])
+        n = min(int(self.head[0]) - tail, max_records)
+        if n <= 0:
+            return self.records[:0].copy()
+        start = tail % self.capacity
+        first = min(n, self.capacity - start)
+        batch = np.concatenate([self.records[start:start + first], self.records[:n - first]])
+        self.tail[0] = tail + n
+        return batch
+
+    def close(self, unlink=False):
+        del self.head, self.tail, self.records
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+# Worker process: aggregates its symbols' trades into bars, updates their indicators and
+# VaR, and pushes a signal record for every bar whose strategy wants to trade
+def _worker_main(shard, symbols, risk_params, freq, clock, inbox_spec, outbox_spec, stop, results):
+    inbox = RingQueue.attach(inbox_spec[0], inbox_spec[1], inbox_spec[2])
+    outbox = RingQueue.attach(outbox_spec[0], outbox_spec[1], outbox_spec[2])
+    aggregator = BarAggregator(freq)
+    state = {
+        sid: (StrategyIndicators(params), RollingVaR(risk_params['var_lookback'], risk_params['var_confidence_level']))
+        for sid, (_, params) in symbols.items()
+    }
+    stats = {'shard': shard, 'symbols': len(symbols), 'trades': 0, 'bars': 0, 'signals': 0, 'busy_seconds': 0.0}
+
+    def on_bar(bar):
+        indicators, var = state[bar.symbol]
+        indicators.update(bar.high, bar.low, bar.close)
+        var.update(bar.close)
+        stats['bars'] += 1
+        side = indicators.signal(bar.close)
+        if side is not None:
+            var_value = var.var()
+            record = (bar.timestamp, bar.close, math.nan if var_value is None else var_value, bar.symbol, 1 if side == 'buy' else -1)
+            while not outbox.push(record):
+                time.sleep(0.0001)
+            stats['signals'] += 1
+
+    idle = 0
+    while True:
+        batch = inbox.pop_many(4096)
+        if not len(batch):
+            if stop.is_set() and not len(inbox):
+                break
+            if clock:
+                for bar in aggregator.flush():
+                    on_bar(bar)
+            idle = min(idle + 1, 10)
+            time.sleep(1e-6 * 2 ** idle)  # back off up to ~1ms while the feed is quiet
+            continue
+
+        idle = 0
+        started = time.perf_counter()
+        for t, price, size, sid in zip(batch['t'].tolist(), batch['price'].tolist(),
+                                       batch['size'].tolist(), batch['symbol'].tolist()):
+            bar = aggregator.add_trade(sid, t, price, size)
+            if bar is not None:
+                on_bar(bar)
+        stats['trades'] += len(batch)
+        stats['busy_seconds'] += time.perf_counter() - started
+
+    # Close the bars still open at shutdown
+    for bar in aggregator.flush(2 ** 62):
+        on_bar(bar)
+    stats['late_trades'] = aggregator.late_trades
+    inbox.close()
+    outbox.close()
+    results.put(stats)
+
+# Feed handler and central risk/position state for the sharded workers.
+# Symbols are assigned to workers round-robin in config order.
+class ShardedEngine:
+    def __init__(self, strategies, risk_params=None, workers=None, broker=None, freq='15min', clock=True,
+                 queue_capacity=1 << 16):
+        self.strategies = strategies
+        self.symbols = list(strategies)
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.workers = workers or os.cpu_count()
+        self.shard_of = np.arange(len(self.symbols)) % self.workers
+        self.risk_params = {**DEFAULT_RISK_PARAMS, **(risk_params or {})}
+        self.freq = freq
+        self.clock = clock
+        self.queue_capacity = queue_capacity
+        self.open_positions = {}
+        self.active_orders = {}
+        self.order_manager = OrderManager(broker, self.active_orders, on_fill=self.update_positions) if broker else None
+        self.stats = {'routed': 0, 'unknown_symbol': 0, 'queue_full_waits': 0, 'signals': 0, 'orders': 0, 'blocked': 0}
+        self.processes = []
+
+    def start(self):
+        self.stop = mp.Event()
+        self.results = mp.Queue()
+        self.inboxes = [RingQueue.create(TICK_DTYPE, self.queue_capacity) for _ in range(self.workers)]
+        self.outboxes = [RingQueue.create(SIGNAL_DTYPE, self.queue_capacity) for _ in range(self.workers)]
+        for shard in range(self.workers):
+            symbols = {sid: (symbol, self.strategies[symbol]) for sid, symbol in enumerate(self.symbols)
+                       if self.shard_of[sid] == shard}
+            if not symbols:
+                self.results.put({'shard': shard, 'symbols': 0})
+                continue
+            process = mp.Process(target=_worker_main, daemon=True, args=(
+                shard, symbols, self.risk_params, self.freq, self.clock,
+                self.inboxes[shard].spec(), self.outboxes[shard].spec(), self.stop, self.results))
+            process.start()
+            self.processes.append(process)
+
+    # Route one trade to its symbol's worker, waiting if that worker's queue is full
+    def route(self, symbol, t, price, size):
+        sid = self.symbol_ids.get(symbol)
+        if sid is None:
+            self.stats['unknown_symbol'] += 1
+            return
+        inbox = self.inboxes[self.shard_of[sid]]
+        while not inbox.push((t, price, size, sid, 0)):
+            self.stats['queue_full_waits'] += 1
+            time.sleep(0.0001)
+        self.stats['routed'] += 1
+
+    # Route an array of TRADE_DTYPE records (a replay log or synthetic trades)
+    def route_batch(self, trades):
+        names = {symbol.encode(): sid for symbol, sid in self.symbol_ids.items()}
+        unique, inverse = np.unique(trades['symbol'], return_inverse=True)
+        lookup = np.array([names.get(name, -1) for name in unique.tolist()], dtype=np.int32)
+        sids = lookup[inverse]
+        known = sids >= 0
+        self.stats['unknown_symbol'] += int((~known).sum())
+
+        ticks = np.zeros(int(known.sum()), dtype=TICK_DTYPE)
+        ticks['t'] = trades['t'][known]
+        ticks['price'] = trades['price'][known]
+        ticks['size'] = trades['size'][known]
+        ticks['symbol'] = sids[known]
+        shards = self.shard_of[ticks['symbol']]
+        for shard in range(self.workers):
+            part = ticks[shards == shard]
+            while len(part):
+                pushed = self.inboxes[shard].push_many(part)
+                part = part[pushed:]
+                if len(part):
+                    self.stats['queue_full_waits'] += 1
+                    time.sleep(0.0001)
+        self.stats['routed'] += len(ticks)
+
+    # Handler for stream.subscribe_trades
+    async def trade_callback(self, data):
+        self.route(data['S'], timestamp_ns(data['t']), data['p'], data['s'])
+
+    # Apply the central risk checks to every pending worker signal and submit the survivors
+    def drain_signals(self):
+        for outbox in self.outboxes:
+            batch = outbox.pop_many(outbox.capacity)
+            for price, var_value, sid, side in zip(batch['price'].tolist(), batch['var'].tolist(),
+                                                   batch['symbol'].tolist(), batch['side'].tolist()):
+                self.stats['signals'] += 1
+                self.check_and_submit(self.symbols[sid], 'buy' if side > 0 else 'sell', 1, price, var_value)
+
+    def check_and_submit(self, symbol, side, qty, price, var_value):
+        max_position_size = self.risk_params['max_position_size']
+        if math.isnan(var_value) or var_value > max_position_size:
+            self.stats['blocked'] += 1
+            return
+        pending = self.order_manager.pending_exposure(symbol) if self.order_manager is not None else 0
+        if exceeds_position_limit(self.open_positions.get(symbol, 0), pending, signed_notional(qty, price, side), max_position_size):
+            self.stats['blocked'] += 1
+            return
+        self.stats['orders'] += 1
+        if self.order_manager is not None:
+            self.order_manager.submit_nowait(symbol, qty, side, price)
+
+    # Same position bookkeeping as risk.update_positions
+    def update_positions(self, symbol, side, qty, entry_price):
+        if side == 'buy':
+            self.open_positions[symbol] = self.open_positions.get(symbol, 0) + (qty * entry_price)
+        elif side == 'sell':
+            self.open_positions[symbol] = max(0, self.open_positions.get(symbol, 0) - (qty * entry_price))
+
+    async def run_risk(self, interval=0.001):
+        while True:
+            self.drain_signals()
+            await asyncio.sleep(interval)
+
+    # Stop the workers once their queues are empty, keep draining signals until they have
+    # all reported, and return their stats
+    async def shutdown(self):
+        self.stop.set()
+        stats = []
+        while len(stats) < self.workers:
+            self.drain_signals()
+            try:
+                stats.append(self.results.get_nowait())
+            except queue.Empty:
+                await asyncio.sleep(0.001)
+        for process in self.processes:
+            process.join()
+        self.drain_signals()
+        if self.order_manager is not None:
+            if self.order_manager.tasks:
+                await asyncio.gather(*self.order_manager.tasks)
+            self.order_manager.shutdown()
+        for ring in self.inboxes + self.outboxes:
+            ring.close(unlink=True)
+        return sorted(stats, key=lambda s: s['shard'])
+
+# Config for n synthetic symbols alternating between the two strategies
+def synthetic_strategies(n):
+    ema_adx = {'strategy': 'ema_adx', 'ema_window': 25, 'adx_window': 20, 'adx_threshold': 35}
+    bollinger = {'strategy': 'bollinger_bands', 'window': 15, 'num_std_dev': 3}
+    return {f"SYM{i:04d}": dict(ema_adx if i % 2 else bollinger) for i in range(n)}
+
+# Offline throughput run: synthetic trades through the sharded engine and a FakeBroker
+async def run_synthetic(num_symbols, num_trades, workers, rate, chunk=1 << 15):
+    strategies = synthetic_strategies(num_symbols)
+    trades = synthetic_trades(list(strategies), num_trades, rate)
+    engine = ShardedEngine(strategies, workers=workers, broker=FakeBroker(), clock=False)
+    engine.start()
+    started = time.perf_counter()
+    for i in range(0, len(trades), chunk):
+        engine.route_batch(trades[i:i + chunk])
+        engine.drain_signals()
+        await asyncio.sleep(0)
+    worker_stats = await engine.shutdown()
+    elapsed = time.perf_counter() - started
+    return elapsed, engine.stats, worker_stats
+
+# Live run against Alpaca: one feed handler, `workers` strategy processes
+async def run_live(live_config, workers):
+    from alpaca_trade_api.stream import Stream
+    from alpaca_trade_api.rest import REST
+    from decouple import config
+
+    rest_api = REST(config('ALPACA_KEY'), config('ALPACA_SECRET'), base_url='https://paper-api.alpaca.markets')
+    stream = Stream(config('ALPACA_KEY'), config('ALPACA_SECRET'), base_url='https://stream.data.alpaca.markets/v2/sip')
+    engine = ShardedEngine(live_config['strategies'], live_config['risk'], workers=workers, broker=rest_api)
+    engine.start()
+    risk = asyncio.create_task(engine.run_risk())
+    polling = asyncio.create_task(engine.order_manager.run_polling())
+    try:
+        for symbol in engine.symbols:
+            stream.subscribe_trades(engine.trade_callback, symbol)
+        stream.subscribe_trade_updates(engine.order_manager.on_trade_update)
+        await stream._run_forever()
+    except Exception as e:
+        logging.error(f"Error during stream execution: {e}")
+    finally:
+        risk.cancel()
+        polling.cancel()
+        await engine.shutdown()
+        await stream.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Symbol-sharded multi-process live engine')
+    parser.add_argument('--config', default='strategy_params.json', help='live config file (strategies and risk)')
+    parser.add_argument('--workers', type=int, default=None, help='strategy worker processes (default: CPU count)')
+    parser.add_argument('--synthetic', type=int, default=0, help='run offline on this many synthetic trades')
+    parser.add_argument('--symbols', type=int, default=500, help='synthetic symbols')
+    parser.add_argument('--rate', type=float, default=50.0, help='synthetic trades per second across all symbols')
+    args = parser.parse_args()
+    # Per-order logging would dominate an offline throughput run
+    logging.basicConfig(level=logging.WARNING if args.synthetic else logging.INFO)
+
+    if args.synthetic:
+        elapsed, stats, worker_stats = asyncio.run(run_synthetic(args.symbols, args.synthetic, args.workers, args.rate))
+        print(f"{stats['routed']} trades in {elapsed:.2f}s: {stats['routed'] / elapsed:,.0f} trades/s, "
+              f"{stats['signals']} signals, {stats['orders']} orders, {stats['queue_full_waits']} queue-full waits")
+        for s in worker_stats:
+            if s['symbols']:
+                print(f"  worker {s['shard']}: {s['symbols']} symbols, {s['trades']} trades, {s['bars']} bars, "
+                      f"busy {s['busy_seconds']:.2f}s")
+    else:
+        asyncio.run(run_live(load_live_config(args.config), args.workers))
@@ -3,7 +3,11 @@ import logging
 from alpaca_trade_api.stream import Stream
 from alpaca_trade_api.rest import REST, TimeFrame
 from decouple import config
-import talib
+from live_indicators import StrategyIndicators, load_live_config
+from ring_buffer import timestamp_ns
+from bar_aggregator import BarAggregator
+from replay import TradeRecorder
+from metrics import METRICS, SampledLog
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -13,6 +17,15 @@ API_KEY = config('ALPACA_KEY')
 SECRET_KEY = config('ALPACA_SECRET')
 BASE_URL = 'https://paper-api.alpaca.markets'
 
+# Optional path to record incoming trades to, for offline replay (see replay.py)
+TRADE_LOG = config('TRADE_LOG', default='')
+
+# Log every Nth trade (0 turns per-trade logging off), and where to report latency metrics
+TRADE_LOG_EVERY = config('TRADE_LOG_EVERY', default=0, cast=int)
+METRICS_PORT = config('METRICS_PORT', default=0, cast=int)
+METRICS_INTERVAL = config('METRICS_INTERVAL', default=60.0, cast=float)
+trade_log = SampledLog(TRADE_LOG_EVERY)
+
 # Initialize Alpaca API clients
 rest_api = REST(API_KEY, SECRET_KEY, base_url=BASE_URL)
 stream = Stream(API_KEY, SECRET_KEY, base_url='https://stream.data.alpaca.markets/v2/sip')
@@ -24,15 +37,23 @@ STRATEGY_PARAMS = {
     'PEP': {'strategy': 'bollinger_bands', 'window': 15, 'num_std_dev': 3}
 }
 
-# Store historical bars for strategy calculation
-historical_data = {
-    'MCD': [],
-    'KO': [],
-    'PEP': []
-}
+# Optional JSON config (see live_indicators.load_live_config), e.g. the parameters exported
+# by walk_forward.py, replacing the parameters above
+STRATEGY_CONFIG = config('STRATEGY_CONFIG', default='')
+if STRATEGY_CONFIG:
+    live_config = load_live_config(STRATEGY_CONFIG)
+    STRATEGY_PARAMS = live_config['strategies']
+
+# Incremental indicator state per symbol, updated once per bar
+indicators = {symbol: StrategyIndicators(params) for symbol, params in STRATEGY_PARAMS.items()}
+
+# Strategies run on completed bars of this size, the same 15-minute bars backtest.py optimizes on
+BAR_FREQ = '15min'
+aggregator = BarAggregator(BAR_FREQ)
 
 # Function to place an order
 def place_order(symbol, qty, side):
+    started = METRICS.now()
     try:
         rest_api.submit_order(
             symbol=symbol,
@@ -41,22 +62,22 @@ def place_order(symbol, qty, side):
             type='market',
             time_in_force='gtc'
         )
+        METRICS.lap('order_submit', symbol, started)
+        METRICS.count('orders_submitted', symbol)
         logging.info(f"Order placed: {side} {qty} shares of {symbol}")
     except Exception as e:
         logging.error(f"Error placing order for {symbol}: {e}")
 
 # EMA-ADX strategy execution
 def execute_ema_adx(symbol, latest_price):
+    started = METRICS.now()
     params = STRATEGY_PARAMS[symbol]
-    if len(historical_data[symbol]) < max(params['ema_window'], params['adx_window']):
+    if not indicators[symbol].ready():
         return  # Not enough data to calculate indicators
 
-    close_prices = [bar['c'] for bar in historical_data[symbol]]
-    high_prices = [bar['h'] for bar in historical_data[symbol]]
-    low_prices = [bar['l'] for bar in historical_data[symbol]]
-
-    ema = talib.EMA(close_prices, timeperiod=params['ema_window'])[-1]
-    adx = talib.ADX(high_prices, low_prices, close_prices, timeperiod=params['adx_window'])[-1]
+    ema = indicators[symbol].ema.value
+    adx = indicators[symbol].adx.value
+    METRICS.lap('signal', symbol, started)
 
     if adx > params['adx_threshold']:
         if latest_price > ema:
@@ -66,50 +87,68 @@ def execute_ema_adx(symbol, latest_price):
 
 # Bollinger Bands strategy execution
 def execute_bollinger_bands(symbol, latest_price):
+    started = METRICS.now()
     params = STRATEGY_PARAMS[symbol]
-    if len(historical_data[symbol]) < params['window']:
+    if not indicators[symbol].ready():
         return  # Not enough data to calculate indicators
 
-    close_prices = [bar['c'] for bar in historical_data[symbol]]
+    upper_band, lower_band = indicators[symbol].bbands.upper, indicators[symbol].bbands.lower
+    METRICS.lap('signal', symbol, started)
 
-    upper_band, middle_band, lower_band = talib.BBANDS(
-        close_prices, timeperiod=params['window'], nbdevup=params['num_std_dev'], nbdevdn=params['num_std_dev'], matype=0)
-
-    if latest_price < lower_band[-1]:
+    if latest_price < lower_band:
         place_order(symbol, 1, 'buy')
-    elif latest_price > upper_band[-1]:
+    elif latest_price > upper_band:
         place_order(symbol, 1, 'sell')
 
+# Update the symbol's indicators with a completed bar and run its strategy on it
+def on_bar(bar):
+    started = METRICS.now()
+    indicators[bar.symbol].update(bar.high, bar.low, bar.close)
+    METRICS.lap('indicators', bar.symbol, started)
+
+    # Execute the appropriate strategy
+    if STRATEGY_PARAMS[bar.symbol]['strategy'] == 'ema_adx':
+        execute_ema_adx(bar.symbol, bar.close)
+    elif STRATEGY_PARAMS[bar.symbol]['strategy'] == 'bollinger_bands':
+        execute_bollinger_bands(bar.symbol, bar.close)
+
 # Callback for trade updates
 async def trade_callback(data):
+    started = METRICS.now()
     symbol = data['S']
     latest_price = data['p']
-    logging.info(f"Received trade update for {symbol} at price {latest_price}")
-
-    # Store the latest trade data
-    bar = {'c': latest_price, 'h': latest_price, 'l': latest_price, 't': data['t']}
-    if len(historical_data[symbol]) >= STRATEGY_PARAMS[symbol]['window']:
-        historical_data[symbol].pop(0)
-    historical_data[symbol].append(bar)
+    trade_log("Received trade update for %s at price %s", symbol, latest_price)
 
-    # Execute the appropriate strategy
-    if STRATEGY_PARAMS[symbol]['strategy'] == 'ema_adx':
-        execute_ema_adx(symbol, latest_price)
-    elif STRATEGY_PARAMS[symbol]['strategy'] == 'bollinger_bands':
-        execute_bollinger_bands(symbol, latest_price)
+    # Aggregate trades into bars; the strategy only runs when a bar closes
+    bar = aggregator.add_trade(symbol, timestamp_ns(data['t']), latest_price, data['s'])
+    METRICS.lap('receive', symbol, started)
+    if bar is not None:
+        on_bar(bar)
 
 # Main function to start the stream
 async def main():
+    # Close bars on the clock even when no further trades arrive
+    clock = asyncio.create_task(aggregator.run_clock(on_bar))
+    # Log latency metrics periodically and optionally serve them over HTTP
+    snapshots = asyncio.create_task(METRICS.run_snapshots(METRICS_INTERVAL))
+    if METRICS_PORT:
+        METRICS.serve(METRICS_PORT)
+    recorder = TradeRecorder(TRADE_LOG) if TRADE_LOG else None
     try:
+        callback = recorder.wrap(trade_callback) if recorder else trade_callback
         for symbol in STRATEGY_PARAMS.keys():
             logging.info(f"Subscribing to trade updates for {symbol}")
-            stream.subscribe_trades(trade_callback, symbol)
+            stream.subscribe_trades(callback, symbol)
         
         # Run the stream without asyncio.run() to avoid conflicts with the existing event loop
         await stream._run_forever()
     except Exception as e:
         logging.error(f"Error during stream execution: {e}")
     finally:
+        clock.cancel()
+        snapshots.cancel()
+        if recorder:
+            recorder.flush()
         await stream.close()
 
 if __name__ == '__main__':
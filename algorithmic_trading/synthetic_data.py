@@ -0,0 +1,214 @@
+import re
+import time
+import zlib
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+
+# Minutes of the regular trading session (13:30-20:00 UTC) on each business day in sessions
+def session_minutes(sessions):
+    offsets = pd.Timedelta(hours=13, minutes=30) + pd.to_timedelta(np.arange(390), unit='min')
+    return pd.DatetimeIndex(np.concatenate([(session + offsets).values for session in sessions])).tz_localize('UTC')
+
+# Random-walk OHLCV bars for one symbol on the given minutes
+def random_walk_bars(minutes, rng, base_price=100.0):
+    n = len(minutes)
+    close = base_price * np.exp(np.cumsum(rng.normal(0, 0.0008, n)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.0005, n)) * close
+    return pd.DataFrame({
+        'timestamp': minutes,
+        'open': open_,
+        'high': np.maximum(open_, close) + spread,
+        'low': np.minimum(open_, close) - spread,
+        'close': close,
+        'volume': rng.integers(100, 10000, n),
+    })
+
+# Generate random-walk minute bars shaped like fetch_alpaca_data's output:
+# {symbol: DataFrame[timestamp, open, high, low, close, volume, symbol]} covering
+# regular trading hours on consecutive business days.
+def synthetic_minute_bars(symbols, days=5, start='2023-05-15', seed=0):
+    rng = np.random.default_rng(seed)
+    minutes = session_minutes(pd.bdate_range(start, periods=days, tz='UTC'))
+
+    data = {}
+    for symbol in symbols:
+        df = random_walk_bars(minutes, rng)
+        df['symbol'] = symbol
+        data[symbol] = df
+    return data
+
+# Record layout of a trade message: event time and receive time (epoch ns), price,
+# size and symbol. Used for synthetic trades and for recorded stream logs (replay.py).
+TRADE_DTYPE = np.dtype([('t', 'i8'), ('recv', 'i8'), ('price', 'f8'), ('size', 'f8'), ('symbol', 'S8')])
+
+# Random-walk trades for the given symbols, `rate` trades per second in total with
+# exponential gaps, starting at the open of the `start` session
+def synthetic_trades(symbols, n, rate=1000.0, start='2023-05-15', seed=0):
+    rng = np.random.default_rng(seed)
+    trades = np.zeros(n, dtype=TRADE_DTYPE)
+    t0 = (pd.Timestamp(start, tz='UTC') + pd.Timedelta(hours=13, minutes=30)).value
+    trades['t'] = t0 + np.cumsum(rng.exponential(1e9 / rate, n)).astype(np.int64)
+    trades['recv'] = trades['t']
+    which = rng.integers(len(symbols), size=n)
+    trades['symbol'] = np.array(symbols, dtype='S8')[which]
+    steps = rng.normal(0, 0.0002, n)
+    prices = np.empty(n)
+    for k in range(len(symbols)):
+        mask = which == k
+        prices[mask] = 100.0 * np.exp(np.cumsum(steps[mask]))
+    trades['price'] = np.round(prices, 2)
+    trades['size'] = rng.integers(1, 500, n)
+    return trades
+
+# Offline stand-in for alpaca's StockHistoricalDataClient.
+# Bars are generated per (symbol, session) from a fixed seed, so overlapping requests
+# return identical rows and chunked fetches can be checked against a single fetch.
+class FakeStockDataClient:
+    def __init__(self, seed=0, latency=0.0):
+        self.seed = seed
+        self.latency = latency
+        self.requests = 0
+
+    def get_stock_bars(self, request_params):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        symbols = request_params.symbol_or_symbols
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        start = pd.Timestamp(request_params.start)
+        end = pd.Timestamp(request_params.end)
+        start = start.tz_localize('UTC') if start.tzinfo is None else start.tz_convert('UTC')
+        end = end.tz_localize('UTC') if end.tzinfo is None else end.tz_convert('UTC')
+
+        frames = []
+        for session in pd.bdate_range(start.normalize(), end.normalize(), tz='UTC'):
+            minutes = session_minutes([session])
+            for symbol in symbols:
+                rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode()), session.toordinal()])
+                df = random_walk_bars(minutes, rng)
+                df['symbol'] = symbol
+                frames.append(df[(df['timestamp'] >= start) & (df['timestamp'] <= end)])
+
+        if not frames:
+            return SimpleNamespace(df=pd.DataFrame())
+        bars = pd.concat(frames).set_index(['symbol', 'timestamp']).sort_index()
+        return SimpleNamespace(df=bars)
+
+# Offline stand-in for a psycopg2 connection to the minute bar table, for benchmarks
+# without a database. Statements are adapted client-side exactly as psycopg2 would send
+# them (so the Python cost of each ingest path is measured) and then discarded; COPY
+# input is read to the end. The loaders' SELECTs (backtest.py's BUCKET_QUERY, MINUTE_QUERY
+# and ROLLUP_QUERY on {table}_{timeframe}) are answered from `bars`, {symbol: frame as
+# synthetic_minute_bars returns}; a rollup view holds every bucket of the minute bars.
+class FakeConnection:
+    encoding = 'UTF8'
+
+    def __init__(self, bars=None, table='alpaca_minute_data'):
+        self.bars = bars or {}
+        self.table = table
+        self.autocommit = False
+        self.results = {}
+        self.statements = 0
+        self.copied_bytes = 0
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    # Rows a loader query returns, ordered by symbol then time; bucketed like
+    # time_bucket when `bucket` is given, from the minutes outside [exclude[0], exclude[1])
+    # when `exclude` is. Cached so repeated loads only pay the client side.
+    def query(self, bucket, start, end, symbols, exclude=None):
+        key = (bucket, str(start), str(end), tuple(symbols), str(exclude))
+        if key not in self.results:
+            start, end = pd.Timestamp(start), pd.Timestamp(end)
+            start = start.tz_localize('UTC') if start.tzinfo is None else start
+            end = end.tz_localize('UTC') if end.tzinfo is None else end
+            frames = [self.bars[symbol] for symbol in sorted(symbols) if symbol in self.bars]
+            if not frames:
+                self.results[key] = []
+                return self.results[key]
+            df = pd.concat(frames)
+            df = df[(df['timestamp'] >= start) & (df['timestamp'] <= end)]
+            if exclude is not None:
+                df = df[(df['timestamp'] < exclude[0]) | (df['timestamp'] >= exclude[1])]
+            if bucket is not None:
+                df = df.set_index('timestamp').groupby(['symbol', pd.Grouper(freq=pd.Timedelta(bucket))]).agg(
+                    open=('open', 'first'), high=('high', 'max'), low=('low', 'min'),
+                    close=('close', 'last'), volume=('volume', 'sum')).dropna().reset_index()
+            timestamps = df['timestamp'].dt.to_pydatetime()
+            self.results[key] = [(t,) + row for t, row in zip(timestamps, df[['symbol', 'open', 'high', 'low', 'close', 'volume']].itertuples(index=False, name=None))]
+        return self.results[key]
+
+    # ROLLUP_QUERY: view rows with bucket starts in [first, last), plus the minutes outside
+    # that span bucketed directly, in one symbol/time order
+    def rollup_query(self, first, last, symbols, bucket, start, end):
+        view = [row for row in self.query(bucket, pd.Timestamp.min, pd.Timestamp.max, symbols) if first <= row[0] < last]
+        ends = self.query(bucket, start, end, symbols, exclude=(first, last))
+        return sorted(view + ends, key=lambda row: (row[1], row[0]))
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.itersize = 2000
+        self.rows = []
+        self.position = 0
+
+    def mogrify(self, sql, params=None):
+        from psycopg2.extensions import adapt
+        if isinstance(sql, str):
+            sql = sql.encode()
+        if params is None:
+            return sql
+        return sql % tuple(adapt(value).getquoted() for value in params)
+
+    def execute(self, sql, params=None):
+        self.connection.statements += 1
+        if isinstance(sql, str) and sql.lstrip().startswith('SELECT') and params:
+            table = re.search(r'FROM (\w+)', sql).group(1)
+            if 'UNION ALL' in sql:
+                self.rows = self.connection.rollup_query(*params[:3], pd.Timedelta(params[3]), *params[4:6])
+                self.position = 0
+                return
+            if len(params) == 4:
+                bucket = params[0]
+            elif table != self.connection.table:
+                bucket = pd.Timedelta(table[len(self.connection.table) + 1:])
+            else:
+                bucket = None
+            self.rows = self.connection.query(bucket, *params[-3:])
+            self.position = 0
+        else:
+            self.mogrify(sql, params)
+
+    def copy_expert(self, sql, file, size=8192):
+        self.connection.statements += 1
+        while True:
+            chunk = file.read(size)
+            if not chunk:
+                break
+            self.connection.copied_bytes += len(chunk)
+
+    def fetchmany(self, size=None):
+        size = size or self.itersize
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows) - self.position)
+
+    def close(self):
+        pass
@@ -0,0 +1,159 @@
+import argparse
+import collections
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from backtest import BACKTEST_KWARGS, STRATEGY_GRIDS, VECTOR_SIGNALS, equity_stats, load_symbol_bars, minute_high_water, simulate_signals
+from bar_cache import BarCache
+from live_indicators import load_live_config
+
+# Walk-forward optimization: roll a train window and the test window that follows it over
+# the history, pick the best parameter set on each train window and report how it does
+# out of sample on the test window. Bars are loaded once per symbol and the indicator
+# signals of the whole grid are built once over the full span with the vectorized engine;
+# every fold is a slice of those arrays, so adding folds only adds the (cheap) simulation.
+# Each fold starts flat with BACKTEST_KWARGS['cash'].
+
+# Live engine strategy names (STRATEGY_PARAMS 'strategy') of the backtest strategies
+LIVE_STRATEGY_NAMES = {'emadx': 'ema_adx', 'bollinger': 'bollinger_bands'}
+
+# Bar positions of one fold: train on [train_start, train_end), test on [train_end, test_end)
+Fold = collections.namedtuple('Fold', ['train_start', 'train_end', 'test_end'])
+
+# Folds over a bar index with train/test/step lengths as Timedelta strings (e.g. '60D').
+# step defaults to test, so the test windows tile the history after the first train
+# window; anchored=True grows every train window from the first bar instead of rolling.
+def walk_forward_folds(index, train='60D', test='20D', step=None, anchored=False):
+    train, test = pd.Timedelta(train), pd.Timedelta(test)
+    step = pd.Timedelta(step) if step else test
+    folds = []
+    start = index[0]
+    while start + train <= index[-1]:
+        a = 0 if anchored else index.searchsorted(start)
+        b = index.searchsorted(start + train)
+        c = index.searchsorted(start + train + test)
+        if c > b and b > a:
+            folds.append(Fold(a, b, c))
+        start += step
+    return folds
+
+# Equity stats of every parameter set over bars [a, b), trading from the first bar whose
+# indicators are ready, with the signals computed over the full history
+def _evaluate(df, close, signals, starts, a, b, cash, commission):
+    local_starts = np.maximum(starts - a, 1)
+    equity = simulate_signals(df.iloc[a:b], signals[a:b], local_starts, cash, commission)
+    return equity_stats(equity, close[a:b], local_starts)
+
+# Walk one strategy forward over one symbol's bars. Returns a DataFrame with one row per
+# fold (windows, chosen params, in-sample return and out-of-sample stats) and the best
+# params on the latest train window, i.e. the ones to trade next.
+def walk_forward_symbol(df, name, folds, train='60D', grid=None, metric='Return [%]',
+                        cash=BACKTEST_KWARGS['cash'], commission=BACKTEST_KWARGS['commission']):
+    grid = grid or STRATEGY_GRIDS[name][1]
+    signals, starts = VECTOR_SIGNALS[name](df, grid)
+    close = df['Close'].to_numpy(np.float64)
+
+    rows = []
+    for a, b, c in folds:
+        in_sample = _evaluate(df, close, signals, starts, a, b, cash, commission)
+        k = int(np.argmax(in_sample[metric].to_numpy()))
+        out_of_sample = _evaluate(df, close, signals[:, k:k + 1], starts[k:k + 1], b, c, cash, commission).iloc[0]
+        rows.append({
+            'train_start': df.index[a],
+            'test_start': df.index[b],
+            'test_end': df.index[c - 1],
+            'params': grid[k],
+            'train_return': in_sample['Return [%]'].iat[k],
+            **{f"test_{key}": value for key, value in out_of_sample.items()}
+        })
+
+    latest = df.index.searchsorted(df.index[-1] - pd.Timedelta(train))
+    in_sample = _evaluate(df, close, signals, starts, latest, len(df), cash, commission)
+    return pd.DataFrame(rows), grid[int(np.argmax(in_sample[metric].to_numpy()))]
+
+# Walk every strategy forward over every symbol in frames ({symbol: bars}). Returns the
+# fold report of all (symbol, strategy) pairs and {(symbol, strategy): latest params}.
+# Symbols with no bars after their first train window get no folds and are left out of
+# both, so the report is empty if no symbol has a fold.
+def walk_forward(frames, strategies=('emadx', 'bollinger'), train='60D', test='20D', step=None, anchored=False):
+    reports = []
+    latest = {}
+    for symbol, df in frames.items():
+        folds = walk_forward_folds(df.index, train, test, step, anchored) if len(df) else []
+        if not folds:
+            continue
+        for name in strategies:
+            report, latest[(symbol, name)] = walk_forward_symbol(df, name, folds, train)
+            reports.append(report.assign(symbol=symbol, strategy=name))
+    report = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame()
+    return report, latest
+
+# Out-of-sample summary per (symbol, strategy): the test windows chained one after another
+def summarize(report):
+    grouped = report.groupby(['symbol', 'strategy'], sort=False)
+    return pd.DataFrame({
+        'folds': grouped.size(),
+        'oos_return': grouped['test_Return [%]'].apply(lambda r: (np.prod(1 + r / 100) - 1) * 100),
+        'mean_fold_return': grouped['test_Return [%]'].mean(),
+        'positive_folds': grouped['test_Return [%]'].apply(lambda r: (r > 0).mean()),
+        'worst_drawdown': grouped['test_Max. Drawdown [%]'].min(),
+        'buy_hold_return': grouped['test_Buy & Hold Return [%]'].apply(lambda r: (np.prod(1 + r / 100) - 1) * 100)
+    })
+
+# Per symbol, the strategy with the best chained out-of-sample return and its params on
+# the latest train window, as live STRATEGY_PARAMS entries
+def choose_live_params(summary, latest):
+    strategies = {}
+    for symbol, rows in summary.groupby(level='symbol', sort=False):
+        name = rows['oos_return'].idxmax()[1]
+        strategies[symbol] = {'strategy': LIVE_STRATEGY_NAMES[name], **latest[(symbol, name)]}
+    return strategies
+
+# Write strategies in the live engines' config format (live_indicators.load_live_config);
+# the "risk" section of an existing file at path is kept. Refuses to write no strategies,
+# which would leave the live engines with nothing to trade.
+def export_live_config(strategies, path):
+    if not strategies:
+        raise ValueError(f"No strategies to export, {path} left unchanged")
+    risk = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            risk = json.load(f).get('risk', {})
+    with open(path, 'w') as f:
+        json.dump({'strategies': strategies, 'risk': risk}, f, indent=4)
+    return load_live_config(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Walk-forward optimization with export of the live parameters')
+    parser.add_argument('--symbols', nargs='+', default=['MCD', 'PEP', 'KO'])
+    parser.add_argument('--start', default='2023-05-15')
+    parser.add_argument('--end', default='2023-08-23')
+    parser.add_argument('--train', default='30D', help='train window, e.g. 30D')
+    parser.add_argument('--test', default='10D', help='test window following each train window')
+    parser.add_argument('--step', help='shift between folds (default: the test window)')
+    parser.add_argument('--anchored', action='store_true', help='grow train windows from the start instead of rolling')
+    parser.add_argument('--export', help='write the chosen live parameters to this config file, e.g. strategy_params.json')
+    args = parser.parse_args()
+
+    cache = BarCache(high_water=minute_high_water)
+    frames = {symbol: cache.load_frame(symbol, '15min', args.start, args.end, load_symbol_bars) for symbol in args.symbols}
+    report, latest = walk_forward(frames, train=args.train, test=args.test, step=args.step, anchored=args.anchored)
+    if report.empty:
+        print(f"No folds: no symbol has bars after its first {args.train} train window, nothing to report or export")
+        sys.exit(1)
+    skipped = [symbol for symbol in args.symbols if symbol not in set(report['symbol'])]
+    if skipped:
+        print(f"Skipped, no bars after the first {args.train} train window: {', '.join(skipped)}")
+
+    columns = ['symbol', 'strategy', 'test_start', 'test_end', 'params', 'train_return', 'test_Return [%]', 'test_Max. Drawdown [%]']
+    print(report[columns].to_string(index=False))
+    summary = summarize(report)
+    print(f"\nOut-of-sample summary:\n{summary.to_string()}")
+
+    strategies = choose_live_params(summary, latest)
+    print(f"\nLive parameters: {json.dumps(strategies, indent=4)}")
+    if args.export:
+        export_live_config(strategies, args.export)
+        print(f"Exported to {args.export}")